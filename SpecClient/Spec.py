@@ -11,6 +11,7 @@ import SpecConnectionsManager
 import SpecEventsDispatcher
 import SpecCommand
 import SpecWaitObject
+from .SpecQueryCache import idempotent
 
 class Spec:
     """Spec objects provide remote Spec facilities to the connected client."""
@@ -27,6 +28,7 @@ class Spec:
         timeout -- optional connection timeout (defaults to None)
         """
         self.connection = None
+        self.__commands = {} # SpecCommand objects returned by __getattr__, { command name: SpecCommand object, ... }
 
         if specVersion is not None:
             self.connectToSpec(specVersion, timeout = timeout)
@@ -45,6 +47,7 @@ class Spec:
         timeout -- optional connection timeout (defaults to None)
         """
         self.__specVersion = specVersion
+        self.__commands = {}
 
         self.connection = SpecConnectionsManager.SpecConnectionsManager().getConnection(specVersion)
 
@@ -56,8 +59,30 @@ class Spec:
         if attr.startswith('__'):
             raise AttributeError
 
-        return SpecCommand.SpecCommand(attr, self.connection)
+        if self.connection is None:
+            return SpecCommand.SpecCommand(attr, self.connection)
+
+        # not self.__commands: __getattr__ would be called if it is not set yet
+        commands = self.__dict__.setdefault('_Spec__commands', {})
+        try:
+            return commands[attr]
+        except KeyError:
+            command = SpecCommand.SpecCommand(attr, self.connection)
+            commands[attr] = command
+            return command
+
+    def batch(self):
+        """Return a SpecCommandBatch object, to execute several function calls in one exchange
+
+        Example:
+        b = spec.batch()
+        b.add('motor_par', 'phi', 'step_size')
+        b.add('counter_par', 0, 'disable')
+        step_size, disabled = b.execute()
+        """
+        return SpecCommand.SpecCommandBatch(self.connection)
 
+    @idempotent
     def _getMotorsMneNames(self):
         """Return motors mnemonics and names list."""
         if self.connection is not None and self.connection.isSpecConnected():
@@ -86,6 +111,7 @@ class Spec:
            motorNamesList.append(motor_dict["name"])
        return motorNamesList
 
+    @idempotent
     def _getCountersMneNames(self):
         """Return counters mnemonics and names list."""
         if self.connection is not None and self.connection.isSpecConnected():
@@ -0,0 +1,156 @@
+"""SpecArgumentStager module
+
+This module defines the SpecArgumentStager class, which sends the bulky
+arguments of Spec function calls (numpy arrays, big dictionaries) as
+binary channel writes instead of text.
+
+Arguments of a call are normally converted with repr, and parsed back by
+Spec ; this does not work for numpy arrays, and is slow for big
+dictionaries. Staged arguments are written to the _SC_ARG<n> Spec globals
+(<n> being the position of the argument) through 'var/' channels, as
+SpecArray or associative array data, and the call refers to the globals.
+
+Each connection has its own SpecArgumentStager object ; array globals
+are declared once for a given type and shape, until Spec gets
+disconnected or answers the handshake (it may have been restarted).
+"""
+
+__author__ = 'Matias Guijarro'
+__version__ = '1.0'
+
+import gevent.lock
+import SpecArray
+import SpecAssocArray
+from .SpecClientError import SpecClientError
+
+try:
+    import numpy
+except:
+    numpy = None
+
+ARGUMENT_VARIABLE = '_SC_ARG%d'
+DICT_STAGING_SIZE = 64 # dictionaries with more items are staged
+
+SPEC_ARRAY_TYPES = { SpecArray.ARRAY_CHAR: 'byte',
+                     SpecArray.ARRAY_UCHAR: 'ubyte',
+                     SpecArray.ARRAY_SHORT: 'short',
+                     SpecArray.ARRAY_USHORT: 'ushort',
+                     SpecArray.ARRAY_LONG: 'long',
+                     SpecArray.ARRAY_ULONG: 'ulong',
+                     SpecArray.ARRAY_FLOAT: 'float',
+                     SpecArray.ARRAY_DOUBLE: 'double' }
+
+
+class SpecVariableReference:
+    """Argument standing for a Spec variable in a command (its repr is the variable name)"""
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class SpecArgumentStager:
+    """SpecArgumentStager class
+
+    Stage call arguments into Spec globals ; the 'lock' must be held from
+    staging until the reply of the call arrives, since the globals are
+    shared by all the calls.
+    """
+    def __init__(self):
+        """Constructor."""
+        self.lock = gevent.lock.RLock()
+        self.declared = {} # { variable name: (array type, rows, cols), ... }
+        self.dictSize = DICT_STAGING_SIZE
+        self.stagedArguments = 0
+
+
+    def reset(self):
+        """Forget the declared globals (i.e. when Spec gets disconnected)"""
+        self.declared.clear()
+
+
+    def isStaged(self, arg):
+        """Return True if arg has to be staged"""
+        if numpy is not None and isinstance(arg, numpy.ndarray):
+            return arg.ndim > 0
+        return SpecAssocArray.isAssoc(arg) and len(arg) > self.dictSize
+
+
+    def needsStaging(self, args):
+        for arg in args:
+            if self.isStaged(arg):
+                return True
+        return False
+
+
+    def stage(self, connection, args):
+        """Write the arguments to stage to Spec, and return the arguments to use in the call
+
+        Arguments:
+        connection -- a SpecConnection object
+        args -- the call arguments
+        """
+        declarations = []
+        writes = []
+        newArgs = list(args)
+
+        for i, arg in enumerate(args):
+            if not self.isStaged(arg):
+                continue
+
+            name = ARGUMENT_VARIABLE % i
+
+            if SpecAssocArray.isAssoc(arg):
+                # keys of a previous call must not remain
+                self.declared.pop(name, None)
+                declarations.append('unglobal %s; global %s[]' % (name, name))
+                if isinstance(arg, SpecAssocArray.SpecAssocArray):
+                    arg = arg.toDict()
+                writes.append((name, arg))
+            else:
+                data = self.arrayData(arg)
+                rows, cols = data.shape
+                declaration = (data.type, rows, cols)
+
+                if self.declared.get(name) != declaration:
+                    if rows == 1:
+                        dims = '[%d]' % cols
+                    else:
+                        dims = '[%d][%d]' % (rows, cols)
+                    declarations.append('unglobal %s; global %s array %s%s' % (name, SPEC_ARRAY_TYPES[data.type], name, dims))
+                    self.declared[name] = declaration
+                writes.append((name, data))
+
+            newArgs[i] = SpecVariableReference(name)
+
+        if len(declarations) > 0:
+            reply = connection.send_msg_cmd_with_return('; '.join(declarations))
+            try:
+                reply.wait()
+            except:
+                connection.registeredReplies.pop(reply.id, None)
+                for name, value in writes:
+                    self.declared.pop(name, None)
+                raise
+
+        # not waiting: the writes go out with the call, in order
+        for name, value in writes:
+            connection.send_msg_chan_send('var/%s' % name, value)
+            self.stagedArguments += 1
+
+        return newArgs
+
+
+    def arrayData(self, array):
+        """Return the SpecArrayData object to write for a numpy array"""
+        if array.ndim > 2:
+            raise SpecClientError("Spec arrays cannot have more than 2 dimensions")
+
+        if array.dtype.type not in SpecArray.NUM_TO_SPEC:
+            if array.dtype.kind in 'iub':
+                array = array.astype(numpy.int32)
+            else:
+                array = array.astype(numpy.float64)
+
+        return SpecArray.SpecArray(numpy.ascontiguousarray(array))
@@ -132,6 +132,10 @@ def SpecArray(data, datatype = ARRAY_CHAR, rows = 0, cols = 0):
                 raise SpecArrayError, 'Invalid Spec array type'
             else:
                 if numpy:
+                    size = rows * cols * numpy.dtype(numtype).itemsize
+                    if size > 0:
+                        # arrays sent by SpecClient end with a NULL byte
+                        data = data[:size]
                     newArray = numpy.fromstring(data, dtype=numtype)
                 else:
                     newArray = Numeric.fromstring(data, numtype)
@@ -0,0 +1,320 @@
+"""SpecAssocArray module
+
+This module defines the SpecAssocArray class, the read-only mapping
+holding the value of channels bound to Spec associative arrays.
+
+SpecAssocArray objects are immutable : updating one returns a new object
+sharing all the unchanged parts with the old one (hash array mapped trie),
+so an update costs O(number of changed keys) whatever the size of the
+associative array, and values can be handed out to receivers without
+copying them.
+"""
+
+__author__ = 'Matias Guijarro'
+__version__ = '1.0'
+
+import collections
+import types
+
+(SHIFT, WIDTH) = (5, 32)
+MASK = WIDTH - 1
+EMPTY_NODE = (None, ) * WIDTH
+
+
+class _Leaf(object):
+    __slots__ = ('hash', 'key', 'value')
+
+    def __init__(self, h, key, value):
+        self.hash = h
+        self.key = key
+        self.value = value
+
+
+class _Bucket(object):
+    """Keys with the same hash value"""
+    __slots__ = ('hash', 'items')
+
+    def __init__(self, h, items):
+        self.hash = h
+        self.items = items
+
+
+def _hash(key):
+    return hash(key) & 0xFFFFFFFFFFFFFFFF
+
+
+def _build(leaves, shift):
+    groups = {}
+    for leaf in leaves:
+        groups.setdefault((leaf.hash >> shift) & MASK, []).append(leaf)
+
+    node = [None] * WIDTH
+    for i, group in groups.iteritems():
+        if len(group) == 1:
+            node[i] = group[0]
+        elif len(set([leaf.hash for leaf in group])) == 1:
+            node[i] = _Bucket(group[0].hash, tuple([(leaf.key, leaf.value) for leaf in group]))
+        else:
+            node[i] = _build(group, shift + SHIFT)
+
+    return tuple(node)
+
+
+def _assoc(node, shift, h, key, value):
+    """Return (new node, key was added) for node with key set to value"""
+    i = (h >> shift) & MASK
+    entry = node[i]
+    added = False
+
+    if entry is None:
+        new = _Leaf(h, key, value)
+        added = True
+    elif entry.__class__ is tuple:
+        new, added = _assoc(entry, shift + SHIFT, h, key, value)
+        if new is entry:
+            return node, False
+    elif entry.__class__ is _Leaf:
+        if entry.hash == h and entry.key == key:
+            if entry.value is value:
+                return node, False
+            new = _Leaf(h, key, value)
+        elif entry.hash == h:
+            new = _Bucket(h, ((entry.key, entry.value), (key, value)))
+            added = True
+        else:
+            new = _build([entry, _Leaf(h, key, value)], shift + SHIFT)
+            added = True
+    else:
+        if entry.hash == h:
+            items = list(entry.items)
+            for j, (k, v) in enumerate(items):
+                if k == key:
+                    if v is value:
+                        return node, False
+                    items[j] = (key, value)
+                    break
+            else:
+                items.append((key, value))
+                added = True
+            new = _Bucket(h, tuple(items))
+        else:
+            child = list(EMPTY_NODE)
+            child[(entry.hash >> (shift + SHIFT)) & MASK] = entry
+            new, added = _assoc(tuple(child), shift + SHIFT, h, key, value)
+
+    node = list(node)
+    node[i] = new
+    return tuple(node), added
+
+
+def _dissoc(node, shift, h, key):
+    """Return (new node or None if empty, key was removed) for node without key"""
+    i = (h >> shift) & MASK
+    entry = node[i]
+
+    if entry is None:
+        return node, False
+    elif entry.__class__ is tuple:
+        new, removed = _dissoc(entry, shift + SHIFT, h, key)
+        if not removed:
+            return node, False
+    elif entry.__class__ is _Leaf:
+        if entry.hash != h or entry.key != key:
+            return node, False
+        new = None
+    else:
+        if entry.hash != h:
+            return node, False
+        items = tuple([(k, v) for k, v in entry.items if k != key])
+        if len(items) == len(entry.items):
+            return node, False
+        if len(items) == 1:
+            new = _Leaf(h, items[0][0], items[0][1])
+        else:
+            new = _Bucket(h, items)
+
+    node = list(node)
+    node[i] = new
+    if node == list(EMPTY_NODE):
+        return None, True
+    return tuple(node), True
+
+
+def _iteritems(node):
+    for entry in node:
+        if entry is None:
+            continue
+        elif entry.__class__ is tuple:
+            for item in _iteritems(entry):
+                yield item
+        elif entry.__class__ is _Leaf:
+            yield (entry.key, entry.value)
+        else:
+            for item in entry.items:
+                yield item
+
+
+def isAssoc(data):
+    """Return True if data is a dictionary or a SpecAssocArray object"""
+    return type(data) == types.DictType or isinstance(data, SpecAssocArray)
+
+
+class SpecAssocArray(collections.Mapping):
+    """SpecAssocArray class
+
+    Immutable, dictionary-like representation of a Spec associative array.
+    Nested dictionaries (2-dimensions associative arrays) are converted to
+    SpecAssocArray objects too.
+    """
+    __slots__ = ('_root', '_len')
+
+    def __init__(self, data = None):
+        """Constructor
+
+        Keyword arguments:
+        data -- dictionary (or any mapping) with the initial contents
+        """
+        self._root = EMPTY_NODE
+        self._len = 0
+
+        if data:
+            leaves = [_Leaf(_hash(key), key, _frozen(value)) for key, value in data.iteritems()]
+            self._root = _build(leaves, 0)
+            self._len = len(leaves)
+
+
+    def __getitem__(self, key):
+        h = _hash(key)
+        node = self._root
+        shift = 0
+
+        while True:
+            entry = node[(h >> shift) & MASK]
+            if entry is None:
+                break
+            elif entry.__class__ is tuple:
+                node = entry
+                shift += SHIFT
+            elif entry.__class__ is _Leaf:
+                if entry.hash == h and entry.key == key:
+                    return entry.value
+                break
+            else:
+                if entry.hash == h:
+                    for k, v in entry.items:
+                        if k == key:
+                            return v
+                break
+
+        raise KeyError(key)
+
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        else:
+            return True
+
+
+    def has_key(self, key):
+        return key in self
+
+
+    def __iter__(self):
+        for key, value in _iteritems(self._root):
+            yield key
+
+
+    def iteritems(self):
+        return _iteritems(self._root)
+
+
+    def itervalues(self):
+        for key, value in _iteritems(self._root):
+            yield value
+
+
+    def items(self):
+        return list(_iteritems(self._root))
+
+
+    def values(self):
+        return list(self.itervalues())
+
+
+    def __len__(self):
+        return self._len
+
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if isinstance(other, SpecAssocArray) and other._len != self._len:
+            return False
+        return collections.Mapping.__eq__(self, other)
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.iteritems()))
+
+
+    def copy(self):
+        """Return a (shallow) copy of the associative array as a mutable dictionary"""
+        return dict(self.iteritems())
+
+
+    def toDict(self):
+        """Return the associative array as a dictionary, including nested associative arrays"""
+        data = {}
+        for key, value in self.iteritems():
+            if isinstance(value, SpecAssocArray):
+                value = value.toDict()
+            data[key] = value
+        return data
+
+
+    def merged(self, changes = None, deletions = ()):
+        """Return a new SpecAssocArray object with changes applied
+
+        The returned object shares its unchanged parts with this one ; if
+        nothing changes, the object itself is returned.
+
+        Keyword arguments:
+        changes -- dictionary of { key: new value, ... } (defaults to None)
+        deletions -- sequence of keys to remove (defaults to empty)
+        """
+        root = self._root
+        length = self._len
+
+        if changes:
+            for key, value in changes.iteritems():
+                root, added = _assoc(root, 0, _hash(key), key, _frozen(value))
+                if added:
+                    length += 1
+
+        for key in deletions:
+            root, removed = _dissoc(root, 0, _hash(key), key)
+            if root is None:
+                root = EMPTY_NODE
+            if removed:
+                length -= 1
+
+        if root is self._root:
+            return self
+
+        new = SpecAssocArray.__new__(SpecAssocArray)
+        new._root = root
+        new._len = length
+        return new
+
+
+def _frozen(value):
+    if type(value) == types.DictType:
+        return SpecAssocArray(value)
+    return value
@@ -8,16 +8,216 @@ __author__ = 'Matias Guijarro'
 __version__ = '1.0'
 
 import SpecEventsDispatcher
-import SpecWaitObject
-from .SpecClientError import SpecClientTimeoutError
+import SpecAssocArray
+import SpecChannelHistory
+from .SpecClientError import SpecClientTimeoutError, SpecClientNotConnectedError
 import time
 import gevent
 import weakref
 import types
 import logging
+import collections
 
 (DOREG, DONTREG, WAITREG) = (0, 1, 2)
 
+
+def coerceValue(value):
+    """Return value as an int or a float if possible, unchanged otherwise"""
+    try:
+        value = int(value)
+    except:
+        try:
+            value = float(value)
+        except:
+            pass
+    return value
+
+
+class SpecChannelCache:
+    """SpecChannelCache class
+
+    Bounded (least recently used entries are evicted first) cache of
+    channel values, with the time they were received
+    """
+    def __init__(self, maxSize = 1000):
+        """Constructor
+
+        Keyword arguments:
+        maxSize -- maximum number of cached channel values (defaults to 1000)
+        """
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict() # { channel name: (value, timestamp), ... }
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, chanName, maxAge):
+        """Return the cached value of a channel, or None if not cached or older than maxAge seconds"""
+        try:
+            value, timestamp = self.entries.pop(chanName)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.entries[chanName] = (value, timestamp)
+
+        if time.time() - timestamp > maxAge:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+
+    def set(self, chanName, value):
+        """Store a channel value ; a None value removes the channel from the cache"""
+        self.entries.pop(chanName, None)
+
+        if value is not None:
+            self.entries[chanName] = (value, time.time())
+
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last = False)
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SpecChannelPattern:
+    """SpecChannelPattern class
+
+    Subscription to all the channels matching a pattern
+
+    Signals:
+    valueChanged(channelName, channelValue) -- emitted when a channel matching the pattern gets updated
+    """
+    def __init__(self, pattern):
+        """Constructor
+
+        Arguments:
+        pattern -- channel name pattern, '*' matches one segment of the channel name
+        (i.e. 'motor/*/position') and a trailing '**' matches the rest of the name
+        (i.e. 'var/**')
+        """
+        self.pattern = pattern
+        self.segments = tuple(pattern.split('/'))
+        self.channels = [] # names of the channels registered for the pattern
+
+        if '**' in self.segments[:-1]:
+            raise ValueError("'**' can only be the last segment of a channel pattern")
+
+
+    def expand(self, names):
+        """Return the channel names obtained by replacing the wildcards by names
+
+        Arguments:
+        names -- sequence of strings (one per channel name) if the pattern has a single
+        wildcard, or of tuples with one string per wildcard
+        """
+        wildcards = [i for i, segment in enumerate(self.segments) if segment in ('*', '**')]
+        channels = []
+
+        for name in names:
+            if type(name) != types.TupleType:
+                name = (name, )
+            segments = list(self.segments)
+            for i, segment in zip(wildcards, name):
+                segments[i] = str(segment)
+            channels.append('/'.join(segments))
+
+        return channels
+
+
+class _PatternNode(object):
+    __slots__ = ('children', 'patterns')
+
+    def __init__(self):
+        self.children = {}
+        self.patterns = []
+
+
+class SpecChannelPatternIndex:
+    """SpecChannelPatternIndex class
+
+    Trie of channel patterns, indexed by channel name segments ; the
+    patterns matching a channel name are cached until the set of
+    patterns changes, so matching an update costs a dictionary lookup
+    """
+    def __init__(self):
+        self.root = _PatternNode()
+        self.patterns = {} # { pattern string: SpecChannelPattern object, ... }
+        self.matches = {}  # { channel name: (SpecChannelPattern object, ...), ... }
+
+
+    def __len__(self):
+        return len(self.patterns)
+
+
+    def add(self, pattern):
+        """Return the SpecChannelPattern object for pattern, adding it to the index if needed"""
+        try:
+            return self.patterns[pattern]
+        except KeyError:
+            patternObj = SpecChannelPattern(pattern)
+
+            node = self.root
+            for segment in patternObj.segments:
+                node = node.children.setdefault(segment, _PatternNode())
+            node.patterns.append(patternObj)
+
+            self.patterns[pattern] = patternObj
+            self.matches.clear()
+            return patternObj
+
+
+    def remove(self, pattern):
+        try:
+            patternObj = self.patterns.pop(pattern)
+        except KeyError:
+            return
+
+        node = self.root
+        for segment in patternObj.segments:
+            node = node.children[segment]
+        node.patterns.remove(patternObj)
+        self.matches.clear()
+
+
+    def match(self, chanName):
+        """Return the SpecChannelPattern objects matching a channel name"""
+        try:
+            return self.matches[chanName]
+        except KeyError:
+            result = []
+            self._match(self.root, chanName.split('/'), 0, result)
+            result = tuple(result)
+            self.matches[chanName] = result
+            return result
+
+
+    def _match(self, node, segments, i, result):
+        if i == len(segments):
+            result.extend(node.patterns)
+            return
+
+        child = node.children.get('**')
+        if child is not None:
+            result.extend(child.patterns)
+        child = node.children.get(segments[i])
+        if child is not None:
+            self._match(child, segments, i + 1, result)
+        child = node.children.get('*')
+        if child is not None:
+            self._match(child, segments, i + 1, result)
+
+
+    def dispatch(self, chanName, value):
+        """Emit the 'valueChanged' signal of the patterns matching a channel name"""
+        for patternObj in self.match(chanName):
+            SpecEventsDispatcher.emit(patternObj, 'valueChanged', (chanName, value, ))
+
+
 class SpecChannel:
     """SpecChannel class
 
@@ -25,6 +225,13 @@ class SpecChannel:
 
     Signals:
     valueChanged(channelValue, channelName) -- emitted when the channel gets updated
+    valueDelta(channelValue, changedKeys, deletedKeys, channelName) -- emitted when the
+    channel gets updated ; for associative arrays, changedKeys and deletedKeys are the
+    sets of top-level keys changed and deleted by the update, for other values (or when
+    the whole value is replaced) they are None
+    valueChanged(absolute, relative)(channelValue, channelName) -- emitted when the
+    channel value moved away from the last value emitted by this signal by more than
+    the deadband (see deadbandSignal)
     """
     def __init__(self, connection, channelName, registrationFlag = DOREG):
         """Constructor
@@ -60,6 +267,10 @@ class SpecChannel:
         self.isdisconnected = True
         self.registered = False
         self.value = None
+        self.serverTime = None
+        self.history = None
+        self.deadbands = {}
+        self.waiters = [] # SpecWaitObject.ChannelWaiter objects
 
         SpecEventsDispatcher.connect(connection, 'connected', self.connected)
         SpecEventsDispatcher.connect(connection, 'disconnected', self.disconnected)
@@ -91,6 +302,12 @@ class SpecChannel:
         self.isdisconnected = True
         self.registered = False
 
+        for state in self.deadbands.itervalues():
+            state[1] = None
+
+        for waiter in self.waiters:
+            waiter.abort(SpecClientNotConnectedError("Spec got disconnected while waiting for channel %s" % self.name))
+
 
     def unregister(self):
         """Unregister channel."""
@@ -118,88 +335,179 @@ class SpecChannel:
             self.registered = True
 
 
-    def _coerce(self, value):
+    def deadbandSignal(self, absolute = None, relative = None):
+        """Return the name of the signal filtered by a deadband
+
+        The signal is emitted like 'valueChanged', except for numeric values
+        that moved by less than the deadband since the last emission of
+        this signal. Forced updates (initial value when a receiver is
+        connected) and None values are always emitted.
+
+        Keyword arguments:
+        absolute -- absolute deadband (defaults to None)
+        relative -- deadband relative to the last emitted value (defaults to None)
+        """
+        key = (float(absolute or 0), float(relative or 0))
+
         try:
-            value = int(value)
-        except:
+            return self.deadbands[key][0]
+        except KeyError:
+            signal = 'valueChanged%r' % (key, )
+            self.deadbands[key] = [signal, None]
+            return signal
+
+
+    def enableHistory(self, size = 1024):
+        """Start keeping the history of the channel values
+
+        Only numeric values are recorded. Return the SpecChannelHistory object,
+        also available as the 'history' attribute.
+
+        Keyword arguments:
+        size -- maximum number of values kept (defaults to 1024)
+        """
+        if self.history is None or self.history.size != size:
+            self.history = SpecChannelHistory.SpecChannelHistory(size)
+        return self.history
+
+
+    def disableHistory(self):
+        self.history = None
+
+
+    def _emit(self, value, changedKeys = None, deletedKeys = None, force = False):
+        connection = self.connection()
+        if connection is not None:
+            connection.channelCache.set(self.name, value)
+            patterns = connection.channelPatterns
+        else:
+            patterns = None
+
+        if self.history is not None and value is not None:
             try:
-                value = float(value)
-            except:
+                self.history.append(float(value), self.serverTime)
+            except (TypeError, ValueError):
                 pass
-        return value
 
-    def update(self, channelValue, deleted = False,force=False):
-        """Update channel's value and emit the 'valueChanged' signal."""
-        if type(channelValue) == types.DictType and self.access1 is not None:
+        SpecEventsDispatcher.emit(self, 'valueChanged', (value, self.name, ))
+        SpecEventsDispatcher.emit(self, 'valueDelta', (value, changedKeys, deletedKeys, self.name, ))
+
+        for (absolute, relative), state in self.deadbands.iteritems():
+            signal, last = state
+            if not force and value is not None and last is not None:
+                try:
+                    if abs(value - last) <= max(absolute, relative * abs(last)):
+                        continue
+                except (TypeError, ValueError):
+                    pass
+            state[1] = value
+            SpecEventsDispatcher.emit(self, signal, (value, self.name, ))
+
+        if patterns:
+            patterns.dispatch(self.name, value)
+
+        for waiter in self.waiters:
+            waiter.check(self.name, value)
+
+
+    def update(self, channelValue, deleted = False, force = False, serverTime = None):
+        """Update channel's value and emit the 'valueChanged' signal.
+
+        serverTime is the time stamp of the event message from Spec, if any
+        """
+        self.serverTime = serverTime
+
+        if SpecAssocArray.isAssoc(channelValue) and self.access1 is not None:
             if self.access1 in channelValue:
                 if deleted:
-                    SpecEventsDispatcher.emit(self, 'valueChanged', (None, self.name, ))
+                    if self.access2 is None or not SpecAssocArray.isAssoc(channelValue[self.access1]) or self.access2 in channelValue[self.access1]:
+                        self.value = None
+                        self._emit(None)
                 else:
                     if self.access2 is None:
                         if force or self.value is None or self.value != channelValue[self.access1]: 
-                            if type(channelValue[self.access1])==types.DictType:
-                                self.value = channelValue[self.access1].copy()
+                            if isinstance(channelValue[self.access1], SpecAssocArray.SpecAssocArray):
+                                # already a trie, shared with the parent value
+                                self.value = channelValue[self.access1]
+                            elif SpecAssocArray.isAssoc(channelValue[self.access1]):
+                                self.value = SpecAssocArray.SpecAssocArray(channelValue[self.access1])
                             else:
-                                self.value = self._coerce(channelValue[self.access1])
-                            SpecEventsDispatcher.emit(self, 'valueChanged', (self.value, self.name, ))
+                                self.value = coerceValue(channelValue[self.access1])
+                            self._emit(self.value, force = force)
                     else:
-                        if self.access2 in channelValue[self.access1]:
-                            if deleted:
-                                SpecEventsDispatcher.emit(self, 'valueChanged', (None, self.name, ))
-                            else:
-                                if force or self.value is None or self.value != channelValue[self.access1][self.access2]:
-                                    self.value = self._coerce(channelValue[self.access1][self.access2])
-                                    SpecEventsDispatcher.emit(self, 'valueChanged', (self.value, self.name, ))
+                        if SpecAssocArray.isAssoc(channelValue[self.access1]) and self.access2 in channelValue[self.access1]:
+                            if force or self.value is None or self.value != channelValue[self.access1][self.access2]:
+                                self.value = coerceValue(channelValue[self.access1][self.access2])
+                                self._emit(self.value, force = force)
+                        elif self.value is not None:
+                            # the key is not in the parent value anymore
+                            self.value = None
+                            self._emit(None)
+            elif self.value is not None and not deleted:
+                # the key is not in the parent value anymore
+                self.value = None
+                self._emit(None)
             return
 
-        if type(self.value) == types.DictType and type(channelValue) == types.DictType:
-            # update dictionary
+        if isinstance(self.value, SpecAssocArray.SpecAssocArray) and type(channelValue) == types.DictType:
+            # update associative array: only the changed keys are
+            # copied, the rest is shared with the previous value
+            changes = {}
+            deletions = []
             if deleted:
                 for key,val in channelValue.iteritems():
                     if type(val) == types.DictType:
-                        for k in val:
-                            try:
-                                del self.value[key][k]
-                            except KeyError:
-                                pass
-                        if len(self.value[key])==1 and None in self.value[key]:
-                            self.value[key]=self.value[key][None]
+                        oldval = self.value.get(key)
+                        if isinstance(oldval, SpecAssocArray.SpecAssocArray):
+                            newval = oldval.merged(deletions = val.keys())
+                            if len(newval)==1 and None in newval:
+                                newval = newval[None]
+                            changes[key] = newval
                     else:
-                        try:
-                            del self.value[key]
-                        except KeyError:
-                            pass
+                        deletions.append(key)
             else:
                 for k1,v1 in channelValue.iteritems():
                     if type(v1)==types.DictType:
-                        try:
-                            self.value[k1].update(v1)
-                        except KeyError:
-                            self.value[k1]=v1
-                        except AttributeError:
-                            self.value[k1]={None: self.value[k1]}
-                            self.value[k1].update(v1)
+                        if not k1 in self.value:
+                            changes[k1]=v1
+                        elif isinstance(self.value[k1], SpecAssocArray.SpecAssocArray):
+                            changes[k1]=self.value[k1].merged(v1)
+                        else:
+                            newval = {None: self.value[k1]}
+                            newval.update(v1)
+                            changes[k1]=newval
                     else:
-                        if self.value.has_key(k1) and type(self.value[k1]) == types.DictType:
-                            self.value[k1][None] = v1
+                        if isinstance(self.value.get(k1), SpecAssocArray.SpecAssocArray):
+                            changes[k1]=self.value[k1].merged({None: v1})
                         else:
-                            self.value[k1] = v1
-            value2emit=self.value.copy()
+                            changes[k1]=v1
+            self.value = self.value.merged(changes, deletions)
+            changedKeys = frozenset(changes)
+            deletedKeys = frozenset(deletions)
         else:
             if deleted:
                 self.value = None
+            elif type(channelValue) == types.DictType:
+                self.value = SpecAssocArray.SpecAssocArray(channelValue)
             else:
                 self.value = channelValue
-            value2emit=self.value
+            changedKeys = None
+            deletedKeys = None
 
-        SpecEventsDispatcher.emit(self, 'valueChanged', (value2emit, self.name, ))
+        self._emit(self.value, changedKeys, deletedKeys, force)
 
 
-    def read(self, timeout=3, force_read=False):
+    def read(self, timeout=3, force_read=False, max_age=None):
         """Read the channel value
 
         If channel is registered, just return the internal value,
         else obtain the channel value and return it.
+
+        Keyword arguments:
+        timeout -- timeout in seconds for the reply from Spec (defaults to 3)
+        force_read -- if True, obtain the value from Spec even if channel is registered
+        max_age -- if not None, return the value cached by the connection if it has been
+        received less than max_age seconds ago instead of asking Spec
         """
         if not force_read and self.registered:
             if self.value is not None:
@@ -211,12 +519,22 @@ class SpecChannel:
         connection = self.connection()
 
         if connection is not None:
+            if max_age is not None:
+                value = connection.channelCache.get(self.name, max_age)
+                if value is not None:
+                    return value
+
             # make sure spec is connected, we give a short timeout
             # because it is supposed to be the case already
-            value = SpecWaitObject.waitReply(connection, 'send_msg_chan_read', (self.spec_chan_name, ), timeout=timeout)
+            value = connection.readChannel(self.spec_chan_name, timeout=timeout)
             if value is None:
                 raise RuntimeError("could not read channel %r" % self.spec_chan_name)
+            if not self.registered:
+                # no events for this channel: the value read replaces the
+                # previous one, keys deleted in Spec must not remain
+                self.value = None
             self.update(value)
+            connection.channelCache.set(self.name, self.value)
             return self.value
 
 
@@ -0,0 +1,120 @@
+"""SpecChannelHistory module
+
+This module defines the SpecChannelHistory class, a fixed size history
+of the numeric values taken by a channel.
+
+Samples are stored in a preallocated numpy array used as a ring buffer,
+so appending a sample does not allocate memory : it is cheap enough
+to follow channels updated at kHz rates.
+"""
+
+__author__ = 'Matias Guijarro'
+__version__ = '1.0'
+
+import time
+
+try:
+    import numpy
+except:
+    numpy = None
+
+from .SpecClientError import SpecClientError
+
+(SERVER_TIME, LOCAL_TIME, VALUE) = (0, 1, 2)
+
+
+class SpecChannelHistory:
+    """SpecChannelHistory class
+
+    Hold the last samples of a channel, each sample being a row of
+    (server time, local time, value). Server time is the time stamp of
+    the event message sent by Spec ; it is NaN for values obtained by
+    reading the channel.
+    """
+    def __init__(self, size = 1024):
+        """Constructor
+
+        Keyword arguments:
+        size -- maximum number of samples kept (defaults to 1024)
+        """
+        if numpy is None:
+            raise SpecClientError("numpy is required for channel history")
+
+        self.size = int(size)
+        self.data = numpy.empty((self.size, 3), numpy.float64)
+        self.count = 0
+
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+
+    def append(self, value, serverTime = None, localTime = None):
+        """Add a sample, overwriting the oldest one if the history is full
+
+        Arguments:
+        value -- channel value (a number)
+
+        Keyword arguments:
+        serverTime -- time stamp from Spec (defaults to None, stored as NaN)
+        localTime -- reception time (defaults to None, meaning now)
+        """
+        if serverTime is None:
+            serverTime = numpy.nan
+        if localTime is None:
+            localTime = time.time()
+
+        self.data[self.count % self.size] = (serverTime, localTime, value)
+        self.count += 1
+
+
+    def clear(self):
+        self.count = 0
+
+
+    def last(self, n = None):
+        """Return the n last samples (all samples if n is None)
+
+        The samples are returned as a new (n, 3) array, oldest first ;
+        columns are SERVER_TIME, LOCAL_TIME and VALUE.
+        """
+        length = len(self)
+        if n is None or n > length:
+            n = length
+
+        end = self.count % self.size
+        start = end - n
+        if start >= 0:
+            return self.data[start:end].copy()
+        return numpy.concatenate((self.data[start:], self.data[:end]))
+
+
+    def window(self, start = None, end = None, column = LOCAL_TIME):
+        """Return the samples time stamped within [start, end]
+
+        Keyword arguments:
+        start -- beginning of the window, in seconds since the epoch (defaults to None, no limit)
+        end -- end of the window, in seconds since the epoch (defaults to None, no limit)
+        column -- time stamp to use, SERVER_TIME or LOCAL_TIME (defaults to LOCAL_TIME)
+        """
+        samples = self.last()
+        if start is None and end is None:
+            return samples
+
+        times = samples[:, column]
+        mask = numpy.ones(len(samples), bool)
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times <= end
+        return samples[mask]
+
+
+    def since(self, seconds, column = LOCAL_TIME):
+        """Return the samples of the last given number of seconds"""
+        return self.window(time.time() - seconds, None, column)
+
+
+    def values(self, n = None):
+        """Return the n last values (all values if n is None)"""
+        return self.last(n)[:, VALUE]
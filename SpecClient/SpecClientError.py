@@ -23,3 +23,10 @@ class SpecClientNotConnectedError(SpecClientError):
 class SpecClientDispatcherError(SpecClientError):
     pass
 
+
+class SpecClientBatchError(SpecClientError):
+    def __init__(self, error = None, err = None, index = None, call = None):
+        SpecClientError.__init__(self, error, err)
+
+        self.index = index # index of the failed call in the batch, if known
+        self.call = call   # failed call string, if known
@@ -7,22 +7,27 @@ Classes:
 BaseSpecCommand
 SpecCommand
 SpecCommandA
+SpecCommandBatch
 """
 
 __author__ = 'Matias Guijarro'
 __version__ = '1.0'
 
 import sys
+import time
 import types
 import logging
+import collections
 import gevent
-from gevent.event import Event
 from .SpecConnection import SpecClientNotConnectedError
 from .SpecReply import SpecReply
 import SpecConnectionsManager
 import SpecEventsDispatcher
 import SpecWaitObject
-from .SpecClientError import SpecClientTimeoutError, SpecClientError
+import SpecCommandScheduler
+import SpecMessage
+import SpecChannel
+from .SpecClientError import SpecClientTimeoutError, SpecClientError, SpecClientBatchError
 
 
 class wrap_errors(object):
@@ -49,13 +54,157 @@ class wrap_errors(object):
         return getattr(self.func, item)
 
 
-def wait_end_of_spec_cmd(cmd_obj):
-   cmd_obj._reply_arrived_event.wait()
+#
+# commands tracing
+#
+TRACE_COMMAND_LENGTH = 200
+TRACE_ARGUMENT_LENGTH = 50
 
-   if cmd_obj._last_reply.error:
+tracing = False
+traces = collections.deque(maxlen = 1000)
+traceSinks = []
+slowCommandThreshold = None
+
+
+def setTracing(enabled = True, size = None):
+    """Enable or disable commands tracing
+
+    Each command executed by SpecCommandA objects gives a trace, which is
+    a dictionary with keys 'command' (truncated command string), 'specVersion',
+    'sendTime', 'replyTime' (None if aborted on timeout), 'duration',
+    'requestSize', 'replySize' (in bytes), 'error', 'errorCode' and 'timedOut'.
+    Traces are kept in the 'traces' ring and passed to the trace sinks.
+    Tracing is disabled by default ; the slow commands warning (see
+    setSlowCommandThreshold) does not need it.
+
+    Keyword arguments:
+    enabled -- True (default) to enable tracing
+    size -- if not None, new number of traces kept in the ring
+    """
+    global tracing, traces
+    tracing = enabled
+
+    if size is not None:
+        traces = collections.deque(traces, maxlen = size)
+
+
+def getTraces():
+    """Return the list of the last commands traces, oldest first"""
+    return list(traces)
+
+
+def addTraceSink(sink):
+    """Add a callable object, called with each command trace"""
+    if not sink in traceSinks:
+        traceSinks.append(sink)
+
+
+def removeTraceSink(sink):
+    try:
+        traceSinks.remove(sink)
+    except ValueError:
+        pass
+
+
+def setSlowCommandThreshold(threshold):
+    """Log a warning for commands taking more than threshold seconds (None to disable)"""
+    global slowCommandThreshold
+    slowCommandThreshold = threshold
+
+
+def _truncate(string, length):
+    if length is not None and len(string) > length:
+        return string[:length - 3] + '...'
+    return string
+
+
+def commandString(command, length = None, argumentLength = None):
+    """Return a command to send to Spec (string or list) as a string
+
+    Keyword arguments:
+    length -- if not None, maximum length of the string
+    argumentLength -- if not None, maximum length of each argument, truncated
+    before formatting the call
+    """
+    if type(command) in (types.StringType, types.UnicodeType):
+        return _truncate(command, length)
+    args = [_truncate(SpecMessage.argumentString(arg), argumentLength) for arg in command[1:]]
+    return _truncate('%s(%s)' % (command[0], ', '.join(args)), length)
+
+
+def _traceCommand(cmd_obj, command, reply, timedOut = False):
+    if not tracing and slowCommandThreshold is None:
+        return
+
+    command = commandString(command, TRACE_COMMAND_LENGTH, TRACE_ARGUMENT_LENGTH)
+
+    if reply.replyTime is None:
+        duration = time.time() - reply.sendTime
+    else:
+        duration = reply.replyTime - reply.sendTime
+
+    trace = { 'command': command,
+              'specVersion': cmd_obj.specVersion or str(cmd_obj.connection),
+              'sendTime': reply.sendTime,
+              'replyTime': reply.replyTime,
+              'duration': duration,
+              'requestSize': reply.requestSize,
+              'replySize': reply.replySize,
+              'error': bool(reply.error),
+              'errorCode': reply.error_code,
+              'timedOut': timedOut }
+
+    if tracing:
+        traces.append(trace)
+
+        for sink in traceSinks:
+            try:
+                sink(trace)
+            except:
+                logging.getLogger("SpecClient").exception("Error while calling command trace sink %s", sink)
+
+    if slowCommandThreshold is not None and duration > slowCommandThreshold:
+        logging.getLogger("SpecClient").warning("Slow command %s on %s: %.3f s%s", command, trace['specVersion'], duration, timedOut and ' (timed out)' or '')
+
+
+def wait_end_of_spec_cmd(cmd_obj, reply, command):
+   try:
+      reply.arrived.wait()
+   except gevent.GreenletExit:
+      # timed out or killed: the reply will never be waited for
+      cmd_obj._forgetReply(reply)
+      _traceCommand(cmd_obj, command, reply, timedOut = True)
+      raise
+   _traceCommand(cmd_obj, command, reply)
+
+   if reply.error:
       raise SpecClientError("command %r aborted from spec" % cmd_obj.command)
    else:
-      return cmd_obj._last_reply.data
+      return reply.data
+
+
+def run_scheduled_spec_cmd(cmd_obj, command, callbacks, scheduler, priority, source):
+   ticket = scheduler.acquire(priority, source)
+   try:
+      reply = cmd_obj._sendCommand(command, callbacks)
+      return wait_end_of_spec_cmd(cmd_obj, reply, command)
+   finally:
+      scheduler.release(ticket)
+
+
+def run_staged_spec_cmd(cmd_obj, args, callbacks, scheduler, priority, source):
+   # the arguments are staged in the turn of the command
+   if scheduler is not None:
+      ticket = scheduler.acquire(priority, source)
+   try:
+      stager = cmd_obj.connection.argumentStager
+      with stager.lock:
+         command = cmd_obj._buildCommand(stager.stage(cmd_obj.connection, args))
+         reply = cmd_obj._sendCommand(command, callbacks)
+         return wait_end_of_spec_cmd(cmd_obj, reply, command)
+   finally:
+      if scheduler is not None:
+         scheduler.release(ticket)
 
 
 class BaseSpecCommand:
@@ -118,28 +267,30 @@ class BaseSpecCommand:
         
         self.connection.connected_event.wait()
 
-        if self.connection.serverVersion < 3:
-            func = False
+        command = self._buildCommand(args, kwargs.get('function', False))
+
+        if kwargs.get("priority") is not None:
+            return self.executeCommand(command, kwargs.get("wait", False), kwargs.get("timeout"), priority = kwargs["priority"])
+        return self.executeCommand(command, kwargs.get("wait", False), kwargs.get("timeout"))
 
-            if 'function' in kwargs:
-                func = kwargs['function']
 
+    def _buildCommand(self, args, function = False):
+        """Return the command to send to Spec for a call with args"""
+        if self.connection.serverVersion < 3:
             #convert args list to string args list
             #it is much more convenient using .call('psvo', 12) than .call('psvo', '12')
             #a possible problem will be seen in Spec
-            args = map(repr, args)
+            args = map(SpecMessage.argumentString, args)
 
-            if func:
+            if function:
                 # macro function
-                command = self.command + '(' + ','.join(args) + ')'
+                return self.command + '(' + ','.join(args) + ')'
             else:
                 # macro
-                command = self.command + ' ' + ' '.join(args)
+                return self.command + ' ' + ' '.join(args)
         else:
             # Spec knows
-            command = [self.command] + list(args)
-
-        return self.executeCommand(command, kwargs.get("wait", False), kwargs.get("timeout"))
+            return [self.command] + list(args)
 
 
     def executeCommand(self, command, wait=False, timeout=None):
@@ -148,12 +299,24 @@ class BaseSpecCommand:
 
 class SpecCommandA(BaseSpecCommand):
     """SpecCommandA is the asynchronous version of SpecCommand.
-    It allows custom waiting by subclassing."""
+    It allows custom waiting by subclassing.
+
+    When the command scheduler of the connection is enabled, commands are
+    queued with the 'priority' of the object (SpecCommandScheduler.AUTOMATION
+    by default, can be given for a call with the 'priority' keyword argument),
+    and fairly with the other commands of the same 'source' (defaults to None,
+    meaning the calling greenlet).
+
+    numpy arrays and big dictionaries given as arguments are written to
+    Spec globals before the call, through binary channel writes (see
+    SpecArgumentStager), instead of being converted to text."""
     def __init__(self, *args, **kwargs):
-        self._reply_arrived_event = Event()
+        self.priority = SpecCommandScheduler.AUTOMATION
+        self.source = None
         self._last_reply = None
         self.__callback = None
         self.__error_callback = None
+        self.__replyCallbacks = {} # { reply id: (callback, error callback), ... }
         self.__callbacks = {
           'connected': None,
           'disconnected': None,
@@ -188,8 +351,6 @@ class SpecCommandA(BaseSpecCommand):
 
     def _connected(self):
         self.connection.registerChannel("status/ready", self._statusChanged)
- 
-        self.connection.send_msg_hello()        
 
         try:
             cb_ref = self.__callbacks.get("connected")
@@ -231,47 +392,158 @@ class SpecCommandA(BaseSpecCommand):
         pass
 
 
-    def executeCommand(self, command, wait=False, timeout=None):
-        self._reply_arrived_event.clear()
+    def _takeCallbacks(self):
+        """Return the (callback, error callback) set for the next call"""
+        callbacks = (self.__callback, self.__error_callback)
+        self.__callback = None
+        self.__error_callback = None
+        return callbacks
+
+
+    def _sendCommand(self, command, callbacks = None):
+        """Send a command to Spec, and return the SpecReply object for it
+
+        The reply is dispatched to replyArrived, with the callbacks set
+        for this call (or the given (callback, error callback) tuple).
+        """
+        if callbacks is None:
+            callbacks = self._takeCallbacks()
+
+        if self.connection.serverVersion < 3 or type(command) == types.StringType:
+            reply = self.connection.send_msg_cmd_with_return(command)
+        else:
+            reply = self.connection.send_msg_func_with_return(command)
+
+        reply.callback = self.replyArrived
+        if callbacks != (None, None):
+            self.__replyCallbacks[reply.id] = callbacks
+
+        return reply
+
+
+    def _forgetReply(self, reply):
+        """Stop waiting for a reply (i.e. after a timeout), so that neither the
+        connection nor this object keep it and its callbacks
+
+        Return True if the reply had not arrived yet
+        """
+        self.__replyCallbacks.pop(reply.id, None)
+        return self.connection.registeredReplies.pop(reply.id, None) is not None
+
+
+    def _commandSource(self):
+        if self.source is None:
+            return id(gevent.getcurrent())
+        return self.source
+
+
+    def executeCommand(self, command, wait=False, timeout=None, priority=None):
         self.beginWait()
 
         with gevent.Timeout(timeout, SpecClientTimeoutError):
-            waiter = SpecWaitObject.SpecWaitObject(self.connection)
-            waiter.waitConnection()
- 
-            if self.connection.serverVersion < 3:
-                id = self.connection.send_msg_cmd_with_return(command)
+            self.connection.connected_event.wait()
+
+            scheduler = self.connection.commandScheduler
+            if scheduler is None:
+                reply = self._sendCommand(command)
+
+                t = gevent.spawn(wrap_errors(wait_end_of_spec_cmd), self, reply, command)
             else:
-                if type(command) == types.StringType:
-                    id = self.connection.send_msg_cmd_with_return(command)
-                else:
-                    id = self.connection.send_msg_func_with_return(command)
+                if priority is None:
+                    priority = self.priority
+
+                t = gevent.spawn(wrap_errors(run_scheduled_spec_cmd), self, command, self._takeCallbacks(), scheduler, priority, self._commandSource())
 
-            t = gevent.spawn(wrap_errors(wait_end_of_spec_cmd), self)
+            return self._commandResult(t, wait)
 
-            if wait:
+
+    def _commandResult(self, t, wait):
+        """Return the result of the command greenlet t if wait is True, or t otherwise"""
+        if wait:
+            try:
                 ret = t.get()
-                if isinstance(ret, SpecClientError):
-                  raise ret
-                elif isinstance(ret, Exception):
-                  self.abort() #abort spec
-                  raise
-                else:
-                  return ret
+            except SpecClientTimeoutError:
+                t.kill()
+                raise
+            if isinstance(ret, SpecClientError):
+              raise ret
+            elif isinstance(ret, Exception):
+              self.abort() #abort spec
+              raise
             else:
-                t._get = t.get
-                def special_get(self, *args, **kwargs):
-                  ret = self._get(*args, **kwargs)
-                  if isinstance(ret, SpecClientError):
-                    raise ret
-                  elif isinstance(ret, Exception):
-                    self.abort() #abort spec
-                    raise
-                  else:
-                    return ret
-                setattr(t, "get", types.MethodType(special_get, t))
+              return ret
+        else:
+            t._get = t.get
+            def special_get(self, *args, **kwargs):
+              ret = self._get(*args, **kwargs)
+              if isinstance(ret, SpecClientError):
+                raise ret
+              elif isinstance(ret, Exception):
+                self.abort() #abort spec
+                raise
+              else:
+                return ret
+            setattr(t, "get", types.MethodType(special_get, t))
+
+            return t
+
+
+    def callMany(self, argsList, timeout=None, function=False, priority=None):
+        """Call the command once per arguments tuple, and return the list of results
+
+        All the requests are sent back to back before waiting for any reply,
+        so the calls cost about one round trip to Spec altogether instead of
+        one each ; each reply is matched to its call by its reply id.
+
+        Arguments:
+        argsList -- sequence of arguments tuples, one per call
+
+        Keyword arguments:
+        timeout -- optional timeout for all the calls (defaults to None)
+        function -- see BaseSpecCommand.__call__, for Spec servers older than v3
+        priority -- priority for the command scheduler (defaults to None, meaning the object priority) ;
+        the calls are scheduled together
+
+        Exceptions:
+        SpecClientError -- if one of the calls failed, for the first failed call
+        """
+        if self.connection is None:
+            raise SpecClientNotConnectedError
+
+        replies = []
+        commands = []
+
+        with gevent.Timeout(timeout, SpecClientTimeoutError):
+            self.connection.connected_event.wait()
+
+            scheduler = self.connection.commandScheduler
+            if scheduler is not None:
+                if priority is None:
+                    priority = self.priority
+                ticket = scheduler.acquire(priority, self._commandSource())
 
-                return t
+            try:
+                for args in argsList:
+                    commands.append(self._buildCommand(args, function))
+                    replies.append(self._sendCommand(commands[-1]))
+
+                for command, reply in zip(commands, replies):
+                    reply.arrived.wait()
+                    _traceCommand(self, command, reply)
+            except:
+                for command, reply in zip(commands, replies):
+                    if self._forgetReply(reply):
+                        _traceCommand(self, command, reply, timedOut = True)
+                raise
+            finally:
+                if scheduler is not None:
+                    scheduler.release(ticket)
+
+        for i, reply in enumerate(replies):
+            if reply.error:
+                raise SpecClientError("command %r aborted from spec (call %d: %s)" % (self.command, i, reply.data), reply.error_code)
+
+        return [reply.data for reply in replies]
 
 
     def _set_callbacks(self, callback, error_callback):
@@ -289,30 +561,58 @@ class SpecCommandA(BaseSpecCommand):
         callback = kwargs.get("callback", None)
         error_callback = kwargs.get("error_callback", None)
         self._set_callbacks(callback, error_callback)
+
+        if self.command is not None and self.connection is not None and self.connection.argumentStager.needsStaging(args):
+            return self._callStaged(args, kwargs.get("wait", False), kwargs.get("timeout"), kwargs.get("priority"))
+
         return BaseSpecCommand.__call__(self, *args, **kwargs)
 
 
+    def _callStaged(self, args, wait, timeout, priority):
+        """Call the command, writing the bulky arguments to Spec globals first (see SpecArgumentStager)
+
+        The staging globals are locked until the reply arrives ; with the
+        command scheduler, the arguments are staged in the turn of the
+        command. Spec servers older than v3 get the arguments as text.
+        """
+        callbacks = self._takeCallbacks()
+
+        with gevent.Timeout(timeout, SpecClientTimeoutError):
+            # the server version is known once connected
+            self.connection.connected_event.wait()
+
+            if self.connection.serverVersion < 3:
+                self.__callback, self.__error_callback = callbacks
+                return self.executeCommand(self._buildCommand(args), wait, priority = priority)
+
+            self.beginWait()
+
+            if priority is None:
+                priority = self.priority
+
+            t = gevent.spawn(wrap_errors(run_staged_spec_cmd), self, args, callbacks, self.connection.commandScheduler, priority, self._commandSource())
+
+            return self._commandResult(t, wait)
+
+
     def replyArrived(self, reply):
         self._last_reply = reply
+        callback_ref, error_callback_ref = self.__replyCallbacks.pop(reply.id, (None, None))
 
         if reply.error:
-            if callable(self.__error_callback):
-                error_callback = self.__error_callback()
+            if callable(error_callback_ref):
+                error_callback = error_callback_ref()
                 try:
                     error_callback(reply.error)
                 except:
                     logging.getLogger("SpecClient").exception("Error while calling error callback (command=%s,spec version=%s)", self.command, self.specVersion)
-                self.__error_callback = None
         else:
-            if callable(self.__callback):
-                callback = self.__callback()
+            if callable(callback_ref):
+                callback = callback_ref()
                 try:
                     callback(reply.data)
                 except:
                     logging.getLogger("SpecClient").exception("Error while calling reply callback (command=%s,spec version=%s)", self.command, self.specVersion)
-                self.__callback = None
-
-        self._reply_arrived_event.set()
 
 
     def beginWait(self):
@@ -350,13 +650,116 @@ class SpecCommand(SpecCommandA):
 
         wait = kwargs.get("wait", True)
         timeout = kwargs.get("timeout", None)
-        return SpecCommandA.__call__(self, *args, wait=wait, timeout=timeout)
+        priority = kwargs.get("priority", None)
+        return SpecCommandA.__call__(self, *args, wait=wait, timeout=timeout, priority=priority)
 
-    def executeCommand(self, command, wait=True, timeout=None):
-        return SpecCommandA.executeCommand(self, command, wait, timeout)
+    def executeCommand(self, command, wait=True, timeout=None, priority=None):
+        return SpecCommandA.executeCommand(self, command, wait, timeout, priority)
          
 
 
+class SpecCommandBatch:
+    """SpecCommandBatch class
+
+    Collect calls of Spec functions (i.e. motor_par, counter_par) and execute
+    them as one compound command, in a single exchange with Spec. The functions
+    must return a single value (not an associative array). While the batch
+    runs, the _SC_BATCH_INDEX global holds the index of the current call, so
+    the failed call can be reported if the command aborts.
+    """
+    def __init__(self, connection):
+        """Constructor
+
+        Arguments:
+        connection -- a SpecConnection object
+        """
+        self.connection = connection
+        self.calls = []
 
 
+    def __len__(self):
+        return len(self.calls)
+
+
+    def add(self, function, *args):
+        """Add a call of function with args to the batch, and return its index
+
+        Arguments:
+        function -- name of a Spec function, i.e. 'motor_par'
+        args -- call arguments (Python values are converted with repr, dictionaries to associative arrays)
+        """
+        self.calls.append('%s(%s)' % (function, ','.join(map(SpecMessage.argumentString, args))))
+        return len(self.calls) - 1
 
+
+    def clear(self):
+        self.calls = []
+
+
+    def getCommand(self):
+        """Return the compound command executing the calls"""
+        lines = ['global _SC_BATCH_INDEX', 'local _sc_results[]']
+        for i, call in enumerate(self.calls):
+            lines.append('_SC_BATCH_INDEX=%d; _sc_results[%d]=%s' % (i, i, call))
+        lines.append('_SC_BATCH_INDEX=-1')
+        lines.append('return _sc_results')
+        return '; '.join(lines)
+
+
+    def execute(self, timeout = None, priority = SpecCommandScheduler.AUTOMATION):
+        """Execute the calls, and return the list of results in calls order
+
+        Keyword arguments:
+        timeout -- optional timeout (defaults to None)
+        priority -- priority for the command scheduler, if enabled (defaults to AUTOMATION)
+
+        Exceptions:
+        SpecClientBatchError -- if a call failed, with the index of the call
+        """
+        if len(self.calls) == 0:
+            return []
+
+        if self.connection is None:
+            raise SpecClientNotConnectedError
+
+        with gevent.Timeout(timeout, SpecClientTimeoutError):
+            self.connection.connected_event.wait()
+
+            scheduler = self.connection.commandScheduler
+            if scheduler is not None:
+                ticket = scheduler.acquire(priority, id(gevent.getcurrent()))
+
+            try:
+                reply = self.connection.send_msg_cmd_with_return(self.getCommand())
+                try:
+                    reply.arrived.wait()
+                except:
+                    self.connection.registeredReplies.pop(reply.id, None)
+                    raise
+            finally:
+                if scheduler is not None:
+                    scheduler.release(ticket)
+
+            if reply.error:
+                try:
+                    index = int(self.connection.readChannel('var/_SC_BATCH_INDEX'))
+                except:
+                    index = None
+
+                if index is not None and 0 <= index < len(self.calls):
+                    call = self.calls[index]
+                    error = 'call %d of batch, %s, failed: %s' % (index, call, reply.data)
+                else:
+                    index = call = None
+                    error = 'batch failed: %s' % reply.data
+                raise SpecClientBatchError(error, reply.error_code, index, call)
+
+        results = reply.data
+        if not hasattr(results, 'get'):
+            results = {}
+
+        values = []
+        for i in range(len(self.calls)):
+            value = results.get(str(i), results.get(i))
+            values.append(SpecChannel.coerceValue(value))
+        return values
@@ -0,0 +1,146 @@
+"""SpecCommandScheduler module
+
+This module defines the SpecCommandScheduler class, which orders the
+commands sent to a Spec session by priority.
+
+Spec executes one command at a time, in arrival order. When the scheduler
+of a connection is enabled (see SpecConnection.setCommandScheduling),
+commands wait on the client side until the previous one is finished, and
+the next command to send is taken from the highest priority class ;
+within a class, sources (i.e. greenlets or named clients) are served in
+turn, so a source sending many commands does not starve the others.
+"""
+
+__author__ = 'Matias Guijarro'
+__version__ = '1.0'
+
+import time
+import collections
+import gevent.event
+
+(INTERACTIVE, AUTOMATION, BACKGROUND) = (0, 1, 2)
+PRIORITIES = (INTERACTIVE, AUTOMATION, BACKGROUND)
+
+
+class _Ticket(object):
+    __slots__ = ('priority', 'source', 'queueTime', 'event')
+
+    def __init__(self, priority, source):
+        self.priority = priority
+        self.source = source
+        self.queueTime = time.time()
+        self.event = gevent.event.Event()
+
+
+class SpecCommandScheduler:
+    """SpecCommandScheduler class
+
+    Let one command run at a time, the others waiting in priority queues
+    """
+    def __init__(self):
+        """Constructor."""
+        # { priority: { source: deque of tickets, ... }, ... }
+        self.queues = dict([(priority, collections.OrderedDict()) for priority in PRIORITIES])
+        self.current = None
+        self.stats = dict([(priority, [0, 0, 0.0, 0.0]) for priority in PRIORITIES]) # [commands, max depth, total wait, max wait]
+
+
+    def depth(self, priority = None):
+        """Return the number of waiting commands (of a given priority, if not None)"""
+        if priority is None:
+            return sum([self.depth(priority) for priority in PRIORITIES])
+        return sum([len(tickets) for tickets in self.queues[priority].itervalues()])
+
+
+    def acquire(self, priority = AUTOMATION, source = None):
+        """Wait for the turn of a command, and return the ticket to release once the command is finished
+
+        Arguments:
+        priority -- INTERACTIVE, AUTOMATION (default) or BACKGROUND
+        source -- identifier of the command sender, for fair queueing (defaults to None)
+        """
+        if not priority in self.queues:
+            priority = AUTOMATION
+
+        ticket = _Ticket(priority, source)
+
+        if self.current is None and self.depth() == 0:
+            self.current = ticket
+        else:
+            self.queues[priority].setdefault(source, collections.deque()).append(ticket)
+
+            stats = self.stats[priority]
+            stats[1] = max(stats[1], self.depth(priority))
+
+            try:
+                ticket.event.wait()
+            except:
+                if self.current is ticket:
+                    self.release(ticket)
+                else:
+                    self._dequeue(ticket)
+                raise
+
+        stats = self.stats[priority]
+        wait = time.time() - ticket.queueTime
+        stats[0] += 1
+        stats[2] += wait
+        stats[3] = max(stats[3], wait)
+
+        return ticket
+
+
+    def release(self, ticket):
+        """Let the next command run ; ticket is the one returned by acquire"""
+        if self.current is not ticket:
+            # reset in between
+            return
+
+        self.current = None
+
+        for priority in PRIORITIES:
+            sources = self.queues[priority]
+            if len(sources) > 0:
+                source, tickets = sources.popitem(last = False)
+                nextTicket = tickets.popleft()
+                if len(tickets) > 0:
+                    # next turn for the other sources
+                    sources[source] = tickets
+                self.current = nextTicket
+                nextTicket.event.set()
+                break
+
+
+    def reset(self):
+        """Consider the running command as finished (i.e. when Spec gets disconnected)"""
+        self.release(self.current)
+
+
+    def _dequeue(self, ticket):
+        sources = self.queues[ticket.priority]
+        tickets = sources.get(ticket.source)
+        if tickets is not None:
+            try:
+                tickets.remove(ticket)
+            except ValueError:
+                pass
+            if len(tickets) == 0:
+                del sources[ticket.source]
+
+
+    def getStats(self):
+        """Return a dictionary of statistics for each priority class
+
+        Keys are 'interactive', 'automation' and 'background' ; values are
+        dictionaries with the current queue depth, the maximum depth, the number
+        of commands and the mean and maximum wait times (in seconds).
+        """
+        result = {}
+        for priority, name in zip(PRIORITIES, ('interactive', 'automation', 'background')):
+            count, maxDepth, totalWait, maxWait = self.stats[priority]
+            result[name] = { 'depth': self.depth(priority),
+                             'max_depth': maxDepth,
+                             'commands': count,
+                             'mean_wait': count and totalWait / count,
+                             'max_wait': maxWait }
+        return result
@@ -18,14 +18,20 @@ import gevent.socket
 import gevent.queue
 import socket
 import weakref
+import collections
 import string
 import logging
 import time
-from .SpecClientError import SpecClientNotConnectedError
+from .SpecClientError import SpecClientError, SpecClientTimeoutError, SpecClientNotConnectedError
 import SpecEventsDispatcher
 import SpecChannel
 import SpecMessage
 import SpecReply
+import SpecWaitObject
+import SpecAssocArray
+import SpecQueryCache
+import SpecCommandScheduler
+import SpecArgumentStager
 import traceback
 import sys
 
@@ -121,9 +127,15 @@ def connectionHandler(connection_ref, socket_to_spec):
                            logging.getLogger("SpecClient").exception("Unexpected error while receiving a message from server")
                         else:
                            del conn.registeredReplies[replyID]
+                           reply.replyTime = time.time()
+                           reply.replySize = message.headerLength + message.dataLength
                            #replies_queue.put((reply, message.data, message.type==SpecMessage.ERROR, message.err))
-                           gevent.spawn(reply.update, message.data, message.type==SpecMessage.ERROR, message.err)
-                           time.sleep(1E-6)
+                           if reply.callback is None:
+                              # nothing but setting the reply event, no need for a greenlet
+                              reply.update(message.data, message.type==SpecMessage.ERROR, message.err)
+                           else:
+                              gevent.spawn(reply.update, message.data, message.type==SpecMessage.ERROR, message.err)
+                              time.sleep(1E-6)
                   elif message.cmd == SpecMessage.EVENT:
                      try:
                         channel = conn.registeredChannels[message.name]
@@ -131,12 +143,15 @@ def connectionHandler(connection_ref, socket_to_spec):
                         pass
                      else:
                         #channels_queue.put((channel, message.data, message.flags == SpecMessage.DELETED))
-                        gevent.spawn(channel.update, message.data, message.flags == SpecMessage.DELETED)
+                        gevent.spawn(channel.update, message.data, message.flags == SpecMessage.DELETED, serverTime = message.time)
                         time.sleep(1E-6)
                   elif message.cmd == SpecMessage.HELLO_REPLY:
                      if conn.checkourversion(message.name):
                         serverVersion = message.vers #header version
                         conn.serverVersion = serverVersion
+                        # Spec may have been restarted or reconfigured
+                        conn.queryCache.clear()
+                        conn.argumentStager.reset()
                         gevent.spawn(conn.specConnected)
                         time.sleep(1E-6)
                      else:
@@ -180,12 +195,27 @@ class SpecConnection:
         self.scanport = False
         self.scanname = ''
         self.registeredChannels = {}
+        self.registeredSubkeys = {} # { parent channel name: { key: [sub-key channel, ...], ... }, ... }
         self.registeredReplies = {}
+        self.channelCache = SpecChannel.SpecChannelCache()
+        self.channelPatterns = SpecChannel.SpecChannelPatternIndex()
+        self.queryCache = SpecQueryCache.SpecQueryCache()
+        self.configChangeChannel = None
+        self.commandScheduler = None
+        self.argumentStager = SpecArgumentStager.SpecArgumentStager()
+        self.channelPool = weakref.WeakValueDictionary() # unregistered channel objects returned by getChannel
+        self.recentChannels = collections.deque(maxlen = 100) # keep the most recent ones alive
+        self.pendingChannelReads = {} # { channel name: AsyncResult, ... }
+        self.channelReads = 0
+        self.coalescedChannelReads = 0
         self.simulationMode = False
         self.connected_event = gevent.event.Event()
         self._completed_writing_event = gevent.event.Event()
         self.outgoing_queue = []
         self.socket_write_event = None
+        self.coalesceWrites = False
+        self.pendingWrites = collections.OrderedDict() # { channel name: value, ... }
+        self.flushScheduled = False
 
         tmp = str(specVersion).split(':')
         self.host = tmp[0]
@@ -224,7 +254,7 @@ class SpecConnection:
         else:
           raise AttributeError("Attribute '%s' unexpected" % attr)
 
-    def registerChannel(self, chanName, receiverSlot, registrationFlag = SpecChannel.DOREG, dispatchMode = SpecEventsDispatcher.UPDATEVALUE):
+    def registerChannel(self, chanName, receiverSlot, registrationFlag = SpecChannel.DOREG, dispatchMode = SpecEventsDispatcher.UPDATEVALUE, executor = None, deltas = False, deadband = None, relativeDeadband = None, initialUpdate = True):
         """Register a channel
 
         Tell the remote Spec we are interested in receiving channel update events.
@@ -243,6 +273,16 @@ class SpecConnection:
         depending on how the receiver slot will be called. UPDATEVALUE means we don't mind skipping some
         channel update events as long as we got the last one (for example, a motor position). FIREEVENT means
         we want to call the receiver slot for every event.
+        executor -- optional SpecEventsDispatcher.SlotExecutor object, to call the receiver slot
+        from a bounded pool of greenlets instead of calling it inline
+        deltas -- if True, the receiver slot is connected to the channel 'valueDelta' signal instead
+        of 'valueChanged', and gets (channel value, changed keys, deleted keys, channel name) on updates
+        deadband -- if not None, the receiver slot is not called for numeric values closer than deadband
+        to the last value it got
+        relativeDeadband -- same as deadband, relatively to the last value the receiver slot got
+        (i.e. 0.01 for 1%)
+        initialUpdate -- if True (default), the channel value already received, if any, is emitted
+        again ; False for channels whose updates are events rather than states (i.e. 'output/tty')
         """
         if dispatchMode is None:
             return
@@ -250,25 +290,134 @@ class SpecConnection:
         chanName = str(chanName)
 
         try:
-          if not chanName in self.registeredChannels:
-            channel = SpecChannel.SpecChannel(self, chanName, registrationFlag)
-            self.registeredChannels[chanName] = channel
-            if channel.spec_chan_name != chanName:
-                self.registerChannel(channel.spec_chan_name, channel.update)
-            channel.registered = True
-          else:
-            channel = self.registeredChannels[chanName]
+          channel = self.addChannel(chanName, registrationFlag)
 
-          SpecEventsDispatcher.connect(channel, 'valueChanged', receiverSlot, dispatchMode)
+          if deltas:
+            SpecEventsDispatcher.connect(channel, 'valueDelta', receiverSlot, dispatchMode, executor)
+          elif deadband is not None or relativeDeadband is not None:
+            signal = channel.deadbandSignal(deadband, relativeDeadband)
+            SpecEventsDispatcher.connect(channel, signal, receiverSlot, dispatchMode, executor)
+          else:
+            SpecEventsDispatcher.connect(channel, 'valueChanged', receiverSlot, dispatchMode, executor)
 
           channelValue = self.registeredChannels[channel.spec_chan_name].value #channel.spec_chan_name].value
-          if channelValue is not None:
+          if channelValue is not None and initialUpdate:
             # we received a value, so emit an update signal
             channel.update(channelValue, force=True)
         except:
           logging.getLogger("SpecClient").exception("Uncaught exception in SpecConnection.registerChannel")
 
 
+    def addChannel(self, chanName, registrationFlag = SpecChannel.DOREG):
+        """Return the registered channel object for chanName
+
+        The channel is registered if needed, without connecting any receiver slot.
+
+        Arguments:
+        chanName -- a string representing the channel name, i.e. 'var/toto'
+
+        Keyword arguments:
+        registrationFlag -- internal flag
+        """
+        chanName = str(chanName)
+
+        try:
+            return self.registeredChannels[chanName]
+        except KeyError:
+            channel = SpecChannel.SpecChannel(self, chanName, registrationFlag)
+            self.registeredChannels[chanName] = channel
+            if channel.spec_chan_name != chanName:
+                subkeys = self.registeredSubkeys.setdefault(channel.spec_chan_name, {})
+                subkeys.setdefault(channel.access1, []).append(channel)
+                self.registerChannel(channel.spec_chan_name, self._parentChannelUpdate, deltas = True)
+
+                parentValue = self.registeredChannels[channel.spec_chan_name].value
+                if parentValue is not None:
+                    channel.update(parentValue)
+            channel.registered = True
+            return channel
+
+
+    def registerPattern(self, pattern, receiverSlot, names = (), dispatchMode = SpecEventsDispatcher.UPDATEVALUE, executor = None):
+        """Register a channel pattern
+
+        Connect the receiver slot to the updates of all the registered channels
+        matching the pattern ; the receiver slot gets (channel name, channel value).
+        Spec only sends events for channels registered one by one, so the
+        channels obtained by replacing the pattern wildcards by names are
+        registered at once (and registered again when Spec reconnects).
+
+        Arguments:
+        pattern -- a string representing the channel name pattern, i.e. 'motor/*/position'
+        ('*' matches one segment of the name, a trailing '**' matches the rest of the name)
+        receiverSlot -- any callable object in Python
+
+        Keyword arguments:
+        names -- names replacing the pattern wildcards, i.e. motor mnemonics (strings for
+        patterns with one wildcard, tuples of strings for several wildcards)
+        dispatchMode -- see registerChannel
+        executor -- see registerChannel
+        """
+        patternObj = self.channelPatterns.add(str(pattern))
+        SpecEventsDispatcher.connect(patternObj, 'valueChanged', receiverSlot, dispatchMode, executor)
+
+        for chanName in patternObj.expand(names):
+            if not chanName in patternObj.channels:
+                patternObj.channels.append(chanName)
+
+        for chanName in patternObj.channels:
+            try:
+                channel = self.addChannel(chanName)
+            except:
+                logging.getLogger("SpecClient").exception("Uncaught exception in SpecConnection.registerPattern")
+            else:
+                if channel.value is not None:
+                    # the other receivers of the pattern already got the value
+                    SpecEventsDispatcher.emitTo(patternObj, 'valueChanged', receiverSlot, (chanName, channel.value, ))
+
+        return patternObj
+
+
+    def unregisterPattern(self, pattern, receiverSlot = None):
+        """Disconnect a receiver slot from a channel pattern
+
+        The pattern is removed when no receiver slot is connected anymore
+        (or if receiverSlot is None) ; its channels are unregistered, unless
+        they are still used (receiver slots, other patterns or waits).
+
+        Arguments:
+        pattern -- a string representing the channel name pattern
+
+        Keyword arguments:
+        receiverSlot -- the slot to disconnect (defaults to None, meaning all slots)
+        """
+        try:
+            patternObj = self.channelPatterns.patterns[str(pattern)]
+        except KeyError:
+            return
+
+        if receiverSlot is not None:
+            SpecEventsDispatcher.disconnect(patternObj, 'valueChanged', receiverSlot)
+            if SpecEventsDispatcher.connections.get(id(patternObj), {}).get('valueChanged'):
+                return
+
+        self.channelPatterns.remove(patternObj.pattern)
+
+        for chanName in patternObj.channels:
+            if not self._isChannelUsed(chanName):
+                self.unregisterChannel(chanName)
+
+
+    def _isChannelUsed(self, chanName):
+        """Return True if a registered channel has receiver slots, matching patterns or waiters"""
+        channel = self.registeredChannels.get(chanName)
+        if channel is None:
+            return False
+        if len(channel.waiters) > 0 or len(self.channelPatterns.match(chanName)) > 0:
+            return True
+        return len(SpecEventsDispatcher.connections.get(id(channel), {})) > 0
+
+
     def unregisterChannel(self, chanName):
         """Unregister a channel
 
@@ -278,25 +427,181 @@ class SpecConnection:
         chanName = str(chanName)
 
         if chanName in self.registeredChannels:
-            self.registeredChannels[chanName].unregister()
+            channel = self.registeredChannels[chanName]
             del self.registeredChannels[chanName]
 
+            if channel.spec_chan_name == chanName:
+                channel.unregister()
+            else:
+                # the events come from the parent channel, which may have other sub-key channels
+                channel.registered = False
+                channel.value = None
+
+                parentName = channel.spec_chan_name
+                subkeys = self.registeredSubkeys.get(parentName, {})
+                try:
+                    subkeys[channel.access1].remove(channel)
+                except (KeyError, ValueError):
+                    pass
+                else:
+                    if len(subkeys[channel.access1]) == 0:
+                        del subkeys[channel.access1]
+
+                if len(subkeys) == 0 and parentName in self.registeredChannels:
+                    self.registeredSubkeys.pop(parentName, None)
+                    SpecEventsDispatcher.disconnect(self.registeredChannels[parentName], 'valueDelta', self._parentChannelUpdate)
+                    if not self._isChannelUsed(parentName):
+                        self.unregisterChannel(parentName)
+
+
+    def _parentChannelUpdate(self, channelValue, changedKeys, deletedKeys, channelName):
+        """Route an update of a 'var/NAME' channel to the 'var/NAME/key' channels
+
+        Only the sub-key channels for keys changed or deleted by the update
+        are updated, unless the whole value has been replaced.
+        """
+        try:
+            subkeys = self.registeredSubkeys[channelName]
+        except KeyError:
+            return
+
+        try:
+            serverTime = self.registeredChannels[channelName].serverTime
+        except KeyError:
+            serverTime = None
+
+        if changedKeys is None:
+            for channels in subkeys.values():
+                for channel in channels:
+                    channel.update(channelValue, serverTime = serverTime)
+            return
+
+        if len(changedKeys) < len(subkeys):
+            keys = [key for key in changedKeys if key in subkeys]
+        else:
+            keys = [key for key in subkeys if key in changedKeys]
+        for key in keys:
+            for channel in subkeys[key]:
+                channel.update(channelValue, serverTime = serverTime)
+
+        for key in deletedKeys:
+            for channel in subkeys.get(key, ()):
+                channel.update({ key: None }, deleted = True, serverTime = serverTime)
+
 
     def getChannel(self, chanName):
         """Return a channel object
 
         If the required channel is already registered, return it.
-        Otherwise, return a new 'temporary' unregistered SpecChannel object ;
-        reference should be kept in the caller or the object will get dereferenced.
+        Otherwise, return a 'temporary' unregistered SpecChannel object ;
+        temporary objects are pooled, so repeated calls for the same channel
+        return the same object as long as it is referenced somewhere or it
+        is one of the last temporary channels created.
 
         Arguments:
         chanName -- a string representing the channel name, i.e. 'var/toto'
         """
-        if not chanName in self.registeredChannels:
-            # return a newly created temporary SpecChannel object, without registering
-            return SpecChannel.SpecChannel(self, chanName, SpecChannel.DONTREG)
+        try:
+            return self.registeredChannels[chanName]
+        except KeyError:
+            channel = self.channelPool.get(chanName)
+
+            if channel is None:
+                # create a temporary SpecChannel object, without registering
+                channel = SpecChannel.SpecChannel(self, chanName, SpecChannel.DONTREG)
+                self.channelPool[chanName] = channel
+                self.recentChannels.append(channel)
+
+            return channel
+
+
+    def readChannel(self, chanName, timeout = None):
+        """Read a channel value from Spec, and return it
+
+        Concurrent reads of the same channel share a single request to Spec.
+
+        Arguments:
+        chanName -- a string representing the channel name, i.e. 'var/toto'
+
+        Keyword arguments:
+        timeout -- optional timeout (defaults to None)
+        """
+        self.channelReads += 1
+
+        pending = self.pendingChannelReads.get(chanName)
+        if pending is not None:
+            self.coalescedChannelReads += 1
+            with gevent.Timeout(timeout, SpecClientTimeoutError):
+                return pending.get()
+
+        pending = gevent.event.AsyncResult()
+        self.pendingChannelReads[chanName] = pending
+        try:
+            try:
+                value = SpecWaitObject.waitReply(self, 'send_msg_chan_read', (chanName, ), timeout=timeout)
+            except Exception, err:
+                pending.set_exception(err)
+                raise
+            else:
+                pending.set(value)
+                return value
+        finally:
+            del self.pendingChannelReads[chanName]
+            if not pending.ready():
+                pending.set_exception(SpecClientError('read of channel %s interrupted' % chanName))
+
+
+    def setCommandScheduling(self, enabled = True):
+        """Enable or disable the command scheduler of the connection
+
+        When enabled, SpecCommandA objects send one command at a time, by
+        priority class (see SpecCommandScheduler). Statistics are available
+        from the scheduler getStats() method.
+        """
+        if enabled:
+            if self.commandScheduler is None:
+                self.commandScheduler = SpecCommandScheduler.SpecCommandScheduler()
+        else:
+            self.commandScheduler = None
+
+
+    def setConfigChangeChannel(self, chanName):
+        """Set the channel signalling Spec configuration changes
+
+        Any update of the channel clears the query cache (see SpecQueryCache).
+
+        Arguments:
+        chanName -- a string representing the channel name, i.e. 'var/CONFIG_COUNT',
+        or None to unset
+        """
+        if self.configChangeChannel is not None:
+            chanObj = self.registeredChannels.get(self.configChangeChannel)
+            if chanObj is not None:
+                SpecEventsDispatcher.disconnect(chanObj, 'valueChanged', self._configChanged)
+
+        self.configChangeChannel = chanName and str(chanName)
 
-        return self.registeredChannels[chanName]
+        if self.configChangeChannel is not None:
+            self.registerChannel(self.configChangeChannel, self._configChanged)
+
+
+    def _configChanged(self, value):
+        self.queryCache.clear()
+
+
+    def getStats(self):
+        """Return a dictionary of statistics about the connection"""
+        return { 'channel_cache_size': len(self.channelCache.entries),
+                 'channel_cache_hits': self.channelCache.hits,
+                 'channel_cache_misses': self.channelCache.misses,
+                 'channel_reads': self.channelReads,
+                 'channel_reads_coalesced': self.coalescedChannelReads,
+                 'channel_read_dedup_ratio': self.channelReads and float(self.coalescedChannelReads) / self.channelReads,
+                 'query_cache_size': len(self.queryCache.entries),
+                 'query_cache_hits': self.queryCache.hits,
+                 'query_cache_misses': self.queryCache.misses,
+                 'command_scheduler': self.commandScheduler and self.commandScheduler.getStats(),
+                 'staged_arguments': self.argumentStager.stagedArguments }
 
 
     def error(self, error):
@@ -323,7 +628,14 @@ class SpecConnection:
             logging.getLogger('SpecClient').info('Connected to %s:%s', self.host, (self.scanport and self.scanname) or self.port)
 
             self.connected_event.set()
-            
+
+            for patternObj in self.channelPatterns.patterns.values():
+                for chanName in patternObj.channels:
+                    self.addChannel(chanName)
+
+            if self.configChangeChannel is not None:
+                self.registerChannel(self.configChangeChannel, self._configChanged)
+
             SpecEventsDispatcher.emit(self, 'connected', ())
 
 
@@ -342,9 +654,23 @@ class SpecConnection:
         """Handle 'close' event on socket."""
         self.connected = False
         self.serverVersion = None
+        if self.socket_write_event is not None:
+            self.socket_write_event.stop()
+            self.socket_write_event = None
+            self._completed_writing_event.set()
         if self.socket:
             self.socket.close()
         self.registeredChannels = {}
+        self.registeredSubkeys = {}
+        # not to be sent after reconnection
+        self.pendingWrites = collections.OrderedDict()
+        self.outgoing_queue = []
+        self.channelCache.clear()
+        self.queryCache.clear()
+        self.argumentStager.reset()
+        if self.commandScheduler is not None:
+            # replies of the running command will never come
+            self.commandScheduler.reset()
         self.specDisconnected()
 
     def disconnect(self):
@@ -452,16 +778,82 @@ class SpecConnection:
     def send_msg_chan_send(self, chanName, value, wait=False):
         """Send a channel write message.
 
+        If writes coalescing is enabled and wait is False, the message is
+        not sent immediately (see setWriteCoalescing).
+
         Arguments:
         chanName -- a string representing the channel name, i.e. 'var/toto'
         value -- channel value
         """
         if self.isSpecConnected():
-            self.__send_msg_no_reply(SpecMessage.msg_chan_send(chanName, value, version = self.serverVersion), wait)
+            if self.coalesceWrites and not wait:
+                self.__queue_chan_send(chanName, value)
+            else:
+                self.__send_msg_no_reply(SpecMessage.msg_chan_send(chanName, value, version = self.serverVersion), wait)
         else:
             raise SpecClientNotConnectedError
 
 
+    def setWriteCoalescing(self, enabled = True):
+        """Enable or disable channel writes coalescing
+
+        When enabled, channel writes are held until the writing greenlet
+        yields to the others (or until flush() is called, or another message
+        is sent to Spec) ; writes to the same channel in the meantime collapse
+        into the last value. Writes still reach Spec in the order in which
+        the surviving values have been written.
+        """
+        self.coalesceWrites = enabled
+
+        if not enabled:
+            self.flush()
+
+
+    def flush(self, wait=False):
+        """Send the pending coalesced channel writes
+
+        Keyword arguments:
+        wait -- if True, wait until the data has been written to the socket
+        """
+        self.flushScheduled = False
+
+        if len(self.pendingWrites) > 0:
+            pendingWrites = self.pendingWrites
+            self.pendingWrites = collections.OrderedDict()
+
+            if not self.isSpecConnected():
+                logging.getLogger('SpecClient').warning('Not connected to Spec, discarding writes to %s', ', '.join(pendingWrites.keys()))
+                return
+
+            for chanName, value in pendingWrites.iteritems():
+                self.__send_msg_no_reply(SpecMessage.msg_chan_send(chanName, value, version = self.serverVersion))
+
+        if wait and self.socket_write_event is not None:
+            self._completed_writing_event.clear()
+            self._completed_writing_event.wait()
+
+
+    def __queue_chan_send(self, chanName, value):
+        oldValue = self.pendingWrites.pop(chanName, None)
+
+        if SpecAssocArray.isAssoc(oldValue) and SpecAssocArray.isAssoc(value):
+            # writes to different keys of an associative array
+            newValue = dict(oldValue.iteritems())
+            for key, val in value.iteritems():
+                if SpecAssocArray.isAssoc(newValue.get(key)) and SpecAssocArray.isAssoc(val):
+                    newValue[key] = dict(newValue[key].iteritems())
+                    newValue[key].update(val)
+                else:
+                    newValue[key] = val
+            value = newValue
+
+        self.pendingWrites[chanName] = value
+
+        if not self.flushScheduled:
+            self.flushScheduled = True
+            gevent.spawn(self.flush)
+
+
     def send_msg_register(self, chanName):
         """Send a channel register message.
 
@@ -524,7 +916,8 @@ class SpecConnection:
         if hasattr(replyReceiverObject, 'replyArrived'):
             reply.callback = replyReceiverObject.replyArrived
 
-        self.__send_msg_no_reply(message)
+        reply.sendTime = time.time()
+        reply.requestSize = self.__send_msg_no_reply(message)
 
         return reply #print "REPLY ID", replyID
 
@@ -545,9 +938,14 @@ class SpecConnection:
 
         If a reply is sent depends only on the message, and not on the
         method to send the message. Using this method, any reply is
-        lost.
+        lost. Return the size of the message, in bytes.
         """
-        self.outgoing_queue.append(message.sendingString()) 
+        if len(self.pendingWrites) > 0:
+            # keep messages order
+            self.flush()
+
+        data = message.sendingString()
+        self.outgoing_queue.append(data)
         if self.socket_write_event is None:
            if wait:
               self._completed_writing_event.clear()
@@ -555,5 +953,7 @@ class SpecConnection:
            self.socket_write_event.start(self.__do_send_data)
            if wait:
               self._completed_writing_event.wait()
-          
+
+        return len(data)
+
 
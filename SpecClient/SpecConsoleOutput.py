@@ -0,0 +1,200 @@
+"""SpecConsoleOutput module
+
+This module defines the SpecConsoleOutput class, which captures the
+text printed on the Spec console, through the 'output/tty' channel.
+
+Output is split into lines ; the last lines are kept in a ring of fixed
+size, and new lines are given to the receivers of the 'linesReceived'
+signal in batches (one list of lines per batch interval at most), so
+verbose macros neither grow memory nor fire one callback per line.
+"""
+
+__author__ = 'Matias Guijarro'
+__version__ = '1.0'
+
+import types
+import collections
+import contextlib
+import gevent
+import SpecConnectionsManager
+import SpecEventsDispatcher
+import SpecCommand
+
+MAX_LINE_LENGTH = 4096 # longer lines are split
+
+
+class SpecOutputCapture:
+    """SpecOutputCapture class
+
+    Output lines captured while a command runs (see SpecConsoleOutput.capture) ;
+    only the last 'size' lines are kept, the number of lines which did not fit
+    is in 'dropped'. For SpecConsoleOutput.execute, 'result' is the command result.
+    """
+    def __init__(self, size):
+        self.lines = collections.deque(maxlen = size)
+        self.dropped = 0
+        self.result = None
+
+
+    def append(self, lines):
+        self.dropped += max(0, len(self.lines) + len(lines) - self.lines.maxlen)
+        self.lines.extend(lines)
+
+
+    def getText(self):
+        return '\n'.join(self.lines)
+
+
+class SpecConsoleOutput:
+    """SpecConsoleOutput class
+
+    Emit 'linesReceived' with the list of new output lines.
+    """
+    def __init__(self, specVersion = None, size = 10000, channelName = 'output/tty', interval = 0.05):
+        """Constructor
+
+        Keyword arguments:
+        specVersion -- 'host:port' string representing a Spec server to connect to (defaults to None)
+        size -- number of lines kept (defaults to 10000) ; it also bounds the lines waiting
+        to be emitted, and the lines of a capture
+        channelName -- output channel (defaults to 'output/tty', the Spec console)
+        interval -- time to collect lines before emitting them, in seconds (defaults to 0.05)
+        """
+        self.connection = None
+        self.specVersion = None
+        self.size = size
+        self.channelName = channelName
+        self.interval = interval
+        self.lines = collections.deque(maxlen = size)
+        self.partialLine = ''
+        self.pendingLines = []
+        self.droppedLines = 0 # lines never emitted, because receivers did not keep up
+        self.flushScheduled = False
+        self.captures = []
+
+        if specVersion is not None:
+            self.connectToSpec(specVersion)
+
+
+    def connectToSpec(self, specVersion):
+        """Connect to a remote Spec, and register the output channel
+
+        Arguments:
+        specVersion -- 'host:port' string representing a Spec server to connect to
+        """
+        self.specVersion = specVersion
+        self.connection = SpecConnectionsManager.SpecConnectionsManager().getConnection(specVersion)
+        SpecEventsDispatcher.connect(self.connection, 'connected', self._connected)
+
+        if self.connection.isSpecConnected():
+            self._connected()
+
+
+    def isSpecConnected(self):
+        return self.connection is not None and self.connection.isSpecConnected()
+
+
+    def _connected(self):
+        # the last output received is not new output
+        self.connection.registerChannel(self.channelName, self._outputReceived, dispatchMode = SpecEventsDispatcher.FIREEVENT, initialUpdate = False)
+
+
+    def _outputReceived(self, output):
+        if output is None:
+            return
+        if not type(output) in (types.StringType, types.UnicodeType):
+            output = str(output)
+
+        lines = (self.partialLine + output).split('\n')
+        self.partialLine = lines.pop()
+        if len(self.partialLine) > MAX_LINE_LENGTH:
+            lines.append(self.partialLine)
+            self.partialLine = ''
+
+        if len(lines) > 0:
+            self._addLines(lines)
+
+
+    def _addLines(self, lines):
+        lines = [line[i:i+MAX_LINE_LENGTH] for line in lines for i in range(0, max(len(line), 1), MAX_LINE_LENGTH)]
+
+        self.lines.extend(lines)
+
+        for capture in self.captures:
+            capture.append(lines)
+
+        self.pendingLines.extend(lines)
+        if len(self.pendingLines) > self.size:
+            self.droppedLines += len(self.pendingLines) - self.size
+            del self.pendingLines[:-self.size]
+
+        if not self.flushScheduled:
+            self.flushScheduled = True
+            gevent.spawn_later(self.interval, self.flush)
+
+
+    def flush(self):
+        """Emit 'linesReceived' with the lines received since the last call"""
+        self.flushScheduled = False
+
+        lines = self.pendingLines
+        self.pendingLines = []
+        if len(lines) > 0:
+            SpecEventsDispatcher.emit(self, 'linesReceived', (lines, ))
+
+
+    def getLines(self, n = None):
+        """Return the n last output lines (all the lines kept if n is None)"""
+        lines = list(self.lines)
+        if n is None:
+            return lines
+        return lines[-n:]
+
+
+    def clear(self):
+        self.lines.clear()
+        self.partialLine = ''
+
+
+    @contextlib.contextmanager
+    def capture(self, size = None):
+        """Return a context manager giving a SpecOutputCapture object, filled with the output lines until exit
+
+        The incomplete last line, if any, is added to the capture on exit.
+
+        Keyword arguments:
+        size -- maximum number of lines captured (defaults to None, meaning the size of the output ring)
+        """
+        capture = SpecOutputCapture(size or self.size)
+        self.captures.append(capture)
+        try:
+            yield capture
+        finally:
+            self.captures.remove(capture)
+            if self.partialLine:
+                capture.append([self.partialLine])
+
+
+    def execute(self, command, *args, **kwargs):
+        """Execute a command, and return the SpecOutputCapture object with its output and result
+
+        Arguments:
+        command -- a SpecCommand object, or a command name
+        args -- command arguments
+
+        Keyword arguments:
+        size -- maximum number of lines captured (defaults to None, meaning the size of the output ring)
+        other keyword arguments are passed to the command (the call always waits for the result)
+        """
+        if type(command) in (types.StringType, types.UnicodeType):
+            command = SpecCommand.SpecCommand(command, self.connection)
+
+        kwargs['wait'] = True
+        with self.capture(kwargs.pop('size', None)) as capture:
+            try:
+                capture.result = command(*args, **kwargs)
+            except Exception, e:
+                # the output tells what went wrong
+                e.output = capture
+                raise
+        return capture
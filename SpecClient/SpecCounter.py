@@ -14,7 +14,7 @@ import SpecConnectionsManager
 import SpecEventsDispatcher
 import SpecWaitObject
 import SpecCommand
-import math
+from .SpecQueryCache import idempotent
 
 NOTINITIALIZED, NOTCOUNTING, COUNTING = range(3)
 UNKNOWN, SCALER, TIMER, MONITOR = 0, 1, 2, 3
@@ -22,6 +22,10 @@ UNKNOWN, SCALER, TIMER, MONITOR = 0, 1, 2, 3
 ALL_COUNT = "scaler/.all./count"
 
 
+def _countingDone(value):
+    return value == 0
+
+
 class SpecCounterA:
     """SpecCounter class"""
     def __init__(self, specName = None, specVersion = None, callbacks = None, timeout = None):
@@ -38,7 +42,6 @@ class SpecCounterA:
          self.chanNamePrefix = ""
          self.connection = None
          self.type = UNKNOWN
-         self.__old_value = None
          self.__callbacks = {
             "counterStateChanged": None,
             "counterValueChanged": None,
@@ -90,6 +93,7 @@ class SpecCounterA:
             self._connected()
 
 
+    @idempotent
     def getType(self):
         c = self.connection.getChannel('var/%s' % self.specName)
         index = c.read()
@@ -104,7 +108,7 @@ class SpecCounterA:
     def _connected(self):
         self.type = self.getType()
         self.connection.registerChannel(self.chanNamePrefix % 'value',
-                                        self.__counterValueChanged)
+                                        self.__counterValueChanged, deadband=1E-6)
                                         #dispatchMode=SpecEventsDispatcher.FIREEVENT)
         self.connection.registerChannel(ALL_COUNT,
                                         self.__counterStateChanged)
@@ -147,13 +151,6 @@ class SpecCounterA:
 
 
     def __counterValueChanged(self, value):
-        if self.__old_value is None:
-            self.__old_value = value
-        else:
-            if math.fabs(value - self.__old_value) > 1E-6:
-                self.__old_value = value
-            else:
-                return
         try:
             if self.__callbacks.get("counterValueChanged"):
                 cb = self.__callbacks["counterValueChanged"]()
@@ -222,8 +219,7 @@ class SpecCounterA:
 
 
     def waitCount(self, timeout=None):
-        w = SpecWaitObject.SpecWaitObject(self.connection)
-        w.waitChannelUpdate(ALL_COUNT, waitValue = 0)
+        SpecWaitObject.waitFor(ALL_COUNT, self.connection, _countingDone, timeout, checkCurrent = False)
         return self.getValue()
 
 
@@ -247,9 +243,13 @@ class SpecCounterA:
         else:
             disable = "1"
         cmd = 'counter_par({0}, "disable", {1})'.format(self.specName, disable)
-        return SpecCommand.SpecCommand(cmd, self.connection)()
+        try:
+            return SpecCommand.SpecCommand(cmd, self.connection)()
+        finally:
+            self.connection.queryCache.invalidate('isEnabled', self.specName)
 
 
+    @idempotent
     def isEnabled(self):
         cmd = 'counter_par({0}, "disable")'.format(self.specName)
         result = SpecCommand.SpecCommand(cmd, self.connection)()
@@ -2,11 +2,19 @@ import weakref
 import exceptions
 import time
 import saferef
+import collections
 import gevent
+import gevent.event
+import gevent.pool
 import logging
 from .SpecClientError import SpecClientDispatcherError
 
 (UPDATEVALUE, FIREEVENT) = (1, 2)
+(DROP_OLDEST, BLOCK, COALESCE) = ('drop_oldest', 'block', 'coalesce')
+
+blockingThreshold = None # log slots which block dispatching longer than this (in seconds)
+profiling = False
+profile = {} # { (sender type, signal, slot name): [calls, total time, max time, exceptions], ... }
 
 def robustApply(slot, arguments = ()):
     """Call slot with appropriate number of arguments"""
@@ -34,9 +42,10 @@ def robustApply(slot, arguments = ()):
 
 
 class Receiver:
-    def __init__(self, weakReceiver, dispatchMode):
+    def __init__(self, weakReceiver, dispatchMode, executor = None):
         self.weakReceiver = weakReceiver
         self.dispatchMode = dispatchMode
+        self.executor = executor
 
 
     def __call__(self, arguments):
@@ -46,6 +55,89 @@ class Receiver:
             return robustApply(slot, arguments)
 
 
+class SlotExecutor:
+    """Run receiver slots in a bounded pool of greenlets
+
+    Receivers connected with an executor are not called inline by emit() ;
+    calls are queued and processed by at most 'size' greenlets, so a slow
+    slot does not stall the delivery of the signal to the other receivers.
+
+    When the queue is full, the queue policy decides what happens :
+    DROP_OLDEST -- the oldest pending call is discarded
+    BLOCK -- the emitter waits until there is room in the queue
+    COALESCE -- a pending call for the same receiver is replaced by the new
+    one (only the last arguments are delivered), then DROP_OLDEST applies
+    """
+    def __init__(self, size = 1, maxQueueSize = 100, queuePolicy = COALESCE):
+        if queuePolicy not in (DROP_OLDEST, BLOCK, COALESCE):
+            raise ValueError('Unknown queue policy %r' % queuePolicy)
+
+        self.size = size
+        self.maxQueueSize = maxQueueSize
+        self.queuePolicy = queuePolicy
+        self.dropped = 0
+        self.pool = gevent.pool.Group()
+        self.workers = 0 # running workers ; not the pool size, greenlets leave it late
+        self.queue = collections.deque()
+        self.pending = {} # { receiver: queued call, ... } (COALESCE only)
+        self.not_full_event = gevent.event.Event()
+        self.not_full_event.set()
+
+
+    def submit(self, receiver, sender, signal, arguments):
+        """Queue a call to receiver, start a worker if the pool is not full"""
+        if self.queuePolicy == COALESCE:
+            call = self.pending.get(receiver)
+            if call is not None:
+                call[3] = arguments
+                return
+
+        while len(self.queue) >= self.maxQueueSize:
+            if self.queuePolicy == BLOCK:
+                self.not_full_event.clear()
+                self.not_full_event.wait()
+            else:
+                oldCall = self.queue.popleft()
+                if self.pending.get(oldCall[0]) is oldCall:
+                    del self.pending[oldCall[0]]
+                self.dropped += 1
+
+        call = [receiver, sender, signal, arguments]
+        self.queue.append(call)
+        if self.queuePolicy == COALESCE:
+            self.pending[receiver] = call
+
+        self._startWorker()
+
+
+    def _startWorker(self):
+        if self.workers < self.size:
+            self.workers += 1
+            self.pool.spawn(self._run)
+
+
+    def _run(self):
+        try:
+            while len(self.queue) > 0:
+                call = self.queue.popleft()
+                receiver, sender, signal, arguments = call
+                if self.pending.get(receiver) is call:
+                    del self.pending[receiver]
+                self.not_full_event.set()
+
+                _callReceiver(receiver, sender, signal, arguments)
+        finally:
+            self.workers -= 1
+            if len(self.queue) > 0:
+                # killed while calls were queued
+                self._startWorker()
+
+
+    def join(self, timeout = None):
+        """Wait for all queued calls to be processed"""
+        return self.pool.join(timeout)
+
+
 class Event:
     def __init__(self, sender, signal, arguments):
         self.receivers = []
@@ -68,7 +160,84 @@ def callableObjectRef(object):
     return saferef.safe_ref(object, _removeReceiver)
 
 
-def connect(sender, signal, slot, dispatchMode = UPDATEVALUE):
+def setBlockingThreshold(threshold):
+    """Log slots blocking the dispatching of signals for more than threshold seconds
+
+    Arguments:
+    threshold -- time in seconds, or None to disable the monitoring
+    """
+    global blockingThreshold
+    blockingThreshold = threshold
+
+
+def setProfiling(enabled = True):
+    """Enable or disable the recording of slots execution statistics"""
+    global profiling
+    profiling = enabled
+
+
+def resetProfile():
+    """Forget all recorded slots execution statistics"""
+    profile.clear()
+
+
+def getProfile():
+    """Return the recorded slots execution statistics
+
+    Return value:
+    a { (sender type, signal, slot name): (calls, total time, max time, exceptions), ... } dictionary
+    """
+    return dict([(key, tuple(stats)) for key, stats in profile.iteritems()])
+
+
+def profileReport(sortBy = 'total', limit = None):
+    """Return the recorded slots execution statistics as a text report
+
+    Keyword arguments:
+    sortBy -- one of 'calls', 'total', 'max' or 'exceptions' (defaults to 'total')
+    limit -- maximum number of lines in the report (defaults to None, meaning all)
+    """
+    column = ('calls', 'total', 'max', 'exceptions').index(sortBy)
+    entries = sorted(profile.iteritems(), key = lambda entry: entry[1][column], reverse = True)
+    if limit is not None:
+        entries = entries[:limit]
+
+    lines = ['%8s %10s %10s %10s %6s  %s' % ('calls', 'total (s)', 'max (s)', 'mean (s)', 'exc', 'sender type / signal / slot')]
+    for (senderType, signal, slot), (calls, total, maximum, exceptions) in entries:
+        lines.append('%8d %10.6f %10.6f %10.6f %6d  %s / %s / %s' % (calls, total, maximum, total / calls, exceptions, senderType, signal, slot))
+
+    return '\n'.join(lines)
+
+
+def slotName(receiver):
+    """Return a readable name for the slot of a Receiver object"""
+    weakReceiver = receiver.weakReceiver
+
+    if isinstance(weakReceiver, saferef.BoundMethodWeakref):
+        return '%s.%s' % (weakReceiver.self_name, weakReceiver.func_name)
+
+    slot = weakReceiver()
+    if slot is None:
+        return '<dead slot>'
+    return getattr(slot, '__name__', repr(slot))
+
+
+def senderName(sender):
+    """Return a readable name for a sender, i.e. the channel name for a SpecChannel"""
+    name = getattr(sender, 'name', None)
+    if name is None:
+        return str(sender)
+    return str(name)
+
+
+def connect(sender, signal, slot, dispatchMode = UPDATEVALUE, executor = None):
+    """Connect signal from sender to slot
+
+    Keyword arguments:
+    dispatchMode -- UPDATEVALUE (default) or FIREEVENT
+    executor -- optional SlotExecutor object ; if given, slot is called from
+    the executor greenlets instead of being called inline by emit()
+    """
     if sender is None or signal is None:
         return
 
@@ -105,9 +274,10 @@ def connect(sender, signal, slot, dispatchMode = UPDATEVALUE):
     for r in receivers:
         if r.weakReceiver == weakReceiver:
             r.dispatchMode = dispatchMode
+            r.executor = executor
             return
 
-    receivers.append(Receiver(weakReceiver, dispatchMode))
+    receivers.append(Receiver(weakReceiver, dispatchMode, executor))
 
 
 def disconnect(sender, signal, slot):
@@ -153,12 +323,62 @@ def emit(sender, signal, arguments = ()):
       return
     else:
       for receiver in receivers:
-          try:
-              receiver(arguments)
-          except:
-              logging.getLogger("SpecClient").exception("Exception while calling receiver %s for signal %s", receiver, signal)
-              continue
-              
+          if receiver.executor is not None:
+              receiver.executor.submit(receiver, sender, signal, arguments)
+          else:
+              _callReceiver(receiver, sender, signal, arguments)
+
+
+def emitTo(sender, signal, slot, arguments = ()):
+    """Emit signal from sender to one of its receivers only
+
+    Nothing happens if slot is not connected to the signal.
+    """
+    try:
+      receivers = connections[id(sender)][str(signal)]
+    except:
+      return
+    else:
+      weakReceiver = callableObjectRef(slot)
+      for receiver in receivers:
+          if receiver.weakReceiver == weakReceiver:
+              if receiver.executor is not None:
+                  receiver.executor.submit(receiver, sender, signal, arguments)
+              else:
+                  _callReceiver(receiver, sender, signal, arguments)
+              break
+
+
+def _callReceiver(receiver, sender, signal, arguments):
+    t0 = time.time()
+    failed = False
+
+    try:
+        receiver(arguments)
+    except:
+        failed = True
+        logging.getLogger("SpecClient").exception("Exception while calling receiver %s for signal %s", receiver, signal)
+
+    if profiling or blockingThreshold is not None:
+        elapsed = time.time() - t0
+
+        if profiling:
+            key = (sender.__class__.__name__, signal, slotName(receiver))
+            try:
+                stats = profile[key]
+            except KeyError:
+                stats = profile[key] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+            if failed:
+                stats[3] += 1
+
+        if blockingThreshold is not None and elapsed > blockingThreshold:
+            logging.getLogger("SpecClient").warning("Slot %s blocked dispatching of signal %s from %s for %.3f s", slotName(receiver), signal, senderName(sender), elapsed)
+
+
 def dispatch(max_time_in_s=1):
     return
 
@@ -15,6 +15,7 @@ import time
 import types
 
 import SpecArray
+import SpecAssocArray
 import SpecReply
 
 (DOUBLE, STRING, ERROR, ASSOC) = (1,2,3,4)
@@ -99,7 +100,7 @@ def dictionarytoraw(dict):
     expected by Spec"""
     data = ""
     for key, val in dict.items():
-        if type(val) == types.DictType:
+        if SpecAssocArray.isAssoc(val):
             for kkey, vval in val.iteritems():
                 if kkey is None:
                   data += str(key) + NULL + str(vval) + NULL
@@ -141,6 +142,7 @@ class SpecMessage:
         self.name = None
         self.err = 0
         self.flags = 0
+        self.dataLength = 0
 
 
     def isComplete(self):
@@ -163,6 +165,7 @@ class SpecMessage:
             if self.readheader:
                 self.readheader = False
                 self.type, self.bytesToRead = self.readHeader(streamBuf[:self.headerLength])
+                self.dataLength = self.bytesToRead
                 consumedBytes = self.headerLength
             else:
                 rawdata = streamBuf[consumedBytes:consumedBytes+self.bytesToRead]
@@ -201,6 +204,10 @@ class SpecMessage:
         if datatype == ERROR:
             return data
         elif datatype == STRING or datatype == DOUBLE:
+            if self.name is not None and self.name.startswith('output/'):
+                # console output is text, even if it looks like a number
+                return data
+
             # try to convert data to a more appropriate type
             try:
                 data = int(data)
@@ -230,7 +237,7 @@ class SpecMessage:
         """
         if type(data) == types.StringType:
             return STRING
-        elif type(data) == types.DictType:
+        elif SpecAssocArray.isAssoc(data):
             return ASSOC
         elif type(data) == types.IntType or type(data) == types.LongType or type(data) == types.FloatType:
             return STRING
@@ -479,19 +486,30 @@ class anymessage(SpecMessage):
         return 0
 
 
+def argumentString(arg):
+    """Convert a command argument to a Spec string.
+
+    Dictionaries and associative arrays are written as Spec associative arrays.
+    """
+    if SpecAssocArray.isAssoc(arg):
+        if isinstance(arg, SpecAssocArray.SpecAssocArray):
+            arg = arg.toDict()
+
+        argstr = repr(arg)
+        argstr = argstr.replace('{', '[')
+        argstr = argstr.replace('}', ']')
+        return argstr
+
+    return repr(arg)
+
+
 def commandListToCommandString(cmdlist):
     """Convert a command list to a Spec command string."""
     if type(cmdlist) == types.ListType and len(cmdlist) > 0:
         cmd = [str(cmdlist[0])]
 
         for arg in cmdlist[1:]:
-            argstr = repr(arg)
-
-            if type(arg) == types.DictType:
-                argstr = argstr.replace('{', '[')
-                argstr = argstr.replace('}', ']')
-
-            cmd.append(argstr)
+            cmd.append(argumentString(arg))
 
         return NULL.join(cmd)
     else:
@@ -19,7 +19,6 @@ import SpecWaitObject
 import SpecCommand
 import logging
 import types
-import math
 
 (NOTINITIALIZED, UNUSABLE, READY, MOVESTARTED, MOVING, ONLIMIT) = (0,1,2,3,4,5)
 (NOLIMIT, LOWLIMIT, HIGHLIMIT) = (0,2,4)
@@ -37,10 +36,10 @@ class SpecMotorA:
         self.motorState = NOTINITIALIZED
         self.limit = NOLIMIT
         self.limits = (None, None)
+        self.parameters = {} # last values of the registered parameter channels
         self.chanNamePrefix = ''
         self.connection = None
         self.timeout = timeout
-        self.__old_position = None
         # the callbacks listed below can be set directly using the 'callbacks' keyword argument ;
         # when the event occurs, the corresponding callback will be called automatically
 	self.__callbacks = {
@@ -97,16 +96,16 @@ class SpecMotorA:
         #
         # register channels
         #
-        self.connection.registerChannel(self.chanNamePrefix % 'low_limit', self._motorLimitsChanged)
-        self.connection.registerChannel(self.chanNamePrefix % 'high_limit', self._motorLimitsChanged)
-        self.connection.registerChannel(self.chanNamePrefix % 'position', self.__motorPositionChanged, dispatchMode=SpecEventsDispatcher.FIREEVENT)
+        self.connection.registerChannel(self.chanNamePrefix % 'low_limit', self.__motorLimitChanged)
+        self.connection.registerChannel(self.chanNamePrefix % 'high_limit', self.__motorLimitChanged)
+        self.connection.registerChannel(self.chanNamePrefix % 'position', self.__motorPositionChanged, dispatchMode=SpecEventsDispatcher.FIREEVENT, deadband=1E-6)
         self.connection.registerChannel(self.chanNamePrefix % 'move_done', self.motorMoveDone, dispatchMode = SpecEventsDispatcher.FIREEVENT)
         self.connection.registerChannel(self.chanNamePrefix % 'high_lim_hit', self.__motorLimitHit)
         self.connection.registerChannel(self.chanNamePrefix % 'low_lim_hit', self.__motorLimitHit)
         self.connection.registerChannel(self.chanNamePrefix % 'sync_check', self.__syncQuestion)
         self.connection.registerChannel(self.chanNamePrefix % 'unusable', self.__motorUnusable)
-        self.connection.registerChannel(self.chanNamePrefix % 'offset', self.motorOffsetChanged)
-        self.connection.registerChannel(self.chanNamePrefix % 'sign', self.signChanged)
+        self.connection.registerChannel(self.chanNamePrefix % 'offset', self.__motorOffsetChanged)
+        self.connection.registerChannel(self.chanNamePrefix % 'sign', self.__signChanged)
         #self.connection.registerChannel(self.chanNamePrefix % 'dial_position', self.dialPositionChanged)
 
         try: 
@@ -131,6 +130,7 @@ class SpecMotorA:
 
         Put the motor in NOTINITIALIZED state.
         """
+        self.parameters = {}
         self.__changeMotorState(NOTINITIALIZED)
 
         try:
@@ -154,6 +154,21 @@ class SpecMotorA:
     #    pass
 
 
+    def __motorLimitChanged(self, limit, channelName):
+        self.parameters[channelName.split('/')[-1]] = limit
+        self._motorLimitsChanged()
+
+
+    def __signChanged(self, sign):
+        self.parameters['sign'] = sign
+        self.signChanged(sign)
+
+
+    def __motorOffsetChanged(self, offset):
+        self.parameters['offset'] = offset
+        self.motorOffsetChanged(offset)
+
+
     def signChanged(self, sign):
         self._motorLimitsChanged()
 
@@ -214,13 +229,8 @@ class SpecMotorA:
 
 
     def __motorPositionChanged(self, absolutePosition):
-        if self.__old_position is None:
-           self.__old_position = absolutePosition
-        else:
-           if math.fabs(absolutePosition - self.__old_position) > 1E-6:
-              self.__old_position = absolutePosition
-           else:
-              return
+        self.parameters['position'] = absolutePosition
+
         try:
           if self.__callbacks.get("motorPositionChanged"):
             cb = self.__callbacks["motorPositionChanged"]()
@@ -243,17 +253,41 @@ class SpecMotorA:
 
     def setOffset(self, offset):
         """Set the motor offset value"""
-        c = self.connection.getChannel(self.chanNamePrefix % 'offset')
+        self._writeParameter('offset', offset)
+
 
-        c.write(offset)
+    def _writeParameter(self, param, value, wait=False):
+        # the value received from the channel is outdated until the
+        # event for the new one comes : getters read from Spec meanwhile
+        self.parameters.pop(param, None)
+
+        c = self.connection.getChannel(self.chanNamePrefix % param)
+        c.write(value, wait=wait)
 
 
     def getOffset(self, timeout=None):
-        return self._read_channel('offset', timeout=timeout)
+        try:
+            return self._getParameters('offset')[0]
+        except KeyError:
+            return self._read_channel('offset', timeout=timeout)
 
 
     def getSign(self, timeout=None):
-        return self._read_channel('sign', timeout=timeout)
+        try:
+            return self._getParameters('sign')[0]
+        except KeyError:
+            return self._read_channel('sign', timeout=timeout)
+
+
+    def _getParameters(self, *names):
+        """Return the last values of the given parameters, received from the registered channels
+
+        Raise KeyError if a value is not known (i.e. not received yet, or Spec is not connected).
+        """
+        values = [self.parameters[name] for name in names]
+        if None in values:
+            raise KeyError(names[values.index(None)])
+        return values
 
 
     def __syncQuestion(self, channelValue):
@@ -391,8 +425,7 @@ class SpecMotorA:
 
 
     def setParameter(self, param, value):
-        c = self.connection.getChannel(self.chanNamePrefix % param)
-        c.write(value)
+        self._writeParameter(param, value)
 
 
     def getPosition(self, timeout=None):
@@ -407,16 +440,31 @@ class SpecMotorA:
 
     def getLimits(self, timeout=None):
         """Return a (low limit, high limit) tuple in user units."""
-        lims = [ x * self.getSign(timeout=timeout) + self.getOffset(timeout=timeout)
-                 for x in (self._read_channel('low_limit', timeout=timeout), \
-                           self._read_channel('high_limit', timeout=timeout))]
+        try:
+            low, high, sign, offset = self._getParameters('low_limit', 'high_limit', 'sign', 'offset')
+        except KeyError:
+            sign = self.getSign(timeout=timeout)
+            offset = self.getOffset(timeout=timeout)
+            low = self._read_channel('low_limit', timeout=timeout)
+            high = self._read_channel('high_limit', timeout=timeout)
+
+        lims = [ x * sign + offset for x in (low, high) ]
 
         return (min(lims), max(lims))
 
 
     def getDialPosition(self, timeout=None):
         """Return the motor dial position."""
-        return self._read_channel('dial_position', timeout=timeout)
+        try:
+            position, sign, offset = self._getParameters('position', 'sign', 'offset')
+        except KeyError:
+            sign = 0
+
+        if not sign:
+            return self._read_channel('dial_position', timeout=timeout)
+
+        # user = sign * dial + offset
+        return (position - offset) * sign
 
 
 class SpecMotor(SpecMotorA):
@@ -438,9 +486,7 @@ class SpecMotor(SpecMotorA):
 
     def setOffset(self, offset):
         """Set the motor offset value"""
-        c = self.connection.getChannel(self.chanNamePrefix % 'offset')
-
-        c.write(offset, wait=True)
+        self._writeParameter('offset', offset, wait=True)
 
     def __syncQuestion(self, channelValue):
         """Callback triggered by a 'sync_check' channel update
@@ -491,8 +537,7 @@ class SpecMotor(SpecMotorA):
 
 
     def setParameter(self, param, value):
-        c = self.connection.getChannel(self.chanNamePrefix % param)
-        c.write(value, wait=True)
+        self._writeParameter(param, value, wait=True)
 
 
     def getState(self, timeout=None):
@@ -0,0 +1,345 @@
+"""SpecMotorGroup module
+
+This module defines the SpecMotorGroup class, which follows the state
+of many motors of a Spec session at once.
+
+Instead of one SpecMotorA object per motor, each with its own channel
+slots, the group subscribes to one channel pattern per motor parameter
+(i.e. 'motor/*/position') with a single slot, and keeps the motors
+parameters in a numpy array with one row per motor. Notifications are
+batched : receivers get the indexes of the motors which changed, at most
+once per batch interval.
+
+Motors of a group can be moved together, by a single Spec command, and
+waited for with a single wait.
+"""
+
+__author__ = 'Matias Guijarro'
+__version__ = '1.0'
+
+import gevent
+import gevent.event
+
+try:
+    import numpy
+except:
+    numpy = None
+
+from .SpecClientError import SpecClientError, SpecClientTimeoutError, SpecClientNotConnectedError
+import SpecConnectionsManager
+import SpecEventsDispatcher
+import SpecCommand
+from .SpecMotor import NOTINITIALIZED, UNUSABLE, READY, MOVESTARTED, MOVING, ONLIMIT, NOLIMIT, LOWLIMIT, HIGHLIMIT
+
+(POSITION, STATE, LIMIT_HIT, LOW_LIMIT, HIGH_LIMIT, OFFSET, SIGN) = range(7)
+
+PARAMETERS = ('position', 'move_done', 'low_limit', 'high_limit', 'low_lim_hit', 'high_lim_hit', 'unusable', 'offset', 'sign')
+COLUMNS = { 'position': POSITION, 'low_limit': LOW_LIMIT, 'high_limit': HIGH_LIMIT, 'offset': OFFSET, 'sign': SIGN }
+
+
+class SpecMotorGroup:
+    """SpecMotorGroup class
+
+    Motors parameters are in the 'data' array, one row per motor (in the
+    order of the motor names), with columns POSITION, STATE (SpecMotor
+    state), LIMIT_HIT (SpecMotor limit flags, reset when the motor starts
+    moving), LOW_LIMIT and HIGH_LIMIT (dial units), OFFSET and SIGN ;
+    unknown values are NaN.
+
+    Signals:
+    positionsChanged(indexes, positions) -- arrays of the indexes and new positions of the motors which moved
+    statesChanged(indexes, states) -- arrays of the indexes and new states of the motors whose state changed
+    limitsChanged(indexes) -- array of the indexes of the motors whose limits, offset or sign changed
+    """
+    def __init__(self, motorNames = None, specVersion = None, interval = 0.05, deadband = 1E-6):
+        """Constructor
+
+        Keyword arguments:
+        motorNames -- sequence of motors mnemonics (defaults to None)
+        specVersion -- 'host:port' string representing a Spec server to connect to (defaults to None)
+        interval -- time to collect changes before emitting them, in seconds (defaults to 0.05)
+        deadband -- smallest position change reported (defaults to 1E-6)
+        """
+        if numpy is None:
+            raise SpecClientError("numpy is required for motor groups")
+
+        self.connection = None
+        self.specVersion = None
+        self.moveCommand = None
+        self.stateWaiters = []
+        self.interval = interval
+        self.deadband = deadband
+        self.motorNames = []
+        self.indexes = {}
+        self.data = numpy.empty((0, 7), numpy.float64)
+        self.changes = { 'positionsChanged': set(), 'statesChanged': set(), 'limitsChanged': set() }
+        self.flushScheduled = False
+
+        if motorNames is not None and specVersion is not None:
+            self.connectToSpec(motorNames, specVersion)
+
+
+    def __len__(self):
+        return len(self.motorNames)
+
+
+    def connectToSpec(self, motorNames, specVersion):
+        """Connect to a remote Spec, and subscribe to the motors channels
+
+        Arguments:
+        motorNames -- sequence of motors mnemonics
+        specVersion -- 'host:port' string representing a Spec server to connect to
+        """
+        self.specVersion = specVersion
+        self.motorNames = [str(name) for name in motorNames]
+        self.indexes = dict([(name, i) for i, name in enumerate(self.motorNames)])
+        self.data = numpy.empty((len(self.motorNames), 7), numpy.float64)
+        self.data.fill(numpy.nan)
+        self.data[:, STATE] = NOTINITIALIZED
+        self.data[:, LIMIT_HIT] = NOLIMIT
+
+        self.connection = SpecConnectionsManager.SpecConnectionsManager().getConnection(specVersion)
+        SpecEventsDispatcher.connect(self.connection, 'disconnected', self._disconnected)
+        self.moveCommand = SpecCommand.SpecCommand('move_em', self.connection)
+
+        for parameter in PARAMETERS:
+            self.connection.registerPattern('motor/*/%s' % parameter, self._channelUpdate, names = self.motorNames,
+                                            dispatchMode = SpecEventsDispatcher.FIREEVENT)
+
+
+    def isSpecConnected(self):
+        return self.connection is not None and self.connection.isSpecConnected()
+
+
+    def _disconnected(self):
+        for index in range(len(self.motorNames)):
+            self._changeState(index, NOTINITIALIZED)
+
+
+    def _channelUpdate(self, chanName, value):
+        try:
+            motorName, parameter = chanName.split('/')[1:]
+            index = self.indexes[motorName]
+        except (ValueError, KeyError):
+            # motor of another group
+            return
+
+        if value is None:
+            return
+
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+
+        row = self.data[index]
+
+        if parameter == 'position':
+            if not abs(value - row[POSITION]) <= self.deadband:
+                row[POSITION] = value
+                self._changed('positionsChanged', (index, ))
+        elif parameter in COLUMNS:
+            row[COLUMNS[parameter]] = value
+            self._changed('limitsChanged', (index, ))
+        elif parameter == 'move_done':
+            if value:
+                row[LIMIT_HIT] = NOLIMIT
+                self._changeState(index, MOVING)
+            elif row[STATE] in (MOVING, MOVESTARTED, NOTINITIALIZED):
+                self._changeState(index, READY)
+        elif parameter == 'unusable':
+            self._changeState(index, value and UNUSABLE or READY)
+        elif value:
+            # limit hit
+            row[LIMIT_HIT] = int(row[LIMIT_HIT]) | (parameter == 'low_lim_hit' and LOWLIMIT or HIGHLIMIT)
+            self._changeState(index, ONLIMIT)
+
+
+    def _changeState(self, index, state):
+        if self.data[index, STATE] != state:
+            self.data[index, STATE] = state
+            self._changed('statesChanged', (index, ))
+
+            for event in self.stateWaiters:
+                event.set()
+
+
+    def _changed(self, signal, indexes):
+        self.changes[signal].update(indexes)
+
+        if not self.flushScheduled:
+            self.flushScheduled = True
+            gevent.spawn_later(self.interval, self.flush)
+
+
+    def flush(self):
+        """Emit the signals for the changes collected since the last call"""
+        self.flushScheduled = False
+
+        for signal, changed in self.changes.iteritems():
+            if len(changed) == 0:
+                continue
+
+            indexes = numpy.array(sorted(changed), numpy.int32)
+            changed.clear()
+
+            if signal == 'positionsChanged':
+                SpecEventsDispatcher.emit(self, signal, (indexes, self.data[indexes, POSITION]))
+            elif signal == 'statesChanged':
+                SpecEventsDispatcher.emit(self, signal, (indexes, self.data[indexes, STATE].astype(numpy.int32)))
+            else:
+                SpecEventsDispatcher.emit(self, signal, (indexes, ))
+
+
+    def index(self, motorName):
+        """Return the index of a motor in the group arrays"""
+        return self.indexes[motorName]
+
+
+    def getSnapshot(self):
+        """Return a copy of the motors parameters array"""
+        return self.data.copy()
+
+
+    def getPositions(self):
+        return self.data[:, POSITION].copy()
+
+
+    def getPosition(self, motorName):
+        return self.data[self.indexes[motorName], POSITION]
+
+
+    def getStates(self):
+        return self.data[:, STATE].astype(numpy.int32)
+
+
+    def getState(self, motorName):
+        return int(self.data[self.indexes[motorName], STATE])
+
+
+    def getLimits(self):
+        """Return (low limits, high limits) arrays in user units"""
+        sign = self.data[:, SIGN]
+        offset = self.data[:, OFFSET]
+        lims = (self.data[:, LOW_LIMIT] * sign + offset, self.data[:, HIGH_LIMIT] * sign + offset)
+        return (numpy.minimum(*lims), numpy.maximum(*lims))
+
+
+    def move(self, positions, wait = False, timeout = None):
+        """Move motors together, and return the array of the indexes of the motors to move
+
+        The motors are started by a single Spec command ('get_angles; A[mne]=position; ...; move_em'),
+        so they start at the same time. Motors already at their position (within the deadband)
+        are not moved.
+
+        Arguments:
+        positions -- dictionary of { motor name: position, ... }, or sequence of positions
+        in the order of the group motors (NaN or None for the motors not to move)
+
+        Keyword arguments:
+        wait -- if True, wait for the end of the move (see waitMove)
+        timeout -- optional timeout for the command, and for the wait (defaults to None)
+
+        Exceptions:
+        SpecClientError -- if the command failed (i.e. a position is beyond limits)
+        """
+        if hasattr(positions, 'items'):
+            targets = [(self.indexes[str(name)], position) for name, position in positions.items()]
+        else:
+            targets = enumerate(positions)
+        targets = [(i, float(position)) for i, position in targets if position is not None and not numpy.isnan(position)]
+        targets = sorted([(i, position) for i, position in targets if not abs(position - self.data[i, POSITION]) <= self.deadband])
+
+        indexes = numpy.array([i for i, position in targets], numpy.int32)
+        if len(indexes) == 0:
+            return indexes
+
+        for i in indexes:
+            self.data[i, LIMIT_HIT] = NOLIMIT
+            self._changeState(i, MOVESTARTED)
+
+        command = 'get_angles; %s; move_em' % '; '.join(['A[%s]=%r' % (self.motorNames[i], position) for i, position in targets])
+        with gevent.Timeout(timeout, SpecClientTimeoutError):
+            try:
+                self.moveCommand.executeCommand(command, True)
+            except:
+                # motors did not start
+                for i in indexes:
+                    if self.data[i, STATE] == MOVESTARTED:
+                        self._changeState(i, READY)
+                raise
+
+            self._readMoveDone(indexes)
+
+        if wait:
+            self.waitMove(indexes, timeout)
+
+        return indexes
+
+
+    def _readMoveDone(self, indexes):
+        """Read 'move_done' for the motors still in MOVESTARTED state
+
+        Spec may not move some of the motors (i.e. already at their position
+        in dial units) ; no event comes for them, they would stay in
+        MOVESTARTED state.
+        """
+        names = ['motor/%s/move_done' % self.motorNames[i] for i in indexes if self.data[i, STATE] == MOVESTARTED]
+
+        reads = [gevent.spawn(self.connection.readChannel, name) for name in names]
+        try:
+            gevent.joinall(reads, raise_error = True)
+        finally:
+            gevent.killall(reads)
+
+        for name, read in zip(names, reads):
+            self._channelUpdate(name, read.value)
+
+
+    def waitMove(self, indexes = None, timeout = None):
+        """Wait until motors are not moving anymore
+
+        Keyword arguments:
+        indexes -- indexes of the motors to wait for (defaults to None, meaning all motors)
+        timeout -- optional timeout (defaults to None)
+
+        Exceptions:
+        SpecClientError -- as soon as one of the motors hits a limit
+        SpecClientTimeoutError -- if the motors are still moving after the timeout
+        SpecClientNotConnectedError -- if Spec gets disconnected
+        """
+        if indexes is None:
+            indexes = numpy.arange(len(self.motorNames))
+        else:
+            indexes = numpy.asarray(indexes, numpy.int32)
+
+        event = gevent.event.Event()
+        self.stateWaiters.append(event)
+
+        try:
+            with gevent.Timeout(timeout, SpecClientTimeoutError):
+                while True:
+                    event.clear()
+                    states = self.data[indexes, STATE]
+
+                    onLimit = indexes[states == ONLIMIT]
+                    if len(onLimit) > 0:
+                        raise SpecClientError("%s hit a limit" % ', '.join([self.motorNames[i] for i in onLimit]))
+
+                    if not numpy.any((states == MOVESTARTED) | (states == MOVING)):
+                        break
+
+                    event.wait()
+        finally:
+            self.stateWaiters.remove(event)
+
+        if not self.isSpecConnected():
+            raise SpecClientNotConnectedError
+
+
+    def stop(self):
+        """Stop the motors
+
+        Send an 'abort' message to the remote Spec
+        """
+        self.connection.abort()
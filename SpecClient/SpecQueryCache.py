@@ -0,0 +1,91 @@
+"""SpecQueryCache module
+
+This module defines the SpecQueryCache class, which memorizes the results
+of idempotent queries to Spec (motors mnemonics, counters types, ...), and
+the 'idempotent' decorator to declare such queries.
+
+Each connection has its own SpecQueryCache object ; it is cleared when
+Spec gets disconnected, when Spec answers the handshake (it may have been
+restarted), and when the configuration change channel of the connection
+gets updated (see SpecConnection.setConfigChangeChannel).
+"""
+
+__author__ = 'Matias Guijarro'
+__version__ = '1.0'
+
+import copy
+
+
+class SpecQueryCache:
+    """SpecQueryCache class
+
+    Results of queries, indexed by (query name, Spec object name, arguments)
+    """
+    def __init__(self):
+        """Constructor."""
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        """Return the result stored for key, or raise KeyError"""
+        try:
+            result = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        else:
+            self.hits += 1
+            return result
+
+
+    def set(self, key, result):
+        self.entries[key] = result
+
+
+    def invalidate(self, name = None, specName = None):
+        """Remove the results of a query, or of the queries about a Spec object
+
+        Keyword arguments:
+        name -- query name (defaults to None, meaning any query)
+        specName -- name of the Spec object (defaults to None, meaning any object)
+        """
+        for key in self.entries.keys():
+            if (name is None or key[0] == name) and (specName is None or key[1] == specName):
+                del self.entries[key]
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+def idempotent(method):
+    """Decorator for methods querying Spec, whose result only changes with Spec configuration
+
+    The object must have a 'connection' attribute ; results are stored in the
+    connection query cache, indexed by method name, the 'specName' attribute
+    of the object (if any) and the call arguments. The cache is not used when
+    Spec is not connected. A copy of the stored result is returned.
+    """
+    name = method.__name__
+
+    def cachedMethod(self, *args):
+        connection = self.connection
+
+        if connection is None or not connection.isSpecConnected():
+            return method(self, *args)
+
+        # not getattr: Spec objects make commands out of unknown attributes
+        key = (name, self.__dict__.get('specName'), args)
+        try:
+            result = connection.queryCache.get(key)
+        except KeyError:
+            result = method(self, *args)
+            connection.queryCache.set(key, result)
+
+        return copy.deepcopy(result)
+
+    cachedMethod.__name__ = name
+    cachedMethod.__doc__ = method.__doc__
+    return cachedMethod
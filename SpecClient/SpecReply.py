@@ -7,7 +7,10 @@ This module defines the SpecReply class
 __author__ = 'Matias Guijarro'
 __version__ = '1.0'
 
+import gevent.event
+
 import SpecEventsDispatcher
+from .SpecClientError import SpecClientError, SpecClientTimeoutError
 
 REPLY_ID_LIMIT = 2**30
 current_id = 0
@@ -22,7 +25,8 @@ def getNextReplyId():
 class SpecReply:
     """SpecReply class
 
-    Represent a reply received from a remote Spec server
+    Represent a reply received from a remote Spec server ; the reply
+    object is also a future, on which the reply can be waited for
 
     Signals:
     replyFromSpec(self) -- emitted on update
@@ -35,17 +39,44 @@ class SpecReply:
         self.id = getNextReplyId()
 
         self.callback = None
+        self.arrived = gevent.event.Event()
+
+        # filled by the connection, for tracing
+        self.sendTime = None
+        self.replyTime = None
+        self.requestSize = 0
+        self.replySize = 0
 
     def update(self, data, error, error_code):
         """Emit the 'replyFromSpec' signal."""
         self.data = data
         self.error = error
         self.error_code = error_code
+        self.arrived.set()
 
         if callable(self.callback):
           self.callback(self)
 
 
+    def wait(self, timeout = None):
+        """Wait for the reply to arrive, and return its value
+
+        Keyword arguments:
+        timeout -- optional timeout (defaults to None)
+
+        Exceptions:
+        SpecClientError -- if Spec replied with an error
+        SpecClientTimeoutError -- if the reply did not arrive before the timeout
+        """
+        if not self.arrived.wait(timeout):
+            raise SpecClientTimeoutError
+
+        if self.error:
+            raise SpecClientError('Server request did not complete: %s' % self.data, self.error_code)
+
+        return self.data
+
+
     def getValue(self):
         """Return the value of the reply object (data field)."""
         return self.data
@@ -137,15 +137,20 @@ class SpecVariableA:
         pass
 
 
-    def getValue(self, timeout=None):
-        """Return the watched variable current value."""
+    def getValue(self, timeout=None, max_age=None):
+        """Return the watched variable current value.
+
+        Keyword arguments:
+        timeout -- optional timeout
+        max_age -- accept a value received less than max_age seconds ago (defaults to None)
+        """
         if self.connection is not None:
             timeout = self.timeout if timeout is None else timeout
             chan = self.connection.getChannel(self.channelName)
             if timeout is None:
-                return chan.read()
+                return chan.read(max_age=max_age)
             else:
-                return chan.read(timeout=timeout)
+                return chan.read(timeout=timeout, max_age=max_age)
 
 
     def setValue(self, value):
@@ -166,14 +171,19 @@ class SpecVariable(SpecVariableA):
     Thin wrapper around SpecChannel objects, to make
     variables watching, setting and getting values easier.
     """
-    def getValue(self, timeout=None):
-        """Return the watched variable current value."""
+    def getValue(self, timeout=None, max_age=None):
+        """Return the watched variable current value.
+
+        Keyword arguments:
+        timeout -- optional timeout
+        max_age -- accept a value received less than max_age seconds ago (defaults to None)
+        """
         timeout = self.timeout if timeout is None else timeout
         chan = self.connection.getChannel(self.channelName)
         if timeout is None:
-            return chan.read(force_read=True)
+            return chan.read(force_read=True, max_age=max_age)
         else:
-            return chan.read(timeout=timeout, force_read=True)
+            return chan.read(timeout=timeout, force_read=True, max_age=max_age)
 
 
     def setValue(self, value):
@@ -196,11 +206,12 @@ class SpecVariable(SpecVariableA):
         timeout -- optional timeout
         """
         if self.isSpecConnected():
-            w = SpecWaitObject.SpecWaitObject(self.connection)
-
-            w.waitChannelUpdate(self.channelName, waitValue = waitValue, timeout = timeout)
+            if waitValue is None:
+                predicate = None
+            else:
+                predicate = lambda value: value == waitValue
 
-            return w.value
+            return SpecWaitObject.waitFor(self.channelName, self.connection, predicate, timeout, checkCurrent = False)
 
 
 
@@ -5,11 +5,15 @@ designed for waiting specific events from Spec
 
 Classes:
 SpecWaitObject -- base class for Wait objects
+ChannelWaiter -- condition on channel values, checked by the channels themselves
 
 Functions:
 waitChannel -- wait for a channel update
 waitReply -- wait for a reply
 waitConnection -- wait for a connection
+waitFor -- wait for a channel value to satisfy a condition
+waitAny -- wait for any of several channel conditions
+waitAll -- wait for all of several channel conditions
 """
 
 __author__ = 'Matias Guijarro'
@@ -22,7 +26,7 @@ import gevent
 from gevent.util import wrap_errors
 
 import SpecEventsDispatcher
-from .SpecClientError import SpecClientError, SpecClientTimeoutError
+from .SpecClientError import SpecClientTimeoutError, SpecClientNotConnectedError
 import SpecConnectionsManager
 
 
@@ -53,7 +57,6 @@ class SpecWaitObject:
         self.isdisconnected = True
         self.channelWasUnregistered = False
         self.value = None
-        self.spec_reply_arrived_event = gevent.event.Event()
         self.channel_updated_event = gevent.event.Event()
 
         SpecEventsDispatcher.connect(connection, 'connected', self.connected)
@@ -81,23 +84,10 @@ class SpecWaitObject:
         argsTuple -- tuple of arguments to be passed to the command
         timeout -- optional timeout (defaults to None)
         """
-        with gevent.Timeout(timeout, SpecClientTimeoutError):
-            self.waitConnection()
-            connection = self.connection()
-
-            if connection is not None:
-                try:
-                    func = getattr(connection, command)
-                except:
-                    return
-                else:
-                    self.spec_reply_arrived_event.clear()
+        connection = self.connection()
 
-                    if callable(func):
-                        func(*argsTuple)
-                    
-                    self.spec_reply_arrived_event.wait(timeout)
-                
+        if connection is not None:
+            self.value = waitReply(connection, command, argsTuple, timeout)
 
 
     def waitChannelUpdate(self, chanName, waitValue = None, timeout = None):
@@ -151,17 +141,6 @@ class SpecWaitObject:
           connection.connected_event.wait(timeout)
         
 
-    def replyArrived(self, reply):
-        """Callback triggered by a reply from Spec."""
-        self.spec_reply_arrived_event.set()
-        value = reply.getValue()
-
-        if reply.error:
-            raise SpecClientError('Server request did not complete: %s' % value, reply.error_code)
-
-        self.value = value
-        
-
     def channelUpdated(self, channelValue):
         """Callback triggered by a channel update
 
@@ -178,6 +157,146 @@ class SpecWaitObject:
             self.channel_updated_event.set()
 
 
+class ChannelWaiter(object):
+    """Condition on the values of one or several channels
+
+    The waiter is put in the 'waiters' list of the registered channel
+    objects, which call check() with each new value ; there is no
+    dispatcher connection and a single event per wait.
+    """
+    __slots__ = ('conditions', 'needed', 'skip', 'values', 'error', 'event')
+
+    def __init__(self, conditions, needed):
+        """Constructor
+
+        Arguments:
+        conditions -- dictionary of { channel name: predicate or None (any update), ... }
+        needed -- number of conditions to satisfy
+        """
+        self.conditions = conditions
+        self.needed = needed
+        self.skip = set() # channels for which the value sent on registration is ignored
+        self.values = {}  # { channel name: value which satisfied the condition, ... }
+        self.error = None
+        self.event = gevent.event.Event()
+
+
+    def check(self, chanName, value):
+        if chanName in self.values or self.event.is_set():
+            return
+        if chanName in self.skip:
+            self.skip.discard(chanName)
+            return
+
+        predicate = self.conditions[chanName]
+        try:
+            if predicate is not None and not predicate(value):
+                return
+        except Exception, err:
+            self.abort(err)
+        else:
+            self.values[chanName] = value
+            if len(self.values) >= self.needed:
+                self.event.set()
+
+
+    def abort(self, error):
+        self.error = error
+        self.event.set()
+
+
+def _waitChannels(connection, conditions, needed, timeout, checkCurrent):
+    if not isinstance(conditions, dict):
+        conditions = dict.fromkeys(conditions)
+    waiter = ChannelWaiter(conditions, min(needed, len(conditions)))
+    channels = []
+
+    with gevent.Timeout(timeout, SpecClientTimeoutError):
+        connection.connected_event.wait()
+
+        try:
+            for chanName in conditions:
+                isNew = not chanName in connection.registeredChannels
+                channel = connection.addChannel(chanName)
+                channel.waiters.append(waiter)
+                channels.append(channel)
+
+                if conditions[chanName] is not None and checkCurrent:
+                    if channel.value is not None:
+                        waiter.check(chanName, channel.value)
+                elif isNew and channel.value is None:
+                    waiter.skip.add(chanName)
+
+            if waiter.needed > 0:
+                waiter.event.wait()
+        finally:
+            for channel in channels:
+                channel.waiters.remove(waiter)
+
+    if waiter.error is not None:
+        raise waiter.error
+
+    return waiter.values
+
+
+def waitFor(chanName, connection, predicate = None, timeout = None, checkCurrent = True):
+    """Wait for a channel value to satisfy a condition
+
+    The channel is registered if needed, and stays registered afterwards.
+
+    Arguments:
+    chanName -- channel name (e.g 'var/toto')
+    connection -- a SpecConnection object
+
+    Keyword arguments:
+    predicate -- callable taking the channel value, returning True when the condition is
+    satisfied (defaults to None, meaning any update)
+    timeout -- optional timeout (defaults to None)
+    checkCurrent -- if True (default), the current channel value can satisfy the condition ;
+    if False, wait for an update
+
+    Return the value satisfying the condition.
+    """
+    return _waitChannels(connection, { chanName: predicate }, 1, timeout, checkCurrent)[chanName]
+
+
+def waitAny(conditions, connection, timeout = None, checkCurrent = True):
+    """Wait for any of several channel conditions
+
+    Arguments:
+    conditions -- dictionary of { channel name: predicate, ... } (see waitFor), or
+    sequence of channel names to wait for any update
+    connection -- a SpecConnection object
+
+    Keyword arguments:
+    timeout -- optional timeout (defaults to None)
+    checkCurrent -- see waitFor
+
+    Return a (channel name, value) tuple for the first condition satisfied.
+    """
+    return _waitChannels(connection, conditions, 1, timeout, checkCurrent).items()[0]
+
+
+def waitAll(conditions, connection, timeout = None, checkCurrent = True):
+    """Wait for all of several channel conditions
+
+    A condition stays satisfied once it has been, even if the channel
+    value changes while waiting for the other ones.
+
+    Arguments:
+    conditions -- dictionary of { channel name: predicate, ... } (see waitFor), or
+    sequence of channel names to wait for any update
+    connection -- a SpecConnection object
+
+    Keyword arguments:
+    timeout -- optional timeout (defaults to None)
+    checkCurrent -- see waitFor
+
+    Return a dictionary of { channel name: value satisfying the condition, ... }
+    """
+    return _waitChannels(connection, conditions, len(conditions), timeout, checkCurrent)
+
+
 def waitConnection(connection, timeout = None):
     """Wait for a connection to Spec to be established
 
@@ -216,12 +335,19 @@ def waitReply(connection, command, argsTuple, timeout = None):
     command -- command to execute
     argsTuple -- tuple of arguments for the command
     timeout -- optional timeout (defaults to None)
-    """
-    w = SpecWaitObject(connection)
-    
-    w.waitReply(command, argsTuple, timeout=timeout)
 
-    return w.value
+    The command must return a SpecReply object. On timeout, the reply
+    is removed from the connection pending replies.
+    """
+    with gevent.Timeout(timeout, SpecClientTimeoutError):
+        connection.connected_event.wait()
+
+        reply = getattr(connection, command)(*argsTuple)
+        try:
+            return reply.wait()
+        except:
+            connection.registeredReplies.pop(reply.id, None)
+            raise
 
 
 
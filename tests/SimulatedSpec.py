@@ -0,0 +1,140 @@
+"""Simulated Spec server for the tests
+
+A gevent server speaking the Spec protocol, in the test process : it keeps
+channel values in the 'values' dictionary, sends events for the registered
+channels, and answers commands with the 'commands' functions.
+"""
+
+import gevent
+import gevent.server
+
+import SpecClient
+from SpecClient import SpecMessage
+from SpecClient import SpecConnectionsManager
+from SpecClient import SpecWaitObject
+
+SpecClient.setLoggingOff()
+
+
+class SimulatedSpecClient:
+    def __init__(self, server, sock):
+        self.server = server
+        self.socket = sock
+        self.version = None
+        self.registered = set()
+
+    def send(self, message):
+        self.socket.sendall(message.sendingString())
+
+    def sendEvent(self, chanName, value, deleted = False):
+        message = SpecMessage.msg_event(chanName, value, version = self.version)
+        if deleted:
+            message.flags = SpecMessage.DELETED
+        self.send(message)
+
+    def serve(self):
+        received = ''
+        message = None
+
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except Exception:
+                break
+            if not data:
+                break
+            received += data
+
+            offset = 0
+            while offset < len(received):
+                if message is None:
+                    message = SpecMessage.message(version = self.version)
+                consumed = message.readFromStream(received[offset:])
+                if consumed == 0:
+                    break
+                offset += consumed
+
+                if message.isComplete():
+                    self.server.received.append(message)
+                    self.dispatch(message)
+                    message = None
+            received = received[offset:]
+
+    def dispatch(self, message):
+        if message.cmd == SpecMessage.HELLO:
+            self.version = message.vers
+            self.send(SpecMessage.msg_hello_reply(message.sn, self.server.name, version = self.version))
+        elif message.cmd == SpecMessage.REGISTER:
+            self.registered.add(message.name)
+            if message.name in self.server.values:
+                self.sendEvent(message.name, self.server.values[message.name])
+        elif message.cmd == SpecMessage.UNREGISTER:
+            self.registered.discard(message.name)
+        elif message.cmd == SpecMessage.CHAN_READ:
+            self.send(SpecMessage.reply_message(message.sn, message.name, self.server.values.get(message.name), version = self.version))
+        elif message.cmd == SpecMessage.CHAN_SEND:
+            self.server.setValue(message.name, message.data)
+        elif message.cmd in (SpecMessage.CMD_WITH_RETURN, SpecMessage.FUNC_WITH_RETURN):
+            try:
+                result = self.server.execute(message.data)
+            except Exception, e:
+                self.send(SpecMessage.error_message(message.sn, '', str(e), version = self.version))
+            else:
+                self.send(SpecMessage.reply_message(message.sn, '', result, version = self.version))
+
+
+class SimulatedSpec:
+    """Simulated Spec server
+
+    'received' is the list of the messages received from the clients ;
+    'commands' is a dictionary of { command name: function, ... }, the
+    functions are called with the command string and return the reply.
+    """
+    def __init__(self, name = 'simulated'):
+        self.name = name
+        self.values = {}
+        self.commands = {}
+        self.received = []
+        self.clients = []
+        self.server = gevent.server.StreamServer(('127.0.0.1', 0), self._handle)
+        self.server.start()
+        self.specVersion = '127.0.0.1:%d' % self.server.server_port
+
+    def _handle(self, sock, address):
+        client = SimulatedSpecClient(self, sock)
+        self.clients.append(client)
+        try:
+            client.serve()
+        finally:
+            self.clients.remove(client)
+
+    def connect(self, timeout = 5):
+        """Return the connection of the connections manager to this server, once connected"""
+        connection = SpecConnectionsManager.SpecConnectionsManager().getConnection(self.specVersion)
+        SpecWaitObject.waitConnection(connection, timeout)
+        return connection
+
+    def stop(self):
+        SpecConnectionsManager.SpecConnectionsManager().closeConnection(self.specVersion)
+        for client in list(self.clients):
+            client.socket.close()
+        self.server.stop()
+
+    def execute(self, command):
+        name = command.split(SpecMessage.NULL)[0].split('(')[0].split()[0]
+        return self.commands[name](command)
+
+    def setValue(self, chanName, value):
+        """Change a channel value, and send the events"""
+        self.values[chanName] = value
+        self.sendEvent(chanName, value)
+
+    def sendEvent(self, chanName, value, deleted = False):
+        """Send an event to the clients which registered the channel"""
+        for client in list(self.clients):
+            if chanName in client.registered:
+                client.sendEvent(chanName, value, deleted)
+
+    def messages(self, cmd):
+        """Return the messages of a type received from the clients"""
+        return [message for message in self.received if message.cmd == cmd]
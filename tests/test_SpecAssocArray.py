@@ -0,0 +1,126 @@
+import random
+import unittest
+
+import SpecClient
+from SpecClient import SpecAssocArray
+
+
+class CollidingKey(object):
+    """Key with a fixed hash value"""
+    def __init__(self, name, h = 42):
+        self.name = name
+        self.h = h
+
+    def __hash__(self):
+        return self.h
+
+    def __eq__(self, other):
+        return isinstance(other, CollidingKey) and other.name == self.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'CollidingKey(%r)' % self.name
+
+
+class TestSpecAssocArray(unittest.TestCase):
+    def assertSameContents(self, assoc, data):
+        self.assertEqual(len(assoc), len(data))
+        self.assertEqual(dict(assoc.iteritems()), data)
+        for key, value in data.iteritems():
+            self.assertTrue(key in assoc)
+            self.assertEqual(assoc[key], value)
+
+    def test_empty(self):
+        assoc = SpecAssocArray.SpecAssocArray()
+        self.assertEqual(len(assoc), 0)
+        self.assertEqual(list(assoc), [])
+        self.assertRaises(KeyError, assoc.__getitem__, 'a')
+        self.assertTrue(assoc.merged() is assoc)
+
+    def test_mapping(self):
+        data = dict([(str(i), i) for i in range(1000)])
+        assoc = SpecAssocArray.SpecAssocArray(data)
+
+        self.assertSameContents(assoc, data)
+        self.assertEqual(assoc, data)
+        self.assertEqual(sorted(assoc.keys()), sorted(data.keys()))
+        self.assertFalse('1000' in assoc)
+        self.assertEqual(assoc.get('1000', 'default'), 'default')
+
+        def setItem():
+            assoc['0'] = 1
+        self.assertRaises(TypeError, setItem)
+
+    def test_random_updates(self):
+        rand = random.Random(0)
+        data = {}
+        assoc = SpecAssocArray.SpecAssocArray()
+
+        for step in range(300):
+            changes = dict([(rand.randrange(500), rand.random()) for i in range(rand.randrange(10))])
+            deletions = [rand.randrange(500) for i in range(rand.randrange(10))]
+
+            previous, previousData = assoc, dict(data)
+            assoc = assoc.merged(changes, deletions)
+            data.update(changes)
+            for key in deletions:
+                data.pop(key, None)
+
+            self.assertSameContents(assoc, data)
+            # the previous value is unchanged
+            self.assertSameContents(previous, previousData)
+
+    def test_hash_collisions(self):
+        keys = [CollidingKey(i) for i in range(5)] + [CollidingKey('other', 42 + SpecAssocArray.WIDTH)]
+        data = dict([(key, i) for i, key in enumerate(keys)])
+        assoc = SpecAssocArray.SpecAssocArray(data)
+        self.assertSameContents(assoc, data)
+
+        assoc = assoc.merged({ keys[0]: 'changed', CollidingKey(5): 5 }, [keys[1], keys[2]])
+        data[keys[0]] = 'changed'
+        data[CollidingKey(5)] = 5
+        del data[keys[1]]
+        del data[keys[2]]
+        self.assertSameContents(assoc, data)
+
+        assoc = assoc.merged(deletions = data.keys())
+        self.assertSameContents(assoc, {})
+
+    def test_structural_sharing(self):
+        assoc = SpecAssocArray.SpecAssocArray({ 'a': { 'x': 1 }, 'b': { 'y': 2 } })
+        updated = assoc.merged({ 'b': { 'y': 3 } })
+
+        self.assertTrue(updated['a'] is assoc['a'])
+        self.assertEqual(updated['b'], { 'y': 3 })
+        self.assertEqual(assoc['b'], { 'y': 2 })
+
+        # same values: nothing changes
+        self.assertTrue(assoc.merged({ 'a': assoc['a'] }) is assoc)
+        self.assertTrue(assoc.merged(deletions = ['c']) is assoc)
+
+    def test_nested(self):
+        data = { 'a': { 'x': 1, 'y': { 'z': 2 } }, 'b': 3 }
+        assoc = SpecAssocArray.SpecAssocArray(data)
+
+        self.assertTrue(isinstance(assoc['a'], SpecAssocArray.SpecAssocArray))
+        self.assertTrue(isinstance(assoc['a']['y'], SpecAssocArray.SpecAssocArray))
+        self.assertEqual(assoc.toDict(), data)
+        self.assertEqual(type(assoc.toDict()['a']), dict)
+        self.assertTrue(SpecAssocArray.isAssoc(assoc))
+        self.assertTrue(SpecAssocArray.isAssoc(data))
+        self.assertFalse(SpecAssocArray.isAssoc([1]))
+
+    def test_equality(self):
+        a = SpecAssocArray.SpecAssocArray({ 'a': 1, 'b': 2 })
+        b = SpecAssocArray.SpecAssocArray({ 'b': 2, 'a': 1 })
+
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, a.merged({ 'c': 3 }))
+        self.assertNotEqual(a, a.merged({ 'a': 2 }))
+        self.assertNotEqual(a, { 'a': 1 })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+import unittest
+
+import SpecClient
+from SpecClient import SpecChannel
+from SpecClient import SpecAssocArray
+from SpecClient import SpecMessage
+from SpecClient import SpecCommand
+from SpecClient import SpecEventsDispatcher
+
+
+class FakeConnection:
+    """Connection answering channel reads from a dictionary"""
+    def __init__(self, values):
+        self.values = values
+        self.channelCache = SpecChannel.SpecChannelCache()
+        self.channelPatterns = SpecChannel.SpecChannelPatternIndex()
+
+    def isSpecConnected(self):
+        return False
+
+    def readChannel(self, chanName, timeout = None):
+        return self.values.get(chanName)
+
+
+class TestTemporaryChannelRead(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection({ 'var/X': { 'a': '1', 'b': '2' } })
+
+    def test_deleted_key(self):
+        channel = SpecChannel.SpecChannel(self.connection, 'var/X', SpecChannel.DONTREG)
+        self.assertEqual(dict(channel.read()), { 'a': '1', 'b': '2' })
+
+        self.connection.values['var/X'] = { 'a': '1' }
+        self.assertEqual(dict(channel.read()), { 'a': '1' })
+
+    def test_deleted_subkey(self):
+        channel = SpecChannel.SpecChannel(self.connection, 'var/X/b', SpecChannel.DONTREG)
+        self.assertEqual(channel.read(), 2)
+
+        self.connection.values['var/X'] = { 'a': '1' }
+        self.assertEqual(channel.read(), None)
+
+
+class TestSubKeyUpdate(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection({})
+
+    def test_shared_assoc_array(self):
+        channel = SpecChannel.SpecChannel(self.connection, 'var/X/k', SpecChannel.DONTREG)
+        parent = SpecAssocArray.SpecAssocArray({ 'k': { 'a': 1, 'b': 2 }, 'l': 3 })
+
+        channel.update(parent)
+        self.assertTrue(channel.value is parent['k'])
+
+    def test_plain_dict(self):
+        channel = SpecChannel.SpecChannel(self.connection, 'var/X/k', SpecChannel.DONTREG)
+
+        channel.update({ 'k': { 'a': 1, 'b': 2 } })
+        self.assertTrue(isinstance(channel.value, SpecAssocArray.SpecAssocArray))
+        self.assertEqual(dict(channel.value), { 'a': 1, 'b': 2 })
+
+
+class TestValueAsArgument(unittest.TestCase):
+    def test_command_argument(self):
+        connection = FakeConnection({ 'var/X': { 'a': '1' } })
+        value = SpecChannel.SpecChannel(connection, 'var/X', SpecChannel.DONTREG).read()
+        self.assertTrue(isinstance(value, SpecAssocArray.SpecAssocArray))
+
+        self.assertEqual(SpecMessage.commandListToCommandString(['f', value, 2]), "f\000['a': '1']\0002")
+        self.assertEqual(SpecCommand.commandString(['f', value]), "f(['a': '1'])")
+
+    def test_batch_argument(self):
+        connection = FakeConnection({ 'var/X': { 'a': { 'b': '1' } } })
+        value = SpecChannel.SpecChannel(connection, 'var/X/a', SpecChannel.DONTREG).read()
+
+        batch = SpecCommand.SpecCommandBatch(connection)
+        batch.add('f', value)
+        self.assertEqual(batch.calls, ["f(['b': '1'])"])
+
+
+class TestDeltas(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection({})
+        self.channel = SpecChannel.SpecChannel(self.connection, 'var/A', SpecChannel.DONTREG)
+        self.deltas = []
+        SpecEventsDispatcher.connect(self.channel, 'valueDelta', self.valueDelta)
+
+    def valueDelta(self, value, changedKeys, deletedKeys):
+        self.deltas.append((value, changedKeys, deletedKeys))
+
+    def test_whole_value(self):
+        self.channel.update({ 'a': '1', 'b': '2' })
+
+        value, changedKeys, deletedKeys = self.deltas[-1]
+        self.assertEqual(value, { 'a': '1', 'b': '2' })
+        self.assertEqual((changedKeys, deletedKeys), (None, None))
+
+    def test_changed_keys(self):
+        self.channel.update({ 'a': '1', 'b': '2', 'c': { 'x': '3' } })
+        first = self.channel.value
+
+        self.channel.update({ 'b': '20', 'd': '4' })
+        value, changedKeys, deletedKeys = self.deltas[-1]
+        self.assertEqual(value, { 'a': '1', 'b': '20', 'c': { 'x': '3' }, 'd': '4' })
+        self.assertEqual(changedKeys, frozenset(['b', 'd']))
+        self.assertEqual(deletedKeys, frozenset())
+        # unchanged keys are shared with the previous value, which is unchanged
+        self.assertTrue(value['c'] is first['c'])
+        self.assertEqual(first, { 'a': '1', 'b': '2', 'c': { 'x': '3' } })
+
+        self.channel.update({ 'c': { 'y': '5' } })
+        value, changedKeys, deletedKeys = self.deltas[-1]
+        self.assertEqual(value['c'], { 'x': '3', 'y': '5' })
+        self.assertEqual(changedKeys, frozenset(['c']))
+
+    def test_deleted_keys(self):
+        self.channel.update({ 'a': '1', 'b': '2', 'c': { 'x': '3', 'y': '4' } })
+
+        self.channel.update({ 'b': '', 'c': { 'x': '' } }, deleted = True)
+        value, changedKeys, deletedKeys = self.deltas[-1]
+        self.assertEqual(value, { 'a': '1', 'c': { 'y': '4' } })
+        self.assertEqual(changedKeys, frozenset(['c']))
+        self.assertEqual(deletedKeys, frozenset(['b']))
+
+    def test_not_assoc(self):
+        self.channel.update(3)
+        self.assertEqual(self.deltas[-1], (3, None, None))
+
+
+class TestDeadband(unittest.TestCase):
+    def setUp(self):
+        self.channel = SpecChannel.SpecChannel(FakeConnection({}), 'var/x', SpecChannel.DONTREG)
+        self.all = []
+        self.filtered = []
+        self.relative = []
+        SpecEventsDispatcher.connect(self.channel, 'valueChanged', self.allChanged)
+        SpecEventsDispatcher.connect(self.channel, self.channel.deadbandSignal(0.5), self.filteredChanged)
+        SpecEventsDispatcher.connect(self.channel, self.channel.deadbandSignal(relative = 0.1), self.relativeChanged)
+
+    def allChanged(self, value):
+        self.all.append(value)
+
+    def filteredChanged(self, value):
+        self.filtered.append(value)
+
+    def relativeChanged(self, value):
+        self.relative.append(value)
+
+    def update(self, values):
+        for value in values:
+            self.channel.update(value)
+
+    def test_absolute(self):
+        self.update([1.0, 1.2, 1.4, 1.6, 1.7, 1.0])
+
+        self.assertEqual(self.all, [1.0, 1.2, 1.4, 1.6, 1.7, 1.0])
+        # compared to the last value emitted for this deadband
+        self.assertEqual(self.filtered, [1.0, 1.6, 1.0])
+
+    def test_relative(self):
+        self.update([100.0, 105.0, 111.0, 121.0, 122.0, 123.0])
+        self.assertEqual(self.relative, [100.0, 111.0, 123.0])
+
+    def test_same_signal(self):
+        self.assertEqual(self.channel.deadbandSignal(0.5), self.channel.deadbandSignal(absolute = 0.5, relative = 0))
+        self.assertNotEqual(self.channel.deadbandSignal(0.5), self.channel.deadbandSignal(0.25))
+
+    def test_always_emitted(self):
+        self.update([1.0, 'text', 'text', 1.1])
+        self.assertEqual(self.filtered, [1.0, 'text', 'text', 1.1])
+
+        self.channel.update(1.2, force = True)
+        self.channel.update(None, deleted = True)
+        self.assertEqual(self.filtered[-2:], [1.2, None])
+
+    def test_disconnected(self):
+        self.update([1.0])
+        self.channel.disconnected()
+        self.update([1.1])
+        self.assertEqual(self.filtered, [1.0, 1.1])
+
+
+class TestPatternIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SpecChannel.SpecChannelPatternIndex()
+
+    def matching(self, chanName):
+        return sorted([patternObj.pattern for patternObj in self.index.match(chanName)])
+
+    def test_match(self):
+        for pattern in ('motor/*/position', 'motor/m1/*', 'motor/m1/position', 'var/**', '*/*/position'):
+            self.index.add(pattern)
+
+        self.assertEqual(self.matching('motor/m1/position'), ['*/*/position', 'motor/*/position', 'motor/m1/*', 'motor/m1/position'])
+        self.assertEqual(self.matching('motor/m2/position'), ['*/*/position', 'motor/*/position'])
+        self.assertEqual(self.matching('motor/m1/offset'), ['motor/m1/*'])
+        self.assertEqual(self.matching('var/x'), ['var/**'])
+        self.assertEqual(self.matching('var/x/key'), ['var/**'])
+        self.assertEqual(self.matching('var'), [])
+        self.assertEqual(self.matching('motor/m1'), [])
+        self.assertEqual(self.matching('motor/m1/position/x'), [])
+
+    def test_add_remove(self):
+        patternObj = self.index.add('motor/*/position')
+        self.assertTrue(self.index.add('motor/*/position') is patternObj)
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.matching('motor/m1/position'), ['motor/*/position'])
+
+        # the cached matches follow the changes of the index
+        self.index.add('motor/m1/*')
+        self.assertEqual(self.matching('motor/m1/position'), ['motor/*/position', 'motor/m1/*'])
+        self.index.remove('motor/*/position')
+        self.assertEqual(self.matching('motor/m1/position'), ['motor/m1/*'])
+        self.index.remove('unknown')
+        self.assertEqual(len(self.index), 1)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.index.add, 'var/**/x')
+
+    def test_expand(self):
+        patternObj = SpecChannel.SpecChannelPattern('motor/*/position')
+        self.assertEqual(patternObj.expand(['m1', 'm2']), ['motor/m1/position', 'motor/m2/position'])
+
+        patternObj = SpecChannel.SpecChannelPattern('*/*/position')
+        self.assertEqual(patternObj.expand([('motor', 'm1')]), ['motor/m1/position'])
+
+    def test_dispatch(self):
+        got = []
+        def valueChanged(chanName, value):
+            got.append((chanName, value))
+        SpecEventsDispatcher.connect(self.index.add('motor/*/position'), 'valueChanged', valueChanged)
+
+        self.index.dispatch('motor/m1/position', 1.0)
+        self.index.dispatch('motor/m1/offset', 2.0)
+        self.assertEqual(got, [('motor/m1/position', 1.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
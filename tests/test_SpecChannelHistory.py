@@ -0,0 +1,99 @@
+import time
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import SpecClient
+from SpecClient import SpecChannel
+from SpecClient import SpecChannelHistory
+from SpecClient.SpecChannelHistory import SERVER_TIME, LOCAL_TIME, VALUE
+
+from test_SpecChannel import FakeConnection
+
+
+@unittest.skipIf(numpy is None, "numpy is required for channel history")
+class TestSpecChannelHistory(unittest.TestCase):
+    def test_empty(self):
+        history = SpecChannelHistory.SpecChannelHistory(4)
+        self.assertEqual(len(history), 0)
+        self.assertEqual(history.last().shape, (0, 3))
+        self.assertEqual(list(history.values()), [])
+
+    def test_wraparound(self):
+        history = SpecChannelHistory.SpecChannelHistory(4)
+
+        for i in range(3):
+            history.append(i, localTime = i)
+        self.assertEqual(list(history.values()), [0, 1, 2])
+
+        for i in range(3, 10):
+            history.append(i, localTime = i)
+            self.assertEqual(len(history), 4)
+            self.assertEqual(list(history.values()), range(i - 3, i + 1))
+
+        self.assertEqual(list(history.values(2)), [8, 9])
+        self.assertEqual(list(history.values(10)), [6, 7, 8, 9])
+        self.assertEqual(list(history.last()[:, LOCAL_TIME]), [6, 7, 8, 9])
+
+    def test_copy(self):
+        history = SpecChannelHistory.SpecChannelHistory(2)
+        history.append(1)
+        history.append(2)
+
+        samples = history.last()
+        history.append(3)
+        self.assertEqual(list(samples[:, VALUE]), [1, 2])
+
+    def test_window(self):
+        history = SpecChannelHistory.SpecChannelHistory(8)
+        for i in range(10):
+            history.append(i, serverTime = 100 + i, localTime = i)
+
+        self.assertEqual(list(history.window(4, 6)[:, VALUE]), [4, 5, 6])
+        self.assertEqual(list(history.window(start = 8)[:, VALUE]), [8, 9])
+        self.assertEqual(list(history.window(end = 3)[:, VALUE]), [2, 3])
+        self.assertEqual(list(history.window(105, 106, column = SERVER_TIME)[:, VALUE]), [5, 6])
+        self.assertEqual(len(history.window()), 8)
+
+    def test_since(self):
+        history = SpecChannelHistory.SpecChannelHistory(8)
+        now = time.time()
+        history.append(1, localTime = now - 10)
+        history.append(2, localTime = now - 1)
+        history.append(3)
+
+        self.assertEqual(list(history.since(5)[:, VALUE]), [2, 3])
+        self.assertTrue(numpy.isnan(history.last(1)[0, SERVER_TIME]))
+
+    def test_clear(self):
+        history = SpecChannelHistory.SpecChannelHistory(2)
+        history.append(1)
+        history.clear()
+        self.assertEqual(len(history), 0)
+
+
+@unittest.skipIf(numpy is None, "numpy is required for channel history")
+class TestChannelHistory(unittest.TestCase):
+    def test_channel_updates(self):
+        channel = SpecChannel.SpecChannel(FakeConnection({}), 'var/x', SpecChannel.DONTREG)
+        history = channel.enableHistory(16)
+        self.assertTrue(channel.history is history)
+
+        channel.update(1, serverTime = 10.0)
+        channel.update('not a number')
+        channel.update(2.5)
+        channel.update(None, deleted = True)
+
+        self.assertEqual(list(history.values()), [1, 2.5])
+        self.assertEqual(history.last(2)[0, SERVER_TIME], 10.0)
+
+        channel.disableHistory()
+        channel.update(3)
+        self.assertEqual(len(history), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,298 @@
+import time
+import logging
+import unittest
+import gevent
+import gevent.event
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import SpecClient
+from SpecClient import SpecCommand
+from SpecClient import SpecCommandScheduler
+from SpecClient import SpecArgumentStager
+from SpecClient import SpecAssocArray
+from SpecClient import SpecReply
+from SpecClient import SpecMessage
+from SpecClient.SpecClientError import SpecClientTimeoutError, SpecClientBatchError
+
+from SimulatedSpec import SimulatedSpec
+
+
+class FakeConnection:
+    """Connection to a Spec which never replies, unless 'replies' is True"""
+    def __init__(self, scheduler = None, replies = False):
+        self.serverVersion = 4
+        self.registeredReplies = {}
+        self.commandScheduler = scheduler
+        self.argumentStager = SpecArgumentStager.SpecArgumentStager()
+        self.replies = replies
+        self.sent = []
+        self.written = {}
+        self.connected_event = gevent.event.Event()
+        self.connected_event.set()
+
+    def isSpecConnected(self):
+        return self.connected_event.is_set()
+
+    def send_msg_cmd_with_return(self, command):
+        self.sent.append(SpecCommand.commandString(command))
+        reply = SpecReply.SpecReply()
+        reply.sendTime = time.time()
+        self.registeredReplies[reply.id] = reply
+        if self.replies:
+            gevent.spawn(self.replyArrived, reply)
+        return reply
+
+    send_msg_func_with_return = send_msg_cmd_with_return
+
+    def send_msg_chan_send(self, chanName, value, wait = False):
+        self.sent.append(chanName)
+        self.written[chanName] = value
+
+    def replyArrived(self, reply):
+        del self.registeredReplies[reply.id]
+        reply.update(None, False, 0)
+
+
+def callback(value):
+    pass
+
+
+class CountingCommand(SpecCommand.SpecCommandA):
+    def __init__(self, *args, **kwargs):
+        SpecCommand.SpecCommandA.__init__(self, *args, **kwargs)
+        self.waits = 0
+
+    def beginWait(self):
+        self.waits += 1
+
+
+class TestCommandTimeout(unittest.TestCase):
+    def check_timeout(self, connection):
+        command = SpecCommand.SpecCommandA('sleep', connection)
+        command._set_callbacks(callback, callback)
+
+        self.assertRaises(SpecClientTimeoutError, command.executeCommand, 'sleep(10)', True, 0.01)
+        self.assertEqual(connection.registeredReplies, {})
+        self.assertEqual(command._SpecCommandA__replyCallbacks, {})
+
+    def test_timeout(self):
+        self.check_timeout(FakeConnection())
+
+    def test_scheduled_timeout(self):
+        self.check_timeout(FakeConnection(SpecCommandScheduler.SpecCommandScheduler()))
+
+
+@unittest.skipIf(numpy is None, "numpy is required for staged arguments")
+class TestStagedCall(unittest.TestCase):
+    def test_call_before_connection(self):
+        connection = FakeConnection(replies = True)
+        connection.connected_event.clear()
+        connection.serverVersion = None
+        command = SpecCommand.SpecCommandA('f', connection)
+
+        t = gevent.spawn(command, numpy.arange(4), wait = True)
+        gevent.sleep(0.01)
+        self.assertEqual(connection.sent, [])
+
+        # the server version is received with the connection
+        connection.serverVersion = 4
+        connection.connected_event.set()
+        t.get(timeout = 1)
+
+        self.assertEqual(connection.sent, ['unglobal _SC_ARG0; global long array _SC_ARG0[4]', 'var/_SC_ARG0', 'f(_SC_ARG0)'])
+
+    def test_scheduled_staging(self):
+        scheduler = SpecCommandScheduler.SpecCommandScheduler()
+        connection = FakeConnection(scheduler, replies = True)
+        command = SpecCommand.SpecCommandA('f', connection)
+
+        ticket = scheduler.acquire()
+        t = command(numpy.arange(4.0))
+        gevent.sleep(0.01)
+        # nothing is sent before the turn of the command
+        self.assertEqual(connection.sent, [])
+
+        scheduler.release(ticket)
+        t.get(timeout = 1)
+
+        self.assertEqual(connection.sent, ['unglobal _SC_ARG0; global double array _SC_ARG0[4]', 'var/_SC_ARG0', 'f(_SC_ARG0)'])
+        self.assertTrue(scheduler.current is None)
+
+    def test_assoc_array(self):
+        connection = FakeConnection(replies = True)
+        command = SpecCommand.SpecCommandA('f', connection)
+        data = dict([(str(i), i) for i in range(100)])
+
+        command(SpecAssocArray.SpecAssocArray(data), wait = True)
+
+        self.assertEqual(connection.sent, ['unglobal _SC_ARG0; global _SC_ARG0[]', 'var/_SC_ARG0', 'f(_SC_ARG0)'])
+        self.assertEqual(type(connection.written['var/_SC_ARG0']), dict)
+        self.assertEqual(connection.written['var/_SC_ARG0'], data)
+
+    def test_old_server(self):
+        scheduler = SpecCommandScheduler.SpecCommandScheduler()
+        connection = FakeConnection(scheduler, replies = True)
+        connection.serverVersion = 2
+        command = CountingCommand('f', connection)
+
+        command(numpy.arange(2), wait = True, priority = SpecCommandScheduler.INTERACTIVE)
+
+        self.assertEqual(connection.sent, ['f array([0, 1])'])
+        self.assertEqual(command.waits, 1)
+        self.assertEqual(scheduler.stats[SpecCommandScheduler.INTERACTIVE][0], 1)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.commands['global'] = self.runBatch
+        self.connection = self.spec.connect()
+        self.batch = SpecCommand.SpecCommandBatch(self.connection)
+        self.batch.add('motor_par', 'phi', 'step_size')
+        self.batch.add('counter_par', 0, 'disable')
+        self.batch.add('motor_par', 'chi', 'offset')
+        self.failing = None
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def runBatch(self, command):
+        """Run the batch as Spec does, until the failing call"""
+        results = {}
+        for statement in command.split('; '):
+            if statement.startswith('_SC_BATCH_INDEX='):
+                self.spec.values['var/_SC_BATCH_INDEX'] = int(statement.split('=')[1])
+            elif statement.startswith('_sc_results['):
+                index = self.spec.values['var/_SC_BATCH_INDEX']
+                if self.failing is not None and ('(%r,' % self.failing) in statement:
+                    raise Exception('motor_par: not a motor')
+                results[str(index)] = index * 1.5
+        return results
+
+    def test_results(self):
+        self.assertEqual(self.batch.execute(timeout = 1), [0, 1.5, 3])
+        self.assertEqual(self.spec.values['var/_SC_BATCH_INDEX'], -1)
+
+    def test_failed_call(self):
+        self.failing = 'chi'
+        try:
+            self.batch.execute(timeout = 1)
+        except SpecClientBatchError, err:
+            self.assertEqual(err.index, 2)
+            self.assertEqual(err.call, "motor_par('chi','offset')")
+            self.assertTrue('motor_par: not a motor' in str(err))
+        else:
+            self.fail('no SpecClientBatchError')
+
+    def test_unknown_call(self):
+        del self.spec.commands['global']
+        try:
+            self.batch.execute(timeout = 1)
+        except SpecClientBatchError, err:
+            self.assertEqual(err.index, None)
+            self.assertEqual(err.call, None)
+        else:
+            self.fail('no SpecClientBatchError')
+
+    def test_empty(self):
+        self.batch.clear()
+        self.assertEqual(self.batch.execute(timeout = 1), [])
+        self.assertEqual(self.spec.messages(SpecMessage.CMD_WITH_RETURN), [])
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.commands['f'] = self.f
+        self.spec.connect()
+        self.command = SpecCommand.SpecCommand('f', self.spec.specVersion)
+        self.delay = 0
+        self.sunk = []
+
+        self.logger = logging.getLogger("SpecClient")
+        self.level = self.logger.level
+        self.handler = RecordingHandler()
+        self.logger.setLevel(logging.WARNING)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        SpecCommand.setTracing(False)
+        SpecCommand.setSlowCommandThreshold(None)
+        SpecCommand.removeTraceSink(self.sink)
+        SpecCommand.traces.clear()
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        self.spec.stop()
+
+    def f(self, command):
+        gevent.sleep(self.delay)
+        return 1
+
+    def sink(self, trace):
+        self.sunk.append(trace)
+
+    def test_disabled(self):
+        self.assertFalse(SpecCommand.tracing)
+        self.command(1)
+        self.assertEqual(SpecCommand.getTraces(), [])
+
+    def test_trace(self):
+        SpecCommand.setTracing(True)
+        SpecCommand.addTraceSink(self.sink)
+        self.assertEqual(self.command(1, 'a'), 1)
+
+        traces = SpecCommand.getTraces()
+        self.assertEqual(len(traces), 1)
+        self.assertEqual(self.sunk, traces)
+        self.assertEqual(traces[0]['command'], "f(1, 'a')")
+        self.assertEqual(traces[0]['specVersion'], self.spec.specVersion)
+        self.assertFalse(traces[0]['error'])
+        self.assertFalse(traces[0]['timedOut'])
+        self.assertTrue(traces[0]['requestSize'] > 0 and traces[0]['replySize'] > 0)
+
+    def test_truncated_arguments(self):
+        SpecCommand.setTracing(True)
+        self.command('x' * 1000, 2)
+
+        self.command('x' * 1000, 'y' * 1000, 3)
+
+        commands = [trace['command'] for trace in SpecCommand.getTraces()]
+        self.assertEqual(commands[0], "f('%s..., 2)" % ('x' * (SpecCommand.TRACE_ARGUMENT_LENGTH - 4)))
+        self.assertTrue(commands[1].endswith("..., '%s..., 3)" % ('y' * (SpecCommand.TRACE_ARGUMENT_LENGTH - 4))))
+        self.assertEqual(len(commands[1]), 2 * SpecCommand.TRACE_ARGUMENT_LENGTH + 8)
+
+    def test_ring_size(self):
+        SpecCommand.setTracing(True, 2)
+        for i in range(3):
+            self.command(i)
+        self.assertEqual([trace['command'] for trace in SpecCommand.getTraces()], ['f(1)', 'f(2)'])
+        SpecCommand.setTracing(False, 1000)
+
+    def test_slow_command(self):
+        # the warning does not need tracing
+        SpecCommand.setSlowCommandThreshold(0.01)
+        self.command(1)
+        self.assertEqual(self.handler.messages, [])
+
+        self.delay = 0.05
+        self.command(2)
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue(self.handler.messages[0].startswith('Slow command f(2) on %s' % self.spec.specVersion))
+        self.assertEqual(SpecCommand.getTraces(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
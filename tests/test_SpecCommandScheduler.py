@@ -0,0 +1,101 @@
+import unittest
+import gevent
+
+import SpecClient
+from SpecClient import SpecCommand
+from SpecClient import SpecCommandScheduler
+from SpecClient import SpecMessage
+from SpecClient.SpecCommandScheduler import INTERACTIVE, AUTOMATION, BACKGROUND
+
+from SimulatedSpec import SimulatedSpec
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = SpecCommandScheduler.SpecCommandScheduler()
+        self.order = []
+
+    def runCommand(self, name, priority, source):
+        ticket = self.scheduler.acquire(priority, source)
+        self.order.append(name)
+        gevent.sleep(0)
+        self.scheduler.release(ticket)
+
+    def runAll(self, commands):
+        """Queue the commands behind a running one, and return the execution order"""
+        ticket = self.scheduler.acquire()
+        greenlets = [gevent.spawn(self.runCommand, *command) for command in commands]
+        gevent.sleep(0)
+        self.assertEqual(self.scheduler.depth(), len(commands))
+
+        self.scheduler.release(ticket)
+        gevent.joinall(greenlets, timeout = 1, raise_error = True)
+        self.assertTrue(self.scheduler.current is None)
+        return self.order
+
+    def test_priority(self):
+        order = self.runAll([('b1', BACKGROUND, None), ('a1', AUTOMATION, None), ('i1', INTERACTIVE, None), ('a2', AUTOMATION, None)])
+        self.assertEqual(order, ['i1', 'a1', 'a2', 'b1'])
+
+    def test_round_robin(self):
+        order = self.runAll([('x1', AUTOMATION, 'x'), ('x2', AUTOMATION, 'x'), ('x3', AUTOMATION, 'x'), ('y1', AUTOMATION, 'y'), ('z1', AUTOMATION, 'z'), ('y2', AUTOMATION, 'y')])
+        self.assertEqual(order, ['x1', 'y1', 'z1', 'x2', 'y2', 'x3'])
+
+    def test_unknown_priority(self):
+        order = self.runAll([('b1', BACKGROUND, None), ('u1', 42, None)])
+        self.assertEqual(order, ['u1', 'b1'])
+
+    def test_killed_while_waiting(self):
+        ticket = self.scheduler.acquire()
+        waiting = gevent.spawn(self.scheduler.acquire, AUTOMATION, 'x')
+        gevent.sleep(0)
+        waiting.kill()
+
+        self.assertEqual(self.scheduler.depth(), 0)
+        self.scheduler.release(ticket)
+        self.assertTrue(self.scheduler.current is None)
+
+    def test_stats(self):
+        self.runAll([('a1', AUTOMATION, None), ('a2', AUTOMATION, None), ('i1', INTERACTIVE, None)])
+        stats = self.scheduler.getStats()
+
+        self.assertEqual(stats['automation']['commands'], 3)
+        self.assertEqual(stats['automation']['max_depth'], 2)
+        self.assertEqual(stats['interactive']['commands'], 1)
+        self.assertEqual(stats['background']['commands'], 0)
+        self.assertEqual(stats['automation']['depth'], 0)
+
+
+class TestScheduledCommands(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.commands['f'] = self.f
+        self.connection = self.spec.connect()
+        self.connection.setCommandScheduling(True)
+        self.running = 0
+        self.maxRunning = 0
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def f(self, command):
+        self.running += 1
+        self.maxRunning = max(self.maxRunning, self.running)
+        gevent.sleep(0.01)
+        self.running -= 1
+        return command
+
+    def test_order(self):
+        command = SpecCommand.SpecCommandA('f', self.connection)
+        first = command('first', priority = BACKGROUND)
+        gevent.sleep(0.001)
+        calls = [command('b', priority = BACKGROUND), command('a', priority = AUTOMATION), command('i', priority = INTERACTIVE)]
+        gevent.joinall([first] + calls, timeout = 1, raise_error = True)
+
+        sent = [message.data.split(SpecMessage.NULL)[1] for message in self.spec.messages(SpecMessage.FUNC_WITH_RETURN)]
+        self.assertEqual(sent, ["'first'", "'i'", "'a'", "'b'"])
+        self.assertEqual(self.maxRunning, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
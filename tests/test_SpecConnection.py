@@ -0,0 +1,228 @@
+import gc
+import weakref
+import unittest
+import gevent
+
+import SpecClient
+from SpecClient import SpecMessage
+from SpecClient import SpecEventsDispatcher
+
+from SimulatedSpec import SimulatedSpec
+
+
+class TestWriteCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.connection = self.spec.connect()
+        self.connection.setWriteCoalescing(True)
+
+    def tearDown(self):
+        self.connection.setWriteCoalescing(False)
+        self.spec.stop()
+
+    def writes(self):
+        return [(message.name, message.data) for message in self.spec.messages(SpecMessage.CHAN_SEND)]
+
+    def test_last_value(self):
+        for value in range(5):
+            self.connection.send_msg_chan_send('var/x', value)
+        self.connection.send_msg_chan_send('var/y', 1)
+        self.connection.send_msg_chan_send('var/x', 5)
+        gevent.sleep(0.05)
+
+        self.assertEqual(self.writes(), [('var/y', 1), ('var/x', 5)])
+
+    def test_message_order(self):
+        self.connection.send_msg_chan_send('var/x', 1)
+        self.connection.send_msg_register('var/x')
+        gevent.sleep(0.05)
+
+        self.assertEqual(self.writes(), [('var/x', 1)])
+        self.assertEqual(self.spec.messages(SpecMessage.REGISTER)[-1].name, 'var/x')
+        self.assertTrue(self.spec.received.index(self.spec.messages(SpecMessage.CHAN_SEND)[0]) < self.spec.received.index(self.spec.messages(SpecMessage.REGISTER)[-1]))
+
+    def test_discarded_on_close(self):
+        self.connection.send_msg_chan_send('var/x', 1)
+        self.connection.handle_close()
+
+        self.assertEqual(len(self.connection.pendingWrites), 0)
+        gevent.sleep(0.05)
+        self.assertEqual(self.writes(), [])
+
+
+class TestChannelPool(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.values['var/x'] = 1
+        self.connection = self.spec.connect()
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def test_same_object(self):
+        channel = self.connection.getChannel('var/x')
+        self.assertTrue(self.connection.getChannel('var/x') is channel)
+        self.assertFalse(channel.registered)
+        self.assertEqual(channel.read(), 1)
+
+    def test_registered_channel(self):
+        temporary = self.connection.getChannel('var/x')
+        registered = self.connection.addChannel('var/x')
+
+        self.assertFalse(registered is temporary)
+        self.assertTrue(self.connection.getChannel('var/x') is registered)
+
+    def test_bounded(self):
+        first = weakref.ref(self.connection.getChannel('var/first'))
+        kept = self.connection.getChannel('var/kept')
+
+        for i in range(self.connection.recentChannels.maxlen):
+            self.connection.getChannel('var/c%d' % i)
+        gc.collect()
+
+        # the least recent channel is released, unless referenced
+        self.assertTrue(first() is None)
+        self.assertTrue(self.connection.getChannel('var/kept') is kept)
+        self.assertTrue(len(self.connection.channelPool) <= self.connection.recentChannels.maxlen + 1)
+
+
+class TestDeadbandSubscription(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.values['var/x'] = 1.0
+        self.connection = self.spec.connect()
+        self.all = []
+        self.filtered = []
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def allChanged(self, value):
+        self.all.append(value)
+
+    def filteredChanged(self, value):
+        self.filtered.append(value)
+
+    def test_receivers(self):
+        self.connection.registerChannel('var/x', self.allChanged, dispatchMode = SpecEventsDispatcher.FIREEVENT)
+        self.connection.registerChannel('var/x', self.filteredChanged, dispatchMode = SpecEventsDispatcher.FIREEVENT, deadband = 0.5)
+        gevent.sleep(0.05)
+
+        for value in (1.1, 1.2, 2.0, 2.1):
+            self.spec.setValue('var/x', value)
+        gevent.sleep(0.05)
+
+        self.assertEqual(self.all[-4:], [1.1, 1.2, 2.0, 2.1])
+        self.assertEqual(self.filtered, [1.0, 2.0])
+
+
+class TestSubKeyChannels(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.values['var/d'] = { 'a': '1', 'b': { 'x': '2' } }
+        self.connection = self.spec.connect()
+        self.values = { 'var/d/a': [], 'var/d/b/x': [] }
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def valueChanged(self, value, chanName):
+        self.values[chanName].append(value)
+
+    def test_deleted_key(self):
+        for chanName in self.values:
+            self.connection.registerChannel(chanName, self.valueChanged, dispatchMode = SpecEventsDispatcher.FIREEVENT)
+        gevent.sleep(0.05)
+        self.assertEqual(self.values, { 'var/d/a': [1], 'var/d/b/x': [2] })
+
+        self.spec.sendEvent('var/d', { 'a': '', 'b': '' }, deleted = True)
+        gevent.sleep(0.05)
+        self.assertEqual(self.values, { 'var/d/a': [1, None], 'var/d/b/x': [2, None] })
+        self.assertEqual(self.connection.registeredChannels['var/d/a'].value, None)
+        self.assertEqual(self.connection.registeredChannels['var/d/b/x'].value, None)
+
+        # the same values again are changes
+        self.spec.setValue('var/d', { 'a': '1', 'b': { 'x': '2' } })
+        gevent.sleep(0.05)
+        self.assertEqual(self.values, { 'var/d/a': [1, None, 1], 'var/d/b/x': [2, None, 2] })
+
+
+class TestPatterns(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.values['motor/m1/position'] = 1
+        self.spec.values['motor/m2/position'] = 2
+        self.connection = self.spec.connect()
+        self.first = []
+        self.second = []
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def firstChanged(self, chanName, value):
+        self.first.append((chanName, value))
+
+    def secondChanged(self, chanName, value):
+        self.second.append((chanName, value))
+
+    def valueChanged(self, value):
+        pass
+
+    def unregistered(self):
+        return [message.name for message in self.spec.messages(SpecMessage.UNREGISTER)]
+
+    def test_initial_values(self):
+        self.connection.registerPattern('motor/*/position', self.firstChanged, names = ['m1', 'm2'], dispatchMode = SpecEventsDispatcher.FIREEVENT)
+        gevent.sleep(0.05)
+        self.assertEqual(sorted(self.first), [('motor/m1/position', 1), ('motor/m2/position', 2)])
+
+        # only the new receiver gets the values already received
+        self.connection.registerPattern('motor/*/position', self.secondChanged, names = ['m1'], dispatchMode = SpecEventsDispatcher.FIREEVENT)
+        gevent.sleep(0.05)
+        self.assertEqual(len(self.first), 2)
+        self.assertEqual(sorted(self.second), [('motor/m1/position', 1), ('motor/m2/position', 2)])
+
+        self.spec.setValue('motor/m2/position', 3)
+        gevent.sleep(0.05)
+        self.assertEqual(self.first[-1], ('motor/m2/position', 3))
+        self.assertEqual(self.second[-1], ('motor/m2/position', 3))
+
+    def test_unregister(self):
+        self.connection.registerPattern('motor/*/position', self.firstChanged, names = ['m1', 'm2', 'm3'])
+        self.connection.registerPattern('motor/*/position', self.secondChanged)
+        self.connection.registerPattern('motor/m3/*', self.secondChanged)
+        self.connection.registerChannel('motor/m2/position', self.valueChanged)
+        gevent.sleep(0.05)
+
+        # other receivers remain
+        self.connection.unregisterPattern('motor/*/position', self.firstChanged)
+        gevent.sleep(0.05)
+        self.assertEqual(self.unregistered(), [])
+
+        self.connection.unregisterPattern('motor/*/position')
+        gevent.sleep(0.05)
+        # m2 has a receiver slot, m3 matches another pattern
+        self.assertEqual(self.unregistered(), ['motor/m1/position'])
+        self.assertFalse('motor/m1/position' in self.connection.registeredChannels)
+        self.assertTrue('motor/m2/position' in self.connection.registeredChannels)
+        self.assertTrue('motor/m3/position' in self.connection.registeredChannels)
+
+        self.spec.setValue('motor/m1/position', 5)
+        gevent.sleep(0.05)
+        self.assertFalse(('motor/m1/position', 5) in self.first + self.second)
+
+    def test_unregister_subkeys(self):
+        self.spec.values['var/data'] = { 'a': '1', 'b': '2' }
+        self.connection.registerPattern('var/data/*', self.firstChanged, names = ['a', 'b'])
+        gevent.sleep(0.05)
+        self.assertEqual(sorted(self.first), [('var/data/a', 1), ('var/data/b', 2)])
+
+        self.connection.unregisterPattern('var/data/*')
+        gevent.sleep(0.05)
+        self.assertEqual(self.unregistered(), ['var/data'])
+        self.assertEqual([name for name in self.connection.registeredChannels if name.startswith('var/data')], [])
+        self.assertEqual(self.connection.registeredSubkeys, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
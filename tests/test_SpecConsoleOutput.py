@@ -0,0 +1,111 @@
+import unittest
+import gevent
+
+import SpecClient
+from SpecClient import SpecConsoleOutput
+from SpecClient import SpecEventsDispatcher
+
+from SimulatedSpec import SimulatedSpec
+
+
+class TestConsoleOutput(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.commands['f'] = self.f
+        self.connection = self.spec.connect()
+        self.received = []
+        self.console = self.newConsole()
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def newConsole(self, **kwargs):
+        console = SpecConsoleOutput.SpecConsoleOutput(self.spec.specVersion, interval = 0.05, **kwargs)
+        SpecEventsDispatcher.connect(console, 'linesReceived', self.linesReceived)
+        gevent.sleep(0.02)
+        return console
+
+    def linesReceived(self, lines):
+        self.received.append(lines)
+
+    def f(self, command):
+        self.output('running\ndone')
+        return 1
+
+    def output(self, text):
+        self.spec.setValue('output/tty', text)
+
+    def test_lines(self):
+        self.output('a\nb')
+        self.output('c\nd\n')
+        gevent.sleep(0.1)
+
+        # one batch of complete lines
+        self.assertEqual(self.received, [['a', 'bc', 'd']])
+        self.assertEqual(self.console.getLines(), ['a', 'bc', 'd'])
+        self.assertEqual(self.console.getLines(1), ['d'])
+
+    def test_long_line(self):
+        self.output('x' * (SpecConsoleOutput.MAX_LINE_LENGTH + 1))
+        gevent.sleep(0.1)
+        self.assertEqual(self.console.getLines(), ['x' * SpecConsoleOutput.MAX_LINE_LENGTH, 'x'])
+
+    def test_bounded(self):
+        console = self.newConsole(size = 3)
+        self.received = []
+        self.output('\n'.join(map(str, range(5))) + '\n')
+        gevent.sleep(0.1)
+
+        self.assertEqual(console.getLines(), ['2', '3', '4'])
+        self.assertEqual(console.droppedLines, 2)
+        self.assertTrue(['2', '3', '4'] in self.received)
+
+    def test_no_replay(self):
+        self.output('old\n')
+        gevent.sleep(0.1)
+        self.received = []
+
+        # registering again does not give the old output as new lines
+        other = self.newConsole()
+        self.console._connected()
+        gevent.sleep(0.1)
+
+        self.assertEqual(self.received, [])
+        self.assertEqual(other.getLines(), [])
+        self.assertEqual(self.console.getLines(), ['old'])
+
+    def test_capture(self):
+        self.output('before\n')
+        gevent.sleep(0.1)
+        with self.console.capture() as capture:
+            self.output('a\nb\nc')
+            gevent.sleep(0.1)
+        self.output('\nafter\n')
+        gevent.sleep(0.1)
+
+        self.assertEqual(list(capture.lines), ['a', 'b', 'c'])
+        self.assertEqual(capture.getText(), 'a\nb\nc')
+
+        with self.console.capture(size = 2) as capture:
+            self.output('1\n2\n3\n')
+            gevent.sleep(0.1)
+        self.assertEqual(list(capture.lines), ['2', '3'])
+        self.assertEqual(capture.dropped, 1)
+
+    def test_execute(self):
+        capture = self.console.execute('f')
+        self.assertEqual(capture.result, 1)
+        self.assertEqual(list(capture.lines), ['running', 'done'])
+
+    def test_execute_error(self):
+        del self.spec.commands['f']
+        try:
+            self.console.execute('f')
+        except SpecClient.SpecClientError.SpecClientError, err:
+            self.assertTrue(isinstance(err.output, SpecConsoleOutput.SpecOutputCapture))
+        else:
+            self.fail('no SpecClientError')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import time
+import logging
+import unittest
+import gevent
+
+import SpecClient
+from SpecClient import SpecEventsDispatcher
+
+
+class Sender:
+    pass
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestSlotExecutor(unittest.TestCase):
+    def setUp(self):
+        self.sender = Sender()
+        self.got = []
+
+    def slot(self, value):
+        self.got.append(value)
+
+    def emitValues(self, values):
+        for value in values:
+            SpecEventsDispatcher.emit(self.sender, 'changed', (value, ))
+
+    def test_not_inline(self):
+        executor = SpecEventsDispatcher.SlotExecutor()
+        SpecEventsDispatcher.connect(self.sender, 'changed', self.slot, executor = executor)
+
+        self.emitValues([1])
+        self.assertEqual(self.got, [])
+
+        executor.join(1)
+        self.assertEqual(self.got, [1])
+
+    def test_drop_oldest(self):
+        executor = SpecEventsDispatcher.SlotExecutor(maxQueueSize = 2, queuePolicy = SpecEventsDispatcher.DROP_OLDEST)
+        SpecEventsDispatcher.connect(self.sender, 'changed', self.slot, executor = executor)
+
+        self.emitValues(range(5))
+        executor.join(1)
+
+        self.assertEqual(self.got, [3, 4])
+        self.assertEqual(executor.dropped, 3)
+
+    def test_coalesce(self):
+        executor = SpecEventsDispatcher.SlotExecutor(queuePolicy = SpecEventsDispatcher.COALESCE)
+        other = []
+        def otherSlot(value):
+            other.append(value)
+        SpecEventsDispatcher.connect(self.sender, 'changed', self.slot, executor = executor)
+        SpecEventsDispatcher.connect(self.sender, 'changed', otherSlot, executor = executor)
+
+        self.emitValues(range(5))
+        executor.join(1)
+
+        # one call per receiver, with the last value
+        self.assertEqual(self.got, [4])
+        self.assertEqual(other, [4])
+        self.assertEqual(executor.dropped, 0)
+
+    def test_block(self):
+        executor = SpecEventsDispatcher.SlotExecutor(maxQueueSize = 1, queuePolicy = SpecEventsDispatcher.BLOCK)
+        SpecEventsDispatcher.connect(self.sender, 'changed', self.slot, executor = executor)
+
+        emitter = gevent.spawn(self.emitValues, range(5))
+        emitter.join(1)
+        executor.join(1)
+
+        self.assertTrue(emitter.successful())
+        self.assertEqual(self.got, range(5))
+        self.assertEqual(executor.dropped, 0)
+
+    def test_slow_slot(self):
+        executor = SpecEventsDispatcher.SlotExecutor(size = 1)
+        def slowSlot(value):
+            gevent.sleep(0.05)
+        SpecEventsDispatcher.connect(self.sender, 'changed', slowSlot, executor = executor)
+        SpecEventsDispatcher.connect(self.sender, 'changed', self.slot)
+
+        t0 = time.time()
+        self.emitValues([1])
+
+        # the inline slot is not delayed by the slow one
+        self.assertEqual(self.got, [1])
+        self.assertTrue(time.time() - t0 < 0.05)
+        executor.join(1)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, SpecEventsDispatcher.SlotExecutor, queuePolicy = 'unknown')
+
+    def test_back_to_back_emits(self):
+        executor = SpecEventsDispatcher.SlotExecutor(size = 1, queuePolicy = SpecEventsDispatcher.DROP_OLDEST)
+        sender = Sender()
+        got = []
+
+        def slot(value):
+            got.append(value)
+
+        SpecEventsDispatcher.connect(sender, 'changed', slot, executor = executor)
+
+        SpecEventsDispatcher.emit(sender, 'changed', (1, ))
+        # the worker runs and finishes, but the pool forgets it later
+        gevent.sleep(0)
+        SpecEventsDispatcher.emit(sender, 'changed', (2, ))
+        gevent.sleep(0.01)
+
+        self.assertEqual(got, [1, 2])
+        self.assertEqual(len(executor.queue), 0)
+        self.assertEqual(executor.workers, 0)
+
+
+class TestBlockingThreshold(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("SpecClient")
+        self.level = self.logger.level
+        self.handler = RecordingHandler()
+        self.logger.setLevel(logging.WARNING)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        SpecEventsDispatcher.setBlockingThreshold(None)
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+
+    def test_blocking_slot(self):
+        sender = Sender()
+        def slowSlot():
+            time.sleep(0.02)
+        def fastSlot():
+            pass
+        SpecEventsDispatcher.connect(sender, 'changed', slowSlot)
+        SpecEventsDispatcher.connect(sender, 'changed', fastSlot)
+
+        SpecEventsDispatcher.setBlockingThreshold(0.01)
+        SpecEventsDispatcher.emit(sender, 'changed')
+
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue('slowSlot' in self.handler.messages[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
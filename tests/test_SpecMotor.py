@@ -0,0 +1,83 @@
+import unittest
+import gevent.event
+
+import SpecClient
+from SpecClient import SpecConnectionsManager
+from SpecClient import SpecEventsDispatcher
+from SpecClient import SpecMotor
+
+SPEC_VERSION = 'fake:motor'
+
+
+class FakeChannel:
+    def __init__(self, connection, chanName):
+        self.connection = connection
+        self.name = chanName
+
+    def read(self, timeout = None, force_read = False):
+        self.connection.reads.append(self.name)
+        return self.connection.values.get(self.name)
+
+    def write(self, value, wait = False):
+        # Spec sends the event later
+        self.connection.values[self.name] = value
+
+
+class FakeConnection:
+    """Connection to a Spec which sends events on demand only"""
+    def __init__(self, values):
+        self.values = values
+        self.reads = []
+        self.slots = {}
+        self.connected_event = gevent.event.Event()
+        self.connected_event.set()
+
+    def isSpecConnected(self):
+        return True
+
+    def registerChannel(self, chanName, receiverSlot, **kwargs):
+        self.slots[chanName] = receiverSlot
+
+    def getChannel(self, chanName):
+        return FakeChannel(self, chanName)
+
+    def sendEvent(self, chanName):
+        SpecEventsDispatcher.robustApply(self.slots[chanName], (self.values[chanName], chanName))
+
+
+class TestParameters(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection({ 'motor/m/offset': 1.0, 'motor/m/sign': 1, 'motor/m/position': 3.0,
+                                           'motor/m/low_limit': -10.0, 'motor/m/high_limit': 10.0 })
+        SpecConnectionsManager.SpecConnectionsManager().connections[SPEC_VERSION] = self.connection
+
+        self.motor = SpecMotor.SpecMotor('m', SPEC_VERSION)
+        for name in ('offset', 'sign', 'position', 'low_limit', 'high_limit'):
+            self.connection.sendEvent('motor/m/%s' % name)
+
+    def tearDown(self):
+        SpecConnectionsManager.SpecConnectionsManager().closeConnection(SPEC_VERSION)
+
+    def test_received_values(self):
+        self.assertEqual(self.motor.getLimits(), (-9.0, 11.0))
+        self.assertEqual(self.motor.getDialPosition(), 2.0)
+        self.assertEqual(self.connection.reads, [])
+
+    def test_get_after_set(self):
+        self.motor.setOffset(2.0)
+        self.assertEqual(self.motor.getOffset(), 2.0)
+
+        self.motor.setParameter('sign', -1)
+        self.assertEqual(self.motor.getSign(), -1)
+        self.assertEqual(self.motor.getLimits(), (-8.0, 12.0))
+
+        # back to the received values with the events
+        self.connection.sendEvent('motor/m/offset')
+        self.connection.sendEvent('motor/m/sign')
+        del self.connection.reads[:]
+        self.assertEqual(self.motor.getLimits(), (-8.0, 12.0))
+        self.assertEqual(self.connection.reads, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import time
+import unittest
+import gevent
+import gevent.event
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import SpecClient
+from SpecClient import SpecConnectionsManager
+from SpecClient import SpecEventsDispatcher
+from SpecClient import SpecMotorGroup
+from SpecClient import SpecReply
+from SpecClient.SpecMotor import NOTINITIALIZED, READY, MOVING, ONLIMIT, LOWLIMIT
+
+from SimulatedSpec import SimulatedSpec
+
+SPEC_VERSION = 'fake:motorgroup'
+
+
+class FakeConnection:
+    """Connection to a Spec which replies at once, and does not send events"""
+    def __init__(self, values):
+        self.serverVersion = 4
+        self.registeredReplies = {}
+        self.commandScheduler = None
+        self.values = values
+        self.sent = []
+        self.connected_event = gevent.event.Event()
+        self.connected_event.set()
+
+    def isSpecConnected(self):
+        return True
+
+    def registerPattern(self, pattern, receiverSlot, names = (), dispatchMode = None):
+        pass
+
+    def readChannel(self, chanName, timeout = None):
+        return self.values.get(chanName)
+
+    def send_msg_cmd_with_return(self, command):
+        self.sent.append(command)
+        reply = SpecReply.SpecReply()
+        reply.sendTime = time.time()
+        gevent.spawn(reply.update, None, False, 0)
+        return reply
+
+
+@unittest.skipIf(numpy is None, "numpy is required for motor groups")
+class TestMove(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection({ 'motor/m0/move_done': 0, 'motor/m1/move_done': 1 })
+        SpecConnectionsManager.SpecConnectionsManager().connections[SPEC_VERSION] = self.connection
+
+        self.group = SpecMotorGroup.SpecMotorGroup(['m0', 'm1'], SPEC_VERSION)
+        for i in range(2):
+            self.group._channelUpdate('motor/m%d/position' % i, 0)
+            self.group._channelUpdate('motor/m%d/move_done' % i, 0)
+
+    def tearDown(self):
+        SpecConnectionsManager.SpecConnectionsManager().closeConnection(SPEC_VERSION)
+
+    def test_motor_not_moved(self):
+        # Spec moves m1 only, m0 is not moved and sends no event
+        self.group.move([1, 2])
+
+        self.assertEqual(len(self.connection.sent), 1)
+        self.assertEqual(self.group.getState('m0'), READY)
+        self.assertEqual(self.group.getState('m1'), MOVING)
+
+        self.assertRaises(SpecClient.SpecClientError.SpecClientTimeoutError, self.group.waitMove, None, 0.01)
+        self.group.waitMove([0], 0.01)
+
+    def test_motors_not_to_move(self):
+        for positions in ([numpy.nan, 2], [None, 2], { 'm0': numpy.nan, 'm1': 2 }, { 'm0': None, 'm1': 2 }):
+            self.group.data[1, SpecMotorGroup.POSITION] = 0
+            self.assertEqual(list(self.group.move(positions)), [1])
+            self.assertEqual(self.connection.sent[-1], 'get_angles; A[m1]=2.0; move_em')
+
+        self.assertEqual(list(self.group.move({ 'm0': None })), [])
+        self.assertEqual(len(self.connection.sent), 4)
+
+
+@unittest.skipIf(numpy is None, "numpy is required for motor groups")
+class TestGroup(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        for i in range(3):
+            for parameter, value in (('position', i), ('move_done', 0), ('low_limit', -10), ('high_limit', 10), ('offset', 0), ('sign', 1)):
+                self.spec.values['motor/m%d/%s' % (i, parameter)] = value
+        self.spec.values['motor/m2/sign'] = -1
+        self.spec.values['motor/m2/offset'] = 5
+        self.spec.connect()
+
+        self.group = SpecMotorGroup.SpecMotorGroup(['m0', 'm1', 'm2'], self.spec.specVersion, interval = 0.05)
+        gevent.sleep(0.1)
+
+        self.signals = []
+        for signal in ('positionsChanged', 'statesChanged', 'limitsChanged'):
+            SpecEventsDispatcher.connect(self.group, signal, getattr(self, signal))
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def positionsChanged(self, indexes, positions):
+        self.signals.append(('positionsChanged', list(indexes), list(positions)))
+
+    def statesChanged(self, indexes, states):
+        self.signals.append(('statesChanged', list(indexes), list(states)))
+
+    def limitsChanged(self, indexes):
+        self.signals.append(('limitsChanged', list(indexes)))
+
+    def test_initial_values(self):
+        self.assertEqual(list(self.group.getPositions()), [0, 1, 2])
+        self.assertEqual(list(self.group.getStates()), [READY] * 3)
+        self.assertEqual(self.group.getPosition('m1'), 1)
+        self.assertEqual(self.group.index('m2'), 2)
+
+    def test_batched_signals(self):
+        self.spec.setValue('motor/m0/move_done', 1)
+        self.spec.setValue('motor/m2/move_done', 1)
+        self.spec.setValue('motor/m0/position', 0.5)
+        self.spec.setValue('motor/m2/position', 2.5)
+        self.spec.setValue('motor/m2/position', 3)
+        # within the deadband
+        self.spec.setValue('motor/m1/position', 1 + 1E-7)
+        gevent.sleep(0.1)
+
+        self.assertEqual(sorted(self.signals), [('positionsChanged', [0, 2], [0.5, 3]), ('statesChanged', [0, 2], [MOVING, MOVING])])
+        self.assertEqual(self.group.getPosition('m1'), 1)
+
+    def test_limit_hit(self):
+        self.spec.setValue('motor/m1/move_done', 1)
+        self.spec.setValue('motor/m1/low_lim_hit', 1)
+        gevent.sleep(0.1)
+
+        self.assertEqual(self.group.getState('m1'), ONLIMIT)
+        self.assertEqual(int(self.group.data[1, SpecMotorGroup.LIMIT_HIT]), LOWLIMIT)
+        self.assertRaises(SpecClient.SpecClientError.SpecClientError, self.group.waitMove, None, 1)
+
+    def test_limits(self):
+        low, high = self.group.getLimits()
+        self.assertEqual(list(low), [-10, -10, -5])
+        self.assertEqual(list(high), [10, 10, 15])
+
+        self.spec.setValue('motor/m0/high_limit', 20)
+        gevent.sleep(0.1)
+        self.assertEqual(self.signals, [('limitsChanged', [0])])
+        self.assertEqual(self.group.getLimits()[1][0], 20)
+
+    def test_snapshot(self):
+        snapshot = self.group.getSnapshot()
+        self.spec.setValue('motor/m0/position', 5)
+        gevent.sleep(0.1)
+
+        self.assertEqual(snapshot[0, SpecMotorGroup.POSITION], 0)
+        self.assertEqual(self.group.getSnapshot()[0, SpecMotorGroup.POSITION], 5)
+
+    def test_disconnected(self):
+        self.spec.stop()
+        gevent.sleep(0.1)
+        self.assertEqual(list(self.group.getStates()), [NOTINITIALIZED] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
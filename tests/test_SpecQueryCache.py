@@ -0,0 +1,88 @@
+import unittest
+import gevent
+
+import SpecClient
+from SpecClient.SpecQueryCache import idempotent
+
+from SimulatedSpec import SimulatedSpec
+
+
+class Queries:
+    def __init__(self, connection, specName = None):
+        self.connection = connection
+        self.specName = specName
+        self.calls = 0
+
+    @idempotent
+    def getConfig(self, *args):
+        self.calls += 1
+        return { 'args': list(args), 'calls': self.calls }
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.values['var/CONFIG_COUNT'] = 1
+        self.connection = self.spec.connect()
+        self.queries = Queries(self.connection, 'phi')
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def test_memoised(self):
+        result = self.queries.getConfig(1)
+        self.assertEqual(result, { 'args': [1], 'calls': 1 })
+
+        # a copy of the stored result is returned
+        result['args'].append(2)
+        self.assertEqual(self.queries.getConfig(1), { 'args': [1], 'calls': 1 })
+        self.assertEqual(self.queries.getConfig(2)['calls'], 2)
+        self.assertEqual(self.queries.calls, 2)
+
+        stats = self.connection.getStats()
+        self.assertEqual((stats['query_cache_size'], stats['query_cache_hits'], stats['query_cache_misses']), (2, 1, 2))
+
+    def test_spec_name(self):
+        other = Queries(self.connection, 'chi')
+        self.queries.getConfig()
+        other.getConfig()
+        self.assertEqual((self.queries.calls, other.calls), (1, 1))
+
+        self.connection.queryCache.invalidate('getConfig', 'chi')
+        self.queries.getConfig()
+        other.getConfig()
+        self.assertEqual((self.queries.calls, other.calls), (1, 2))
+
+    def test_not_connected(self):
+        self.spec.stop()
+        gevent.sleep(0.05)
+        self.assertFalse(self.connection.isSpecConnected())
+
+        self.queries.getConfig()
+        self.queries.getConfig()
+        self.assertEqual(self.queries.calls, 2)
+
+    def test_disconnection(self):
+        self.queries.getConfig()
+        self.connection.handle_close()
+        self.assertEqual(len(self.connection.queryCache.entries), 0)
+
+    def test_config_change(self):
+        self.connection.setConfigChangeChannel('var/CONFIG_COUNT')
+        gevent.sleep(0.05)
+        self.queries.getConfig()
+
+        self.spec.setValue('var/CONFIG_COUNT', 2)
+        gevent.sleep(0.05)
+        self.queries.getConfig()
+        self.assertEqual(self.queries.calls, 2)
+
+        self.connection.setConfigChangeChannel(None)
+        self.spec.setValue('var/CONFIG_COUNT', 3)
+        gevent.sleep(0.05)
+        self.queries.getConfig()
+        self.assertEqual(self.queries.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
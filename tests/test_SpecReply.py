@@ -0,0 +1,33 @@
+import unittest
+import gevent
+
+import SpecClient
+from SpecClient import SpecReply
+from SpecClient.SpecClientError import SpecClientError, SpecClientTimeoutError
+
+
+class TestReplyWait(unittest.TestCase):
+    def test_timeout(self):
+        reply = SpecReply.SpecReply()
+        self.assertRaises(SpecClientTimeoutError, reply.wait, 0.01)
+
+    def test_none_value(self):
+        reply = SpecReply.SpecReply()
+        gevent.spawn_later(0.01, reply.update, None, False, 0)
+        self.assertEqual(reply.wait(1), None)
+
+    def test_error(self):
+        reply = SpecReply.SpecReply()
+        reply.update('syntax error', True, 1)
+        try:
+            reply.wait(1)
+        except SpecClientTimeoutError:
+            self.fail('error reply reported as a timeout')
+        except SpecClientError:
+            pass
+        else:
+            self.fail('error reply not raised')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import gevent
+
+import SpecClient
+from SpecClient import SpecWaitObject
+from SpecClient.SpecClientError import SpecClientTimeoutError
+
+from SimulatedSpec import SimulatedSpec
+
+
+class TestWaitChannels(unittest.TestCase):
+    def setUp(self):
+        self.spec = SimulatedSpec()
+        self.spec.values['var/x'] = 1
+        self.spec.values['var/y'] = 1
+        self.connection = self.spec.connect()
+
+    def tearDown(self):
+        self.spec.stop()
+
+    def setLater(self, chanName, value, delay = 0.02):
+        gevent.spawn_later(delay, self.spec.setValue, chanName, value)
+
+    def assertNoWaiter(self, *chanNames):
+        for chanName in chanNames:
+            self.assertEqual(self.connection.registeredChannels[chanName].waiters, [])
+
+    def test_wait_for(self):
+        self.setLater('var/x', 2)
+        self.setLater('var/x', 3, 0.04)
+        self.assertEqual(SpecWaitObject.waitFor('var/x', self.connection, lambda value: value >= 3, timeout = 1), 3)
+        self.assertNoWaiter('var/x')
+
+    def test_current_value(self):
+        self.assertEqual(SpecWaitObject.waitFor('var/x', self.connection, lambda value: value == 1, timeout = 1), 1)
+
+        # the current value is ignored with checkCurrent False, or without predicate
+        self.assertRaises(SpecClientTimeoutError, SpecWaitObject.waitFor, 'var/x', self.connection, lambda value: value == 1, 0.05, False)
+        self.assertRaises(SpecClientTimeoutError, SpecWaitObject.waitFor, 'var/y', self.connection, None, 0.05)
+
+    def test_timeout(self):
+        self.setLater('var/x', 2)
+        self.assertRaises(SpecClientTimeoutError, SpecWaitObject.waitFor, 'var/x', self.connection, lambda value: value == 5, 0.05)
+        self.assertNoWaiter('var/x')
+
+        self.assertRaises(SpecClientTimeoutError, SpecWaitObject.waitAny, ['var/x', 'var/y'], self.connection, 0.05)
+        self.assertRaises(SpecClientTimeoutError, SpecWaitObject.waitAll, { 'var/x': lambda value: value == 5, 'var/y': None }, self.connection, 0.05)
+        self.assertNoWaiter('var/x', 'var/y')
+
+    def test_wait_any(self):
+        self.setLater('var/y', 2)
+        self.assertEqual(SpecWaitObject.waitAny(['var/x', 'var/y'], self.connection, timeout = 1), ('var/y', 2))
+
+    def test_wait_all(self):
+        self.setLater('var/x', 2)
+        self.setLater('var/y', 2, 0.04)
+        # var/x stays satisfied when it changes again
+        self.setLater('var/x', 3, 0.06)
+
+        values = SpecWaitObject.waitAll({ 'var/x': lambda value: value == 2, 'var/y': None }, self.connection, timeout = 1)
+        self.assertEqual(values, { 'var/x': 2, 'var/y': 2 })
+        self.assertNoWaiter('var/x', 'var/y')
+
+    def test_predicate_error(self):
+        self.setLater('var/x', 'a')
+        self.assertRaises(ValueError, SpecWaitObject.waitFor, 'var/x', self.connection, lambda value: int(value) > 1, 1, False)
+        self.assertNoWaiter('var/x')
+
+
+if __name__ == '__main__':
+    unittest.main()